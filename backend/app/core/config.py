@@ -9,8 +9,92 @@ class Settings(BaseSettings):
     SUPABASE_URL: str
     SUPABASE_KEY: str # Service Role Key for backend operations
     
+    # Supabase HTTP connection pool
+    SUPABASE_POOL_SIZE: int = 100 # max concurrent connections per worker
+    SUPABASE_POOL_KEEPALIVE: int = 20 # idle keep-alive connections kept open
+    SUPABASE_KEEPALIVE_EXPIRY: float = 30.0 # seconds
+    SUPABASE_TIMEOUT: float = 10.0 # seconds, read/write
+    SUPABASE_CONNECT_TIMEOUT: float = 5.0 # seconds
+    SUPABASE_POOL_TIMEOUT: float = 5.0 # seconds waiting for a free connection
+    SUPABASE_HTTP2: bool = False
+    
+    # Auth (local JWT verification)
+    SUPABASE_JWT_SECRET: Optional[str] = None # Project JWT secret, for HS256-signed access tokens
+    JWT_AUDIENCE: str = "authenticated"
+    JWT_LEEWAY_SECONDS: int = 10
+    JWKS_CACHE_TTL: float = 600.0 # seconds
+    JWKS_MIN_REFRESH_SECONDS: float = 30.0 # throttle refetches triggered by unknown key ids
+    ROLE_CACHE_TTL: float = 60.0 # seconds a cached profiles.role stays valid
+    ROLE_CACHE_SIZE: int = 10000
+    ADMIN_AUTH_DISABLED: bool = False # dev only: serve /admin routes without an admin access token
+    
+    # Queue engine
+    QUEUE_STORE: str = "supabase" # "supabase" (Postgres RPCs) or "memory" (single process, state lost on restart)
+    
+    # Join admission control (per worker)
+    ADMISSION_ENABLED: bool = True
+    JOIN_MAX_CONCURRENCY: int = 8 # issue_token calls in flight per service
+    JOIN_QUEUE_LIMIT: int = 200 # joins allowed to wait for a slot, per service
+    JOIN_QUEUE_TIMEOUT: float = 2.0 # seconds a join waits for a slot before 429
+    JOIN_RATE_PER_USER: float = 0.5 # join attempts per second per user (token bucket refill)
+    JOIN_BURST_PER_USER: int = 3
+    JOIN_RATE_CACHE_SIZE: int = 100000 # users tracked by the rate limiter
+    
     # Geo
     DEFAULT_PRESENCE_RADIUS: float = 100.0 # meters
+    NEAR_RADIUS_FACTOR: float = 3.0 # within factor * presence_radius counts as NEAR
+    
+    # Queue push feed (/queue/{service_id}/stream)
+    QUEUE_FEED_INTERVAL: float = 0.5 # seconds between upstream polls; bursts inside it are coalesced
+    QUEUE_STREAM_KEEPALIVE: float = 15.0 # seconds between SSE keep-alive comments
+    DEFAULT_SERVICE_TIME_SECONDS: float = 300.0 # per token, until enough samples exist
+    
+    # Wait-time estimation
+    ETA_EWMA_ALPHA: float = 0.2 # weight of the newest sample
+    ETA_WINDOW: int = 200 # recent samples kept for percentiles
+    ETA_COUNTER_ACTIVE_SECONDS: float = 1800.0 # counters idle longer are not counted as serving
+    
+    # Counter auto-dispatch (background task)
+    AUTO_DISPATCH_ENABLED: bool = True # call confirmed tokens to idle counters without call-next
+    DISPATCH_INTERVAL_SECONDS: float = 5.0 # retry for services with confirmed tokens but no idle counter
+    DISPATCH_HINT_TTL: float = 5.0 # seconds a "no idle counter" result suppresses dispatches
+    
+    # Stale token sweeper (background task)
+    SWEEPER_ENABLED: bool = True
+    SWEEP_INTERVAL_SECONDS: float = 60.0
+    SWEEP_BATCH_SIZE: int = 500
+    WAITING_TIMEOUT_SECONDS: int = 4 * 3600 # unconfirmed tokens older than this expire
+    CALLED_TIMEOUT_SECONDS: int = 300 # called tokens not started within this are missed
+    ARCHIVE_ENABLED: bool = True # move finished tokens to tokens_history on each sweep
+    ARCHIVE_AFTER_SECONDS: int = 6 * 3600 # finished tokens issued longer ago than this are archived
+    ARCHIVE_BATCH_SIZE: int = 1000
+    
+    # Bulk admin operations (/admin/bulk-cancel, /admin/bulk-complete)
+    BULK_MAX_TOKENS: int = 1000 # tokens moved per call
+    
+    # Token transition log (token_events; the database triggers write it for the Supabase engine)
+    TRANSITION_LOG_ENABLED: bool = True # buffer and flush the in-memory engine's transitions
+    TRANSITION_LOG_FLUSH_SECONDS: float = 1.0 # max time an event waits in the buffer
+    TRANSITION_LOG_BATCH_SIZE: int = 500 # rows per insert; a full batch is flushed at once
+    TRANSITION_LOG_MAX_BUFFER: int = 100000 # events kept while the database is unreachable; oldest dropped beyond
+    
+    # In-process caches
+    SERVICE_CACHE_TTL: float = 60.0 # seconds a cached service geometry stays valid
+    SERVICE_CACHE_SIZE: int = 10000
+    TOKEN_SERVICE_CACHE_SIZE: int = 100000
+    LIST_CACHE_TTL: float = 10.0 # seconds a cached organization/service list page stays valid
+    LIST_CACHE_SIZE: int = 2000
+    IDEMPOTENCY_TTL: float = 600.0 # seconds a response stays replayable for its Idempotency-Key
+    IDEMPOTENCY_CACHE_SIZE: int = 50000
+    
+    # Nearby-services spatial index (/services/nearby)
+    NEARBY_INDEX_ENABLED: bool = True # build at startup and rebuild periodically; else built on first query
+    NEARBY_REFRESH_SECONDS: float = 300.0 # full rebuild interval, picks up out-of-band edits and deletions
+    NEARBY_CELL_DEGREES: float = 0.02 # grid cell size, ~2.2 km of latitude
+    NEARBY_MAX_RADIUS: float = 50000.0 # meters
+    
+    # Metrics (/metrics, Prometheus text format)
+    METRICS_ENABLED: bool = True
     
     class Config:
         env_file = ".env"
@@ -1,8 +1,72 @@
-from supabase import create_client, Client
+from typing import Optional
+
+import httpx
+from supabase import AsyncClient, AsyncClientOptions, acreate_client
 from app.core.config import settings
+from app.core.metrics import InstrumentedTransport
+
+# Shared async Supabase client. Created once in the app lifespan so every
+# request reuses the same pooled keep-alive connections instead of blocking
+# the event loop on synchronous HTTP.
+_http_client: Optional[httpx.AsyncClient] = None
+_supabase: Optional[AsyncClient] = None
+
+def _build_http_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.SUPABASE_POOL_SIZE,
+        max_keepalive_connections=settings.SUPABASE_POOL_KEEPALIVE,
+        keepalive_expiry=settings.SUPABASE_KEEPALIVE_EXPIRY,
+    )
+    # Every table/rpc execution goes through this transport, which records its latency
+    transport_cls = InstrumentedTransport if settings.METRICS_ENABLED else httpx.AsyncHTTPTransport
+    return httpx.AsyncClient(
+        transport=transport_cls(limits=limits, http2=settings.SUPABASE_HTTP2),
+        timeout=httpx.Timeout(
+            settings.SUPABASE_TIMEOUT,
+            connect=settings.SUPABASE_CONNECT_TIMEOUT,
+            pool=settings.SUPABASE_POOL_TIMEOUT,
+        ),
+        follow_redirects=True,
+    )
+
+async def init_supabase() -> AsyncClient:
+    """
+    Creates the shared async client and its connection pool.
+    Called from the app lifespan on startup.
+    """
+    global _http_client, _supabase
+    if _supabase is None:
+        _http_client = _http_client or _build_http_client()
+        _supabase = await acreate_client(
+            settings.SUPABASE_URL,
+            settings.SUPABASE_KEY,
+            options=AsyncClientOptions(httpx_client=_http_client),
+        )
+    return _supabase
+
+async def close_supabase() -> None:
+    """
+    Closes the pooled HTTP connections. Called from the app lifespan on shutdown.
+    """
+    global _http_client, _supabase
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _supabase = None
 
-# Initialize Supabase Client
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+def get_http_client() -> httpx.AsyncClient:
+    """
+    The pooled HTTP client, for direct calls to Supabase endpoints (e.g. JWKS).
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = _build_http_client()
+    return _http_client
 
-def get_supabase() -> Client:
-    return supabase
+async def get_supabase() -> AsyncClient:
+    """
+    FastAPI dependency returning the shared async Supabase client.
+    """
+    if _supabase is None:
+        return await init_supabase()
+    return _supabase
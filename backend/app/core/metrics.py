@@ -0,0 +1,171 @@
+import bisect
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+# ASGI scope of the request being handled; the route template is read from it lazily
+# (routing happens after the middleware) so DB calls can be attributed to a route
+_current_scope: ContextVar[Optional[dict]] = ContextVar("current_scope", default=None)
+
+INF_LABEL = 'le="+Inf"'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Histogram:
+    """
+    Minimal Prometheus histogram. observe() is a bisect plus two additions.
+    """
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        self.series: Dict[Tuple[str, ...], list] = {} # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, INF_LABEL)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {series[-1]}")
+        return "\n".join(lines)
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.series: Dict[Tuple[str, ...], int] = {}
+
+    def inc(self, *labels: str) -> None:
+        self.series[labels] = self.series.get(labels, 0) + 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.series.items():
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return "\n".join(lines)
+
+http_request_duration = Histogram(
+    "queueless_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status")
+)
+http_request_errors = Counter(
+    "queueless_http_request_errors_total", "HTTP requests that failed, by route and error class.", ("method", "route", "error")
+)
+db_call_duration = Histogram(
+    "queueless_db_call_duration_seconds", "Supabase call latency by operation and calling route.", ("operation", "route")
+)
+db_call_errors = Counter(
+    "queueless_db_call_errors_total", "Failed Supabase calls by operation, calling route and error class.", ("operation", "route", "error")
+)
+admission_rejections = Counter(
+    "queueless_admission_rejections_total", "Requests refused by admission control, by route and reason.", ("route", "reason")
+)
+
+REGISTRY = (http_request_duration, http_request_errors, db_call_duration, db_call_errors, admission_rejections)
+
+def render_metrics() -> str:
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+def route_label(scope: Optional[dict]) -> str:
+    """
+    Route template (e.g. /api/v1/queue/{service_id}/eta-stats) rather than the raw
+    path, so label cardinality stays bounded.
+    """
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no response buffering, safe for SSE) recording latency per route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+        error = None
+        token = _current_scope.set(scope)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            route = route_label(scope)
+            http_request_duration.observe(time.perf_counter() - started, scope["method"], route, str(status))
+            if error is None and status >= 400:
+                error = f"{status // 100}xx"
+            if error is not None:
+                http_request_errors.inc(scope["method"], route, error)
+            _current_scope.reset(token)
+
+def _operation(request: httpx.Request) -> str:
+    path = request.url.path
+    if "/rest/v1/rpc/" in path:
+        return "rpc:" + path.rsplit("/", 1)[-1]
+    if "/rest/v1/" in path:
+        return f"{request.method} table:{path.rsplit('/', 1)[-1]}"
+    if "/auth/v1/" in path:
+        return "auth:" + path.split("/auth/v1/", 1)[1]
+    return f"{request.method} other"
+
+class InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """
+    httpx transport recording every Supabase call (table and rpc executions) with the calling route.
+    """
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        operation = _operation(request)
+        route = route_label(_current_scope.get())
+        try:
+            response = await super().handle_async_request(request)
+        except Exception as e:
+            db_call_duration.observe(time.perf_counter() - started, operation, route)
+            db_call_errors.inc(operation, route, type(e).__name__)
+            raise
+        db_call_duration.observe(time.perf_counter() - started, operation, route)
+        if response.status_code >= 400:
+            db_call_errors.inc(operation, route, str(response.status_code))
+        return response
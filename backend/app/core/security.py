@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+import jwt
+from fastapi import Depends, Header, HTTPException
+from pydantic import BaseModel
+from supabase import AsyncClient
+from app.core.config import settings
+from app.core.database import get_supabase, get_http_client
+from app.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class InvalidTokenError(Exception):
+    pass
+
+class VerificationUnavailable(InvalidTokenError):
+    """
+    The token cannot be checked locally (no secret configured / signing key not published).
+    """
+
+class AuthenticatedUser(BaseModel):
+    id: str
+    email: Optional[str] = None
+    role: str
+
+class JWKSCache:
+    """
+    Supabase signing keys by `kid`, refreshed every JWKS_CACHE_TTL seconds or when an
+    unknown `kid` shows up (key rotation), at most once per JWKS_MIN_REFRESH_SECONDS.
+    """
+
+    def __init__(self):
+        self.keys: Dict[str, jwt.PyJWK] = {}
+        self.fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"{settings.SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json"
+
+    async def _refresh(self) -> None:
+        res = await get_http_client().get(self.url, headers={"apikey": settings.SUPABASE_KEY})
+        res.raise_for_status()
+        keys = {}
+        for data in res.json().get("keys", []):
+            try:
+                keys[data["kid"]] = jwt.PyJWK(data)
+            except (KeyError, jwt.PyJWKError):
+                continue
+        self.keys = keys
+        self.fetched_at = time.monotonic()
+
+    async def get(self, kid: str) -> Optional[jwt.PyJWK]:
+        age = time.monotonic() - self.fetched_at
+        if kid in self.keys and age < settings.JWKS_CACHE_TTL:
+            return self.keys[kid]
+        async with self._lock:
+            age = time.monotonic() - self.fetched_at
+            if age >= settings.JWKS_CACHE_TTL or (kid not in self.keys and age >= settings.JWKS_MIN_REFRESH_SECONDS):
+                try:
+                    await self._refresh()
+                except Exception as e:
+                    # Keep serving the previous keys; retry after the throttle window
+                    logger.warning("JWKS refresh failed: %s", e)
+                    self.fetched_at = time.monotonic() - settings.JWKS_CACHE_TTL + settings.JWKS_MIN_REFRESH_SECONDS
+        return self.keys.get(kid)
+
+jwks_cache = JWKSCache()
+
+# user_id -> profiles.role
+role_cache = TTLCache(maxsize=settings.ROLE_CACHE_SIZE, ttl=settings.ROLE_CACHE_TTL)
+
+async def verify_access_token(token: str) -> dict:
+    """
+    Verifies a Supabase access token locally and returns its claims.
+    HS256 tokens use SUPABASE_JWT_SECRET; asymmetric tokens use the cached JWKS.
+    """
+    try:
+        header = jwt.get_unverified_header(token)
+    except jwt.PyJWTError as e:
+        raise InvalidTokenError(str(e))
+
+    if header.get("alg") == "HS256":
+        if not settings.SUPABASE_JWT_SECRET:
+            raise VerificationUnavailable("HS256 token but SUPABASE_JWT_SECRET is not configured")
+        key, alg = settings.SUPABASE_JWT_SECRET, "HS256"
+    else:
+        jwk = await jwks_cache.get(header.get("kid", ""))
+        if jwk is None:
+            raise VerificationUnavailable("Unknown signing key")
+        # Algorithm comes from the published key, never from the token header
+        key, alg = jwk.key, jwk.algorithm_name
+
+    try:
+        return jwt.decode(
+            token, key,
+            algorithms=[alg],
+            audience=settings.JWT_AUDIENCE,
+            options={"require": ["exp", "sub"]},
+            leeway=settings.JWT_LEEWAY_SECONDS,
+        )
+    except jwt.PyJWTError as e:
+        raise InvalidTokenError(str(e))
+
+async def get_user_role(supabase: AsyncClient, user_id: str) -> str:
+    role = role_cache.get(user_id)
+    if role is None:
+        profile_response = await supabase.table('profiles').select('role').eq('id', user_id).maybe_single().execute()
+        role = "USER" # Default role
+        if profile_response and profile_response.data:
+            role = profile_response.data.get('role', 'USER')
+        role_cache.set(user_id, role)
+    return role
+
+def invalidate_role(user_id: str) -> None:
+    role_cache.invalidate(str(user_id))
+
+async def authenticate(token: str, supabase: AsyncClient) -> AuthenticatedUser:
+    claims = await verify_access_token(token)
+    user_id = claims["sub"]
+    return AuthenticatedUser(id=user_id, email=claims.get("email"), role=await get_user_role(supabase, user_id))
+
+def _bearer_token(authorization: Optional[str]) -> str:
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    return authorization[7:].strip()
+
+async def get_current_user(
+    authorization: Optional[str] = Header(None),
+    supabase: AsyncClient = Depends(get_supabase)
+) -> AuthenticatedUser:
+    """
+    FastAPI dependency: the caller's verified identity and role, without a round trip
+    to Supabase Auth (profiles lookup only on a role cache miss).
+    """
+    try:
+        return await authenticate(_bearer_token(authorization), supabase)
+    except InvalidTokenError as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
+
+async def require_admin(
+    authorization: Optional[str] = Header(None),
+    supabase: AsyncClient = Depends(get_supabase)
+) -> Optional[AuthenticatedUser]:
+    """
+    FastAPI dependency for admin routes: the caller must be an ADMIN. Skipped only when
+    ADMIN_AUTH_DISABLED is set for local development.
+    """
+    if settings.ADMIN_AUTH_DISABLED:
+        return None
+    user = await get_current_user(authorization, supabase)
+    if user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Admin role required")
+    return user
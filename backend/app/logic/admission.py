@@ -0,0 +1,142 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+from fastapi import HTTPException
+from app.core.config import settings
+from app.core.metrics import admission_rejections
+from app.utils.cache import TTLCache
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Takes one token. Returns 0 on success, else seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class ServiceGate:
+    """
+    At most `limit` joins of one service run at a time; up to `queue_limit` more wait
+    in FIFO order and get a slot handed over directly as one finishes.
+    """
+
+    def __init__(self, limit: int, queue_limit: int):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.hold_seconds = 0.05 # EWMA of time a join holds its slot, for Retry-After
+
+    def retry_after(self) -> int:
+        backlog = len(self.waiters) + self.active
+        return max(1, math.ceil(backlog * self.hold_seconds / self.limit))
+
+    async def acquire(self, timeout: float) -> str:
+        """
+        Returns "" once a slot is held, else the rejection reason.
+        """
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return ""
+        if len(self.waiters) >= self.queue_limit:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return ""
+        except asyncio.TimeoutError:
+            return self._abandon(waiter) or "timeout"
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: asyncio.Future) -> str:
+        if waiter.done() and not waiter.cancelled():
+            # The slot was handed over just as we gave up: we hold it, so keep it
+            return ""
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+        return "timeout"
+
+    def release(self, held_for: float) -> None:
+        self.hold_seconds = 0.8 * self.hold_seconds + 0.2 * held_for
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None) # hand the slot over, active count unchanged
+                return
+        self.active -= 1
+
+    @property
+    def idle(self) -> bool:
+        return self.active == 0 and not self.waiters
+
+class JoinAdmission:
+    """
+    Admission control in front of issue_token: a per-user token bucket, then a
+    per-service concurrency gate. Excess load is refused immediately with 429 and
+    Retry-After instead of piling up on the database. Per worker.
+    """
+
+    def __init__(self):
+        self.gates: Dict[str, ServiceGate] = {}
+        self.buckets = TTLCache(maxsize=settings.JOIN_RATE_CACHE_SIZE, ttl=settings.JOIN_BURST_PER_USER / settings.JOIN_RATE_PER_USER)
+
+    def _reject(self, reason: str, retry_after: float) -> HTTPException:
+        admission_rejections.inc("queue/join", reason)
+        return HTTPException(
+            status_code=429,
+            detail="Too many join requests, please retry shortly." if reason != "rate_limited" else "Too many join attempts for this user.",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    @asynccontextmanager
+    async def admit(self, service_id: str, user_id: str):
+        if not settings.ADMISSION_ENABLED:
+            yield
+            return
+
+        # 1. Per-user rate limit
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(settings.JOIN_RATE_PER_USER, settings.JOIN_BURST_PER_USER)
+        wait = bucket.take()
+        self.buckets.set(user_id, bucket)
+        if wait:
+            raise self._reject("rate_limited", wait)
+
+        # 2. Per-service concurrency gate
+        gate = self.gates.get(service_id)
+        if gate is None:
+            gate = self.gates[service_id] = ServiceGate(settings.JOIN_MAX_CONCURRENCY, settings.JOIN_QUEUE_LIMIT)
+        reason = await gate.acquire(settings.JOIN_QUEUE_TIMEOUT)
+        if reason:
+            raise self._reject(reason, gate.retry_after())
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            gate.release(time.monotonic() - started)
+            if gate.idle:
+                self.gates.pop(service_id, None)
+
+join_admission = JoinAdmission()
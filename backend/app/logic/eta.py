@@ -0,0 +1,135 @@
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional
+from app.core.config import settings
+
+# Tokens still waiting to be called (same set the queue feed counts as "ahead")
+WAITING_STATES = ["CREATED", "WAITING", "NEAR", "CONFIRMING", "CONFIRMED"]
+
+def _parse_ts(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+class RollingStats:
+    """
+    Incrementally updated service-time statistics: an EWMA for the estimate and a
+    bounded window of recent samples for percentiles. O(1) per update.
+    """
+
+    def __init__(self, alpha: float, window: int):
+        self.alpha = alpha
+        self.ewma: Optional[float] = None
+        self.count = 0
+        self.samples: deque = deque(maxlen=window)
+        self.last_seen = 0.0
+
+    def add(self, value: float) -> None:
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+        self.count += 1
+        self.samples.append(value)
+        self.last_seen = time.monotonic()
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def to_dict(self) -> dict:
+        return {
+            "ewma_seconds": self.ewma,
+            "p50_seconds": self.percentile(50),
+            "p90_seconds": self.percentile(90),
+            "samples": self.count,
+        }
+
+class EtaEstimator:
+    """
+    Per-service and per-counter service-time and no-show statistics, fed by the
+    flow/admin routes as tokens finish. Estimates are per worker process.
+    """
+
+    def __init__(self):
+        self.services: Dict[str, RollingStats] = {}
+        self.counters: Dict[str, RollingStats] = {}
+        self.counter_service: Dict[str, str] = {}
+        self.no_show: Dict[str, float] = {} # service_id -> EWMA of no-show outcomes (0..1)
+
+    def _stats(self, table: Dict[str, RollingStats], key: str) -> RollingStats:
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = RollingStats(settings.ETA_EWMA_ALPHA, settings.ETA_WINDOW)
+        return stats
+
+    def record_service(self, token: Optional[dict]) -> None:
+        """
+        Record a finished token (row returned by end_service / finish_and_call_next).
+        """
+        if not token:
+            return
+        started = _parse_ts(token.get('service_start_at'))
+        ended = _parse_ts(token.get('service_end_at'))
+        if not started or not ended or ended < started:
+            return
+        seconds = (ended - started).total_seconds()
+        service_id = str(token['service_id'])
+        self._stats(self.services, service_id).add(seconds)
+        if token.get('counter_id'):
+            counter_id = str(token['counter_id'])
+            self._stats(self.counters, counter_id).add(seconds)
+            self.counter_service[counter_id] = service_id
+
+    def record_outcome(self, service_id: str, no_show: bool) -> None:
+        """
+        Record whether a called/waiting token showed up (start_service) or was missed/expired.
+        """
+        service_id = str(service_id)
+        previous = self.no_show.get(service_id)
+        value = 1.0 if no_show else 0.0
+        alpha = settings.ETA_EWMA_ALPHA
+        self.no_show[service_id] = value if previous is None else alpha * value + (1 - alpha) * previous
+
+    def active_counters(self, service_id: str) -> int:
+        horizon = time.monotonic() - settings.ETA_COUNTER_ACTIVE_SECONDS
+        return sum(
+            1 for counter_id, svc in self.counter_service.items()
+            if svc == service_id and self.counters[counter_id].last_seen >= horizon
+        )
+
+    def service_time(self, service_id: str) -> float:
+        stats = self.services.get(str(service_id))
+        if stats is None or stats.ewma is None:
+            return settings.DEFAULT_SERVICE_TIME_SECONDS
+        return stats.ewma
+
+    def estimate_wait(self, service_id: str, people_ahead: int) -> float:
+        """
+        Expected seconds until this token is called.
+        """
+        service_id = str(service_id)
+        show_rate = 1.0 - self.no_show.get(service_id, 0.0)
+        counters = max(1, self.active_counters(service_id))
+        return round(people_ahead * show_rate * self.service_time(service_id) / counters, 1)
+
+    def snapshot(self, service_id: str) -> dict:
+        service_id = str(service_id)
+        stats = self.services.get(service_id)
+        return {
+            "service": stats.to_dict() if stats else None,
+            "counters": {
+                counter_id: self.counters[counter_id].to_dict()
+                for counter_id, svc in self.counter_service.items() if svc == service_id
+            },
+            "no_show_rate": self.no_show.get(service_id),
+            "active_counters": self.active_counters(service_id),
+        }
+
+eta_estimator = EtaEstimator()
+
+def position_estimate(service_id: str, people_ahead: int) -> dict:
+    return {
+        "position": people_ahead,
+        "estimated_wait_seconds": eta_estimator.estimate_wait(service_id, people_ahead),
+    }
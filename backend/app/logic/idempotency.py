@@ -0,0 +1,66 @@
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from fastapi import HTTPException
+from pydantic import BaseModel
+from app.core.config import settings
+from app.utils.cache import TTLCache
+
+MAX_KEY_LENGTH = 255
+
+class IdempotencyStore:
+    """
+    Responses of POST routes by Idempotency-Key, so client retries and double taps are
+    answered from memory instead of re-running the operation. A retry that arrives
+    while the first attempt is still running waits for it. Successful responses and
+    4xx errors are kept; 429 and 5xx errors are not, so those retries run again.
+    Per worker: retries routed to another worker are not deduplicated.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.responses = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.in_flight: Dict[Tuple[str, str], asyncio.Event] = {}
+
+    async def run(self, scope: str, key: Optional[str], payload: BaseModel, handler: Callable[[], Awaitable[Any]]) -> Any:
+        if not key:
+            return await handler()
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+        cache_key = (scope, key)
+        fingerprint = hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+
+        # 1. Replay a stored response, or wait for an attempt in progress
+        while True:
+            entry = self.responses.get(cache_key)
+            if entry is not None:
+                return self._replay(entry, fingerprint)
+            pending = self.in_flight.get(cache_key)
+            if pending is None:
+                break
+            await pending.wait()
+
+        # 2. First attempt: run and remember the outcome
+        done = self.in_flight[cache_key] = asyncio.Event()
+        try:
+            result = await handler()
+            self.responses.set(cache_key, (fingerprint, result, None))
+            return result
+        except HTTPException as e:
+            if e.status_code < 500 and e.status_code != 429:
+                self.responses.set(cache_key, (fingerprint, None, e))
+            raise
+        finally:
+            del self.in_flight[cache_key]
+            done.set()
+
+    @staticmethod
+    def _replay(entry: tuple, fingerprint: str) -> Any:
+        stored_fingerprint, result, error = entry
+        if stored_fingerprint != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        if error is not None:
+            raise HTTPException(status_code=error.status_code, detail=error.detail)
+        return result
+
+idempotency_store = IdempotencyStore(maxsize=settings.IDEMPOTENCY_CACHE_SIZE, ttl=settings.IDEMPOTENCY_TTL)
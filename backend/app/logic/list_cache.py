@@ -0,0 +1,55 @@
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from fastapi import Request, Response
+from app.core.config import settings
+from app.utils.cache import SingleFlight, TTLCache
+
+# key -> (etag, serialized body)
+list_cache = TTLCache(maxsize=settings.LIST_CACHE_SIZE, ttl=settings.LIST_CACHE_TTL)
+list_flights = SingleFlight()
+
+# Bumping a generation makes every cached page of that scope unreachable at once
+_generations: Dict[str, int] = {}
+
+def _generation(scope: str) -> int:
+    return _generations.get(scope, 0)
+
+def invalidate_scope(scope: str) -> None:
+    _generations[scope] = _generation(scope) + 1
+
+def invalidate_org(org_id: Optional[Any]) -> None:
+    """
+    Drop cached service lists of an organization. Call after any write to its `services`.
+    """
+    if org_id:
+        invalidate_scope(f"org:{org_id}")
+
+async def cached_json(scope: str, key: Tuple[Hashable, ...], loader: Callable[[], Awaitable[Any]]) -> Tuple[str, bytes]:
+    """
+    (etag, body) for a read, from the cache or from one shared call to `loader`
+    for all identical requests in flight.
+    """
+    full_key = (scope, _generation(scope)) + key
+    entry = list_cache.get(full_key)
+    if entry is not None:
+        return entry
+
+    async def load() -> Tuple[str, bytes]:
+        body = json.dumps(await loader(), separators=(",", ":"), default=str).encode()
+        entry = ('"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"', body)
+        list_cache.set(full_key, entry)
+        return entry
+
+    return await list_flights.do(full_key, load)
+
+def etag_response(request: Request, entry: Tuple[str, bytes]) -> Response:
+    """
+    200 with the cached body, or 304 if the client already has this version.
+    """
+    etag, body = entry
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,164 @@
+import asyncio
+import bisect
+import logging
+from typing import Dict, Optional, Set
+from app.core.config import settings
+from app.logic.eta import eta_estimator
+from app.logic.queue_store import QueueStore
+
+logger = logging.getLogger(__name__)
+
+# Tokens still waiting to be called, in line order
+WAITING_STATES = {"CREATED", "WAITING", "NEAR", "CONFIRMING", "CONFIRMED"}
+CALLED_STATES = {"CALLED", "SERVING"}
+
+class Subscriber:
+    """
+    One connected client. Holds at most one pending message: a newer update replaces
+    an unsent one, so slow clients get coalesced state instead of a growing backlog.
+    """
+
+    def __init__(self, service_id: str, token_id: Optional[str]):
+        self.service_id = service_id
+        self.token_id = token_id
+        self._pending: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._last: Optional[dict] = None
+
+    def push(self, message: dict) -> None:
+        if message == self._last:
+            return
+        self._last = message
+        if self._pending.full():
+            self._pending.get_nowait()
+        self._pending.put_nowait(message)
+
+    async def get(self) -> dict:
+        return await self._pending.get()
+
+class ServiceFeed:
+    """
+    Single upstream change feed for one service, shared by all its subscribers.
+    Polls the versioned /changes projection, so a burst of writes between two polls
+    becomes one update per client.
+    """
+
+    def __init__(self, service_id: str, store: QueueStore):
+        self.service_id = service_id
+        self.store = store
+        self.version = 0
+        self.tokens: Dict[str, dict] = {}
+        self.waiting_numbers: list = [] # sorted token_numbers of WAITING_STATES tokens
+        self.now_serving: Optional[int] = None
+        self.subscribers: Set[Subscriber] = set()
+        self.task: Optional[asyncio.Task] = None
+        self.loaded = False
+
+    async def _load_snapshot(self) -> None:
+        data = await self.store.snapshot(self.service_id)
+        self.version = data['version']
+        self.tokens = {t['id']: t for t in data['tokens']}
+        self._reindex()
+        self.loaded = True
+
+    async def _poll_changes(self) -> bool:
+        changed = False
+        while True:
+            rows = await self.store.changes(self.service_id, self.version, 500)
+            for row in rows:
+                if row['state'] in WAITING_STATES or row['state'] in CALLED_STATES:
+                    self.tokens[row['id']] = row
+                else:
+                    self.tokens.pop(row['id'], None)
+            if rows:
+                self.version = rows[-1]['version']
+                changed = True
+            if len(rows) < 500:
+                return changed
+
+    def _reindex(self) -> None:
+        self.waiting_numbers = sorted(t['token_number'] for t in self.tokens.values() if t['state'] in WAITING_STATES)
+        called = [t for t in self.tokens.values() if t['state'] in CALLED_STATES]
+        if called:
+            self.now_serving = max(t['token_number'] for t in called)
+
+    def message_for(self, token_id: Optional[str]) -> dict:
+        message = {
+            "service_id": self.service_id,
+            "version": self.version,
+            "now_serving": self.now_serving,
+            "waiting": len(self.waiting_numbers),
+        }
+        token = self.tokens.get(token_id) if token_id else None
+        if token_id is None:
+            return message
+        if token is None:
+            # Finished or unknown token
+            message.update({"token_id": token_id, "state": None, "position": None, "eta_seconds": None})
+            return message
+        message.update({"token_id": token_id, "state": token['state'], "token_number": token['token_number']})
+        if token['state'] in WAITING_STATES:
+            people_ahead = bisect.bisect_left(self.waiting_numbers, token['token_number'])
+            message.update({
+                "position": people_ahead,
+                "eta_seconds": eta_estimator.estimate_wait(self.service_id, people_ahead),
+            })
+        else:
+            message.update({"position": 0, "eta_seconds": 0})
+        return message
+
+    def notify(self, subscribers: Optional[Set[Subscriber]] = None) -> None:
+        for sub in subscribers if subscribers is not None else self.subscribers:
+            sub.push(self.message_for(sub.token_id))
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if not self.loaded:
+                    await self._load_snapshot()
+                    self.notify()
+                elif await self._poll_changes():
+                    self._reindex()
+                    self.notify()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Queue feed %s poll failed: %s", self.service_id, e)
+            await asyncio.sleep(settings.QUEUE_FEED_INTERVAL)
+
+class QueueFeedManager:
+    """
+    Keeps one ServiceFeed per service with at least one connected client.
+    """
+
+    def __init__(self):
+        self.feeds: Dict[str, ServiceFeed] = {}
+
+    def subscribe(self, service_id: str, token_id: Optional[str], store: QueueStore) -> Subscriber:
+        feed = self.feeds.get(service_id)
+        if feed is None:
+            feed = ServiceFeed(service_id, store)
+            feed.task = asyncio.create_task(feed.run())
+            self.feeds[service_id] = feed
+        sub = Subscriber(service_id, token_id)
+        feed.subscribers.add(sub)
+        if feed.loaded:
+            # Feed already warm: send current state immediately
+            feed.notify({sub})
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        feed = self.feeds.get(sub.service_id)
+        if feed is None:
+            return
+        feed.subscribers.discard(sub)
+        if not feed.subscribers:
+            feed.task.cancel()
+            del self.feeds[sub.service_id]
+
+    async def close(self) -> None:
+        for feed in self.feeds.values():
+            feed.task.cancel()
+        await asyncio.gather(*(f.task for f in self.feeds.values()), return_exceptions=True)
+        self.feeds.clear()
+
+queue_feeds = QueueFeedManager()
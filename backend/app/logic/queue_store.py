@@ -0,0 +1,739 @@
+import bisect
+import heapq
+import uuid
+from collections import deque
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+from fastapi import Depends
+from supabase import AsyncClient
+from app.core.config import settings
+from app.core.database import get_supabase
+from app.logic.eta import WAITING_STATES
+from app.logic.state_machine import ACTIVE_STATES, can_transition
+from app.logic.transition_log import transition_log
+from app.models.schemas import TokenState
+
+# Compact projection shared by snapshot and changes
+QUEUE_FIELDS = "id, token_number, state, counter_id, version"
+QUEUE_FIELD_NAMES = [f.strip() for f in QUEUE_FIELDS.split(",")]
+FINISHED_STATES = {TokenState.DONE.value, TokenState.MISSED.value, TokenState.EXPIRED.value}
+SUMMARY_FIELDS = "active_count, waiting_count, confirmed_count, last_called_number, avg_wait_seconds, updated_at"
+EMPTY_SUMMARY = {
+    "active_count": 0, "waiting_count": 0, "confirmed_count": 0,
+    "last_called_number": None, "avg_wait_seconds": None, "updated_at": None,
+}
+WAIT_EWMA_ALPHA = 0.2 # same weight as apply_queue_stats
+LOG_COMPACT_MIN = 1024 # change-log entries per service before superseded ones are compacted away
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def _utc_iso(value: datetime) -> str:
+    # Naive datetimes are taken as UTC, like timestamptz input in Supabase
+    return (value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+
+class QueueError(Exception):
+    """
+    A rejected queue operation. Messages match the SQL functions' exceptions, so
+    routes map both engines' errors the same way.
+    """
+
+class QueueStore(ABC):
+    """
+    Queue state machine behind the routes. Every method is atomic: either the whole
+    transition (token + counter) is applied, or a QueueError is raised.
+    Token dicts have the same shape as rows of the `tokens` table.
+    """
+
+    @abstractmethod
+    async def issue(self, service_id: str, user_id: str) -> dict:
+        """New WAITING token with the next number of the service."""
+
+    @abstractmethod
+    async def confirm(self, token_id: str) -> Optional[dict]:
+        """Confirm presence (-> CONFIRMED). Already confirmed/called/serving tokens are returned as is."""
+
+    @abstractmethod
+    async def call_next(self, service_id: str, counter_id: str) -> Optional[dict]:
+        """
+        Next CONFIRMED token the counter can serve -> CALLED at the counter: highest
+        priority first, then lowest number. None if nobody is waiting.
+        """
+
+    @abstractmethod
+    async def dispatch(self, service_id: str) -> dict:
+        """
+        call_next() for every idle counter of the service, highest weight then idle longest
+        first: {assigned: [tokens], idle_counters, backlog (confirmed tokens left)}.
+        """
+
+    @abstractmethod
+    async def start(self, token_id: str, counter_id: str) -> dict:
+        """CALLED -> SERVING, counter BUSY."""
+
+    @abstractmethod
+    async def end(self, token_id: str) -> dict:
+        """SERVING -> DONE, counter FREE."""
+
+    @abstractmethod
+    async def finish_and_call_next(self, token_id: str) -> dict:
+        """end() and call_next() on the same counter in one step: {finished_token, next_token}."""
+
+    @abstractmethod
+    async def cancel(self, token_id: str) -> Optional[dict]:
+        """Active token -> MISSED (admin cancel). None if the token cannot be cancelled."""
+
+    @abstractmethod
+    async def bulk_transition(
+        self, state: TokenState, token_ids: Optional[List[str]] = None,
+        service_id: Optional[str] = None, states: Optional[List[TokenState]] = None, limit: int = 1000
+    ) -> List[dict]:
+        """
+        Moves the tokens in token_ids, or up to `limit` tokens of service_id in `states`
+        (lowest number first), to `state` at once; only VALID_TRANSITIONS moves are applied
+        and counters holding a moved token are freed. One outcome per token, in order:
+        {token_id, outcome: applied | invalid_transition | not_found, from_state, token}.
+        """
+
+    @abstractmethod
+    async def apply_presence(self, updates: List[dict]) -> List[dict]:
+        """Compare-and-set presence transitions [{token_id, from_state, to_state}]; returns applied rows."""
+
+    @abstractmethod
+    async def snapshot(self, service_id: str) -> dict:
+        """{version, tokens}: active tokens of a service in QUEUE_FIELDS projection, by token_number."""
+
+    @abstractmethod
+    async def changes(self, service_id: str, since: int, limit: int) -> List[dict]:
+        """Tokens written after version `since`, in version order (QUEUE_FIELDS projection)."""
+
+    @abstractmethod
+    async def summary(self, service_id: str) -> dict:
+        """Per-service counters (SUMMARY_FIELDS), maintained incrementally on every write."""
+
+    @abstractmethod
+    async def get_many(self, token_ids: List[str]) -> List[dict]:
+        """
+        Tokens by id (id, service_id, state, token_number). May embed the service
+        geometry as `services` when the engine can fetch it in the same read.
+        """
+
+    @abstractmethod
+    async def people_ahead(self, tokens: List[Tuple[str, int]]) -> List[int]:
+        """For each (service_id, token_number), how many waiting tokens are ahead of it."""
+
+    @abstractmethod
+    async def sweep(self, waiting_timeout: int, called_timeout: int, batch_size: int) -> dict:
+        """One batch of stale token expiry, same report shape as sweep_stale_tokens."""
+
+    @abstractmethod
+    async def archive(self, older_than: int, batch_size: int) -> dict:
+        """Move one batch of finished tokens to the archive: {skipped, moved}."""
+
+    @abstractmethod
+    async def history(self, service_id: str, since: Optional[datetime], until: Optional[datetime], limit: int) -> List[dict]:
+        """Live and archived tokens of a service issued in [since, until), newest first."""
+
+    @abstractmethod
+    async def route(self, token_id: str, priority: int, skill: Optional[str]) -> Optional[dict]:
+        """Set the priority lane and required skill of a token still in line; None if it is not."""
+
+    @abstractmethod
+    async def set_counter_status(self, counter_id: str, status: str) -> Optional[dict]:
+        """FREE <-> OFFLINE. A counter with someone called or being served cannot go offline."""
+
+    async def set_service_status(self, service_id: str, status: str) -> None:
+        """Keeps engines that do not read the `services` table in sync with toggle-service."""
+
+    async def sync_counters(self, counters: List[dict]) -> None:
+        """Keeps engines that do not read the `counters` table in sync with counter rows (service, skills, weight)."""
+
+class SupabaseQueueStore(QueueStore):
+    """
+    Postgres engine: each operation is one of the RPCs in database/schema.sql.
+    """
+
+    def __init__(self, supabase: AsyncClient):
+        self.supabase = supabase
+
+    async def issue(self, service_id: str, user_id: str) -> dict:
+        res = await self.supabase.rpc('issue_token', {'p_service_id': str(service_id), 'p_user_id': user_id}).execute()
+        return res.data
+
+    async def confirm(self, token_id: str) -> Optional[dict]:
+        res = await self.supabase.rpc('confirm_token', {'p_token_id': str(token_id)}).execute()
+        return res.data
+
+    async def call_next(self, service_id: str, counter_id: str) -> Optional[dict]:
+        res = await self.supabase.rpc('call_next_token', {'p_service_id': str(service_id), 'p_counter_id': str(counter_id)}).execute()
+        return res.data
+
+    async def dispatch(self, service_id: str) -> dict:
+        res = await self.supabase.rpc('dispatch_service', {'p_service_id': str(service_id)}).execute()
+        return res.data or {"assigned": [], "idle_counters": 0, "backlog": False}
+
+    async def start(self, token_id: str, counter_id: str) -> dict:
+        res = await self.supabase.rpc('start_service', {'p_token_id': str(token_id), 'p_counter_id': str(counter_id)}).execute()
+        return res.data
+
+    async def end(self, token_id: str) -> dict:
+        res = await self.supabase.rpc('end_service', {'p_token_id': str(token_id)}).execute()
+        return res.data
+
+    async def finish_and_call_next(self, token_id: str) -> dict:
+        res = await self.supabase.rpc('finish_and_call_next', {'p_token_id': str(token_id)}).execute()
+        return res.data or {}
+
+    async def cancel(self, token_id: str) -> Optional[dict]:
+        # Only states with a -> MISSED transition can be cancelled
+        cancellable = [s.value for s in TokenState if can_transition(s, TokenState.MISSED)]
+        res = await self.supabase.table("tokens").update({"state": TokenState.MISSED.value}).eq("id", str(token_id)).in_("state", cancellable).execute()
+        return res.data[0] if res.data else None
+
+    async def bulk_transition(
+        self, state: TokenState, token_ids: Optional[List[str]] = None,
+        service_id: Optional[str] = None, states: Optional[List[TokenState]] = None, limit: int = 1000
+    ) -> List[dict]:
+        res = await self.supabase.rpc('bulk_transition', {
+            'p_to_state': state.value,
+            'p_allowed_from': [s.value for s in TokenState if can_transition(s, state)],
+            'p_token_ids': [str(t) for t in token_ids] if token_ids is not None else None,
+            'p_service_id': str(service_id) if service_id else None,
+            'p_states': [s.value for s in states] if states else None,
+            'p_limit': limit,
+        }).execute()
+        return res.data or []
+
+    async def route(self, token_id: str, priority: int, skill: Optional[str]) -> Optional[dict]:
+        res = await self.supabase.table("tokens").update({"priority": priority, "skill": skill}).eq("id", str(token_id)).in_("state", WAITING_STATES).execute()
+        return res.data[0] if res.data else None
+
+    async def set_counter_status(self, counter_id: str, status: str) -> Optional[dict]:
+        res = await self.supabase.rpc('set_counter_status', {'p_counter_id': str(counter_id), 'p_status': status}).execute()
+        return res.data
+
+    async def apply_presence(self, updates: List[dict]) -> List[dict]:
+        res = await self.supabase.rpc('apply_presence_batch', {'p_updates': updates}).execute()
+        return res.data or []
+
+    async def snapshot(self, service_id: str) -> dict:
+        res = await self.supabase.rpc('queue_snapshot', {'p_service_id': str(service_id)}).execute()
+        return res.data or {"version": 0, "tokens": []}
+
+    async def changes(self, service_id: str, since: int, limit: int) -> List[dict]:
+        res = await self.supabase.table("tokens").select(QUEUE_FIELDS).eq("service_id", str(service_id)).gt("version", since).order("version").limit(limit).execute()
+        return res.data or []
+
+    async def summary(self, service_id: str) -> dict:
+        res = await self.supabase.table("queue_stats").select(SUMMARY_FIELDS).eq("service_id", str(service_id)).maybe_single().execute()
+        return res.data if res and res.data else dict(EMPTY_SUMMARY)
+
+    async def get_many(self, token_ids: List[str]) -> List[dict]:
+        # Service geometry joined in, so a cold presence check is still one round trip
+        res = await self.supabase.table("tokens").select(
+            "id, service_id, state, token_number, services(latitude, longitude, presence_radius)"
+        ).in_("id", [str(t) for t in token_ids]).execute()
+        return res.data or []
+
+    async def people_ahead(self, tokens: List[Tuple[str, int]]) -> List[int]:
+        if not tokens:
+            return []
+        # Counts only, one round trip for the whole batch
+        res = await self.supabase.rpc('count_waiting_ahead', {
+            'p_service_ids': [str(s) for s, _ in tokens],
+            'p_token_numbers': [number for _, number in tokens],
+        }).execute()
+        return res.data or [0] * len(tokens)
+
+    async def sweep(self, waiting_timeout: int, called_timeout: int, batch_size: int) -> dict:
+        res = await self.supabase.rpc('sweep_stale_tokens', {
+            'p_waiting_timeout_seconds': waiting_timeout,
+            'p_called_timeout_seconds': called_timeout,
+            'p_batch_size': batch_size
+        }).execute()
+        return res.data or {}
+
+    async def archive(self, older_than: int, batch_size: int) -> dict:
+        res = await self.supabase.rpc('archive_finished_tokens', {
+            'p_older_than_seconds': older_than,
+            'p_batch_size': batch_size
+        }).execute()
+        return res.data or {}
+
+    async def history(self, service_id: str, since: Optional[datetime], until: Optional[datetime], limit: int) -> List[dict]:
+        # tokens_all = tokens + tokens_history
+        query = self.supabase.table("tokens_all").select("*").eq("service_id", str(service_id))
+        if since:
+            query = query.gte("issued_at", _utc_iso(since))
+        if until:
+            query = query.lt("issued_at", _utc_iso(until))
+        res = await query.order("issued_at", desc=True).limit(limit).execute()
+        return res.data or []
+
+class _RankIndex:
+    """
+    Fenwick tree over token numbers: O(log n) insert/remove and "how many waiting
+    tokens have a lower number". Grows by doubling as numbers increase.
+    """
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self.tree = [0] * (size + 1)
+        self.members = bytearray(size + 1)
+
+    def _grow(self, number: int) -> None:
+        size = self.size
+        while size < number:
+            size *= 2
+        members = self.members + bytearray(size - self.size)
+        self.size, self.members, self.tree = size, members, [0] * (size + 1)
+        for i in range(1, size + 1):
+            if members[i]:
+                self._add(i, 1)
+
+    def _add(self, i: int, delta: int) -> None:
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def add(self, number: int) -> None:
+        if number > self.size:
+            self._grow(number)
+        if not self.members[number]:
+            self.members[number] = 1
+            self._add(number, 1)
+
+    def remove(self, number: int) -> None:
+        if number <= self.size and self.members[number]:
+            self.members[number] = 0
+            self._add(number, -1)
+
+    def rank(self, number: int) -> int:
+        """Members strictly below `number`."""
+        i, total = min(number - 1, self.size), 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+class _ServiceQueue:
+    def __init__(self):
+        self.last_number = 0
+        self.version = 0
+        self.confirmed: List[Tuple[int, int, str]] = [] # heap of (-priority, token_number, token_id), stale entries skipped on pop
+        self.waiting = _RankIndex()
+        self.active: Dict[str, dict] = {} # token_id -> token, ACTIVE_STATES only
+        self.log: List[Tuple[int, str]] = [] # (version, token_id) in version order
+        self.log_compacted = 0 # log length after the last compaction
+        self.stats = dict(EMPTY_SUMMARY)
+
+PRESENCE_TRANSITIONS = {
+    (TokenState.WAITING, TokenState.NEAR), (TokenState.WAITING, TokenState.CONFIRMED),
+    (TokenState.NEAR, TokenState.WAITING), (TokenState.NEAR, TokenState.CONFIRMED),
+    (TokenState.CONFIRMING, TokenState.NEAR), (TokenState.CONFIRMING, TokenState.CONFIRMED),
+}
+
+WAITING_STATE_SET = {TokenState(s) for s in WAITING_STATES}
+
+class InMemoryQueueStore(QueueStore):
+    """
+    Single-process engine for single-node deployments, tests and benchmarks.
+    call_next pops a per-service heap of confirmed tokens (O(log n)), positions come
+    from a Fenwick tree (O(log n)) and token lookups are dict hits. Every transition is
+    checked against VALID_TRANSITIONS. Operations only await before touching state
+    (the first join of a service loads its status from `services`; services that are
+    not found are CLOSED), so each one is atomic on the event loop. State is lost on
+    restart and not shared between workers.
+    Transitions reach token_events through the buffered transition_log.
+    """
+
+    def __init__(self, default_service_status: str = "CLOSED", history_size: int = 100000):
+        self.default_service_status = default_service_status
+        self.supabase: Optional[AsyncClient] = None # set by queue_store_for, for service status
+        self.archived: Deque[dict] = deque(maxlen=history_size)
+        self.service_status: Dict[str, str] = {}
+        self.services: Dict[str, _ServiceQueue] = {}
+        self.tokens: Dict[str, dict] = {}
+        self.active_users: Dict[Tuple[str, str], str] = {} # (service_id, user) -> active token_id
+        self.counters: Dict[str, dict] = {} # counter_id -> row of the `counters` table (status, current_token_id, skills, ...)
+
+    def _queue(self, service_id: str) -> _ServiceQueue:
+        queue = self.services.get(service_id)
+        if queue is None:
+            queue = self.services[service_id] = _ServiceQueue()
+        return queue
+
+    def _counter(self, counter_id: str) -> dict:
+        counter = self.counters.get(counter_id)
+        if counter is None:
+            counter = self.counters[counter_id] = {
+                "id": counter_id, "service_id": None, "name": None, "status": "FREE", "current_token_id": None,
+                "skills": None, "weight": 1, "freed_at": _now(),
+            }
+        return counter
+
+    @staticmethod
+    def _free_counter(counter: dict) -> None:
+        counter.update(status="FREE", current_token_id=None, freed_at=_now())
+
+    def _idle(self, counter: dict) -> bool:
+        # FREE and nobody called to it (a cancelled call can leave current_token_id behind)
+        current = self.tokens.get(counter['current_token_id'] or "")
+        return counter['status'] == "FREE" and (current is None or current['state'] != TokenState.CALLED.value)
+
+    @staticmethod
+    def _serves(counter: dict, token: dict) -> bool:
+        return token.get('skill') is None or counter['skills'] is None or token['skill'] in counter['skills']
+
+    def _token(self, token_id: str) -> dict:
+        token = self.tokens.get(str(token_id))
+        if token is None:
+            raise QueueError("Token not found")
+        return token
+
+    def _write(self, token: dict, state: Optional[TokenState] = None, actor: Optional[str] = None, **fields) -> dict:
+        """Apply a transition and keep the indexes, version, change log and transition log in step."""
+        queue = self._queue(token['service_id'])
+        old = TokenState(token['state'])
+        if state is not None and state != old:
+            if not can_transition(old, state):
+                raise QueueError(f"Invalid transition {old.value} -> {state.value}")
+            token['state'] = state.value
+            stats = queue.stats
+            if old in WAITING_STATE_SET and state not in WAITING_STATE_SET:
+                queue.waiting.remove(token['token_number'])
+                stats['waiting_count'] -= 1
+            if old == TokenState.CONFIRMED:
+                stats['confirmed_count'] -= 1
+            if state == TokenState.CONFIRMED:
+                heapq.heappush(queue.confirmed, (-token['priority'], token['token_number'], token['id']))
+                stats['confirmed_count'] += 1
+            if state not in ACTIVE_STATES:
+                queue.active.pop(token['id'], None)
+                self.active_users.pop((token['service_id'], token['user_identifier']), None)
+                stats['active_count'] -= 1
+            stats['updated_at'] = _now()
+        token.update(fields)
+        if state == TokenState.CALLED and old != state:
+            self._record_call(queue.stats, token)
+        queue.version += 1
+        token['version'] = queue.version
+        queue.log.append((queue.version, token['id']))
+        if len(queue.log) > 2 * max(queue.log_compacted, LOG_COMPACT_MIN):
+            self._compact_log(queue)
+        if state is not None and state != old:
+            transition_log.record(token, old.value, actor or "queue")
+        return dict(token)
+
+    @staticmethod
+    def _record_call(stats: dict, token: dict) -> None:
+        stats['last_called_number'] = token['token_number']
+        wait = (datetime.fromisoformat(token['called_at']) - datetime.fromisoformat(token['issued_at'])).total_seconds()
+        previous = stats['avg_wait_seconds']
+        stats['avg_wait_seconds'] = wait if previous is None else previous + WAIT_EWMA_ALPHA * (wait - previous)
+
+    def _release_counter(self, token: dict) -> None:
+        counter = self.counters.get(token.get('counter_id') or "")
+        if counter is not None and counter['current_token_id'] == token['id']:
+            self._free_counter(counter)
+
+    def _compact_log(self, queue: _ServiceQueue) -> None:
+        # Keep only the entries still current: at most one per token, so the log is
+        # bounded by the service's tokens while /changes replays stay exact
+        queue.log = [(v, t) for v, t in queue.log if t in self.tokens and self.tokens[t]['version'] == v]
+        queue.log_compacted = len(queue.log)
+
+    async def set_service_status(self, service_id: str, status: str) -> None:
+        self.service_status[str(service_id)] = status
+
+    async def _service_status(self, service_id: str) -> str:
+        status = self.service_status.get(service_id)
+        if status is not None:
+            return status
+        if self.supabase is None:
+            return self.default_service_status
+        res = await self.supabase.table("services").select("status").eq("id", service_id).limit(1).execute()
+        if not res.data:
+            return self.default_service_status
+        # A concurrent join may have loaded it (or toggle-service set it) meanwhile
+        return self.service_status.setdefault(service_id, res.data[0]['status'])
+
+    async def issue(self, service_id: str, user_id: str) -> dict:
+        service_id = str(service_id)
+        if await self._service_status(service_id) != "OPEN":
+            raise QueueError("Service is closed or does not exist")
+        if (service_id, user_id) in self.active_users:
+            raise QueueError("User already has an active token")
+
+        queue = self._queue(service_id)
+        queue.last_number += 1
+        token = {
+            "id": str(uuid.uuid4()), "service_id": service_id, "counter_id": None,
+            "user_identifier": user_id, "token_number": queue.last_number, "state": TokenState.WAITING.value,
+            "issued_at": _now(), "confirmed_at": None, "called_at": None,
+            "service_start_at": None, "service_end_at": None,
+            "entry_qr_code": None, "exit_qr_code": None, "version": 0, "priority": 0, "skill": None,
+        }
+        self.tokens[token['id']] = token
+        self.active_users[(service_id, user_id)] = token['id']
+        queue.active[token['id']] = token
+        queue.waiting.add(token['token_number'])
+        queue.stats['active_count'] += 1
+        queue.stats['waiting_count'] += 1
+        queue.stats['updated_at'] = token['issued_at']
+        transition_log.record(token, None, "issue_token")
+        return self._write(token)
+
+    async def confirm(self, token_id: str) -> Optional[dict]:
+        token = self._token(token_id)
+        state = TokenState(token['state'])
+        if state in (TokenState.CONFIRMED, TokenState.CALLED, TokenState.SERVING):
+            return dict(token)
+        if state == TokenState.CREATED:
+            self._write(token, TokenState.WAITING, actor="confirm_token")
+        elif state not in (TokenState.WAITING, TokenState.NEAR, TokenState.CONFIRMING):
+            raise QueueError("Token invalid or finished")
+        return self._write(token, TokenState.CONFIRMED, actor="confirm_token", confirmed_at=_now())
+
+    async def call_next(self, service_id: str, counter_id: str) -> Optional[dict]:
+        counter = self._counter(str(counter_id))
+        if counter['status'] == "BUSY":
+            raise QueueError("Counter is busy")
+        if counter['status'] == "OFFLINE":
+            raise QueueError("Counter is offline")
+
+        heap = self._queue(str(service_id)).confirmed
+        skipped = [] # tokens needing a skill this counter lacks, put back afterwards
+        called = None
+        while heap:
+            entry = heapq.heappop(heap)
+            token = self.tokens.get(entry[2])
+            if token is None or token['state'] != TokenState.CONFIRMED.value or -token['priority'] != entry[0]:
+                continue # stale: called, cancelled or re-routed since it was pushed
+            if not self._serves(counter, token):
+                skipped.append(entry)
+                continue
+            called = self._write(token, TokenState.CALLED, actor="call_next_token", called_at=_now(), counter_id=str(counter_id))
+            counter['current_token_id'] = token['id']
+            break
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        return called
+
+    async def dispatch(self, service_id: str) -> dict:
+        service_id = str(service_id)
+        idle = sorted(
+            (c for c in self.counters.values() if c['service_id'] == service_id and self._idle(c)),
+            key=lambda c: (-c['weight'], c['freed_at'])
+        )
+        assigned = []
+        for counter in idle:
+            token = await self.call_next(service_id, counter['id'])
+            if token is not None:
+                assigned.append(token)
+        return {
+            "assigned": assigned,
+            "idle_counters": len(idle) - len(assigned),
+            "backlog": self._queue(service_id).stats['confirmed_count'] > 0,
+        }
+
+    async def start(self, token_id: str, counter_id: str) -> dict:
+        token = self._token(token_id)
+        if token['state'] != TokenState.CALLED.value:
+            raise QueueError("Token is not called")
+        started = self._write(token, TokenState.SERVING, actor="start_service", service_start_at=_now(), counter_id=str(counter_id))
+        self._counter(str(counter_id)).update(status="BUSY", current_token_id=token['id'])
+        return started
+
+    async def end(self, token_id: str) -> dict:
+        token = self._token(token_id)
+        if token['state'] != TokenState.SERVING.value:
+            raise QueueError("Token is not currently serving")
+        finished = self._write(token, TokenState.DONE, actor="end_service", service_end_at=_now())
+        if token['counter_id']:
+            self._free_counter(self._counter(token['counter_id']))
+        return finished
+
+    async def finish_and_call_next(self, token_id: str) -> dict:
+        finished = await self.end(token_id)
+        next_token = None
+        if finished['counter_id']:
+            next_token = await self.call_next(finished['service_id'], finished['counter_id'])
+        return {"finished_token": finished, "next_token": next_token}
+
+    async def cancel(self, token_id: str) -> Optional[dict]:
+        token = self.tokens.get(str(token_id))
+        if token is None or not can_transition(TokenState(token['state']), TokenState.MISSED):
+            return None
+        self._release_counter(token)
+        return self._write(token, TokenState.MISSED, actor="cancel_token")
+
+    async def bulk_transition(
+        self, state: TokenState, token_ids: Optional[List[str]] = None,
+        service_id: Optional[str] = None, states: Optional[List[TokenState]] = None, limit: int = 1000
+    ) -> List[dict]:
+        allowed = {s for s in TokenState if can_transition(s, state)}
+        if token_ids is None:
+            # Movable tokens are all active, so the service's active set is enough
+            wanted = allowed & set(states) if states else allowed
+            picked = sorted(
+                (t for t in self._queue(str(service_id)).active.values() if TokenState(t['state']) in wanted),
+                key=lambda t: t['token_number']
+            )
+            token_ids = [t['id'] for t in picked]
+        results = []
+        for token_id in [str(t) for t in token_ids][:limit]:
+            token = self.tokens.get(token_id)
+            if token is None:
+                results.append({"token_id": token_id, "outcome": "not_found", "from_state": None, "token": None})
+                continue
+            from_state = token['state']
+            if TokenState(from_state) not in allowed:
+                results.append({"token_id": token_id, "outcome": "invalid_transition", "from_state": from_state, "token": None})
+                continue
+            self._release_counter(token)
+            fields = {"service_end_at": token['service_end_at'] or _now()} if state == TokenState.DONE else {}
+            moved = self._write(token, state, actor="bulk_transition", **fields)
+            results.append({"token_id": token_id, "outcome": "applied", "from_state": from_state, "token": moved})
+        return results
+
+    async def route(self, token_id: str, priority: int, skill: Optional[str]) -> Optional[dict]:
+        token = self.tokens.get(str(token_id))
+        if token is None or TokenState(token['state']) not in WAITING_STATE_SET:
+            return None
+        routed = self._write(token, priority=priority, skill=skill)
+        if token['state'] == TokenState.CONFIRMED.value:
+            # The old heap entry goes stale (priority mismatch) or is skipped by skill
+            heapq.heappush(self._queue(token['service_id']).confirmed, (-priority, token['token_number'], token['id']))
+        return routed
+
+    async def set_counter_status(self, counter_id: str, status: str) -> Optional[dict]:
+        if status == "BUSY":
+            raise QueueError("Counter status BUSY is set by entry scans")
+        counter = self._counter(str(counter_id))
+        if counter['status'] == "BUSY" or (status == "OFFLINE" and not self._idle(counter)):
+            raise QueueError("Counter is busy")
+        if status == "OFFLINE":
+            counter.update(status=status, current_token_id=None)
+        elif counter['status'] != status:
+            counter['status'] = status
+            if counter['current_token_id'] is None:
+                counter['freed_at'] = _now()
+        return dict(counter)
+
+    async def sync_counters(self, counters: List[dict]) -> None:
+        for row in counters or []:
+            counter = self._counter(str(row['id']))
+            counter.update({k: row[k] for k in ("service_id", "name", "skills", "weight") if k in row})
+
+    async def apply_presence(self, updates: List[dict]) -> List[dict]:
+        applied = []
+        for update in updates:
+            token = self.tokens.get(str(update['token_id']))
+            from_state, to_state = TokenState(update['from_state']), TokenState(update['to_state'])
+            if token is None or token['state'] != from_state.value or (from_state, to_state) not in PRESENCE_TRANSITIONS:
+                continue
+            fields = {"confirmed_at": _now()} if to_state == TokenState.CONFIRMED else {}
+            applied.append(self._write(token, to_state, actor="apply_presence_batch", **fields))
+        return applied
+
+    async def snapshot(self, service_id: str) -> dict:
+        queue = self._queue(str(service_id))
+        tokens = sorted(queue.active.values(), key=lambda t: t['token_number'])
+        return {"version": queue.version, "tokens": [{f: t[f] for f in QUEUE_FIELD_NAMES} for t in tokens]}
+
+    async def changes(self, service_id: str, since: int, limit: int) -> List[dict]:
+        queue = self._queue(str(service_id))
+        rows = []
+        for version, token_id in queue.log[bisect.bisect_left(queue.log, (since + 1,)):]:
+            token = self.tokens.get(token_id)
+            if token is not None and token['version'] == version: # skip superseded or archived entries
+                rows.append({f: token[f] for f in QUEUE_FIELD_NAMES})
+                if len(rows) == limit:
+                    break
+        return rows
+
+    async def summary(self, service_id: str) -> dict:
+        return dict(self._queue(str(service_id)).stats)
+
+    async def get_many(self, token_ids: List[str]) -> List[dict]:
+        return [
+            {f: token[f] for f in ("id", "service_id", "state", "token_number")}
+            for token in (self.tokens.get(str(t)) for t in token_ids) if token is not None
+        ]
+
+    async def people_ahead(self, tokens: List[Tuple[str, int]]) -> List[int]:
+        return [self._queue(str(s)).waiting.rank(number) for s, number in tokens]
+
+    async def sweep(self, waiting_timeout: int, called_timeout: int, batch_size: int) -> dict:
+        now = datetime.now(timezone.utc)
+        waiting_cutoff = (now - timedelta(seconds=waiting_timeout)).isoformat()
+        called_cutoff = (now - timedelta(seconds=called_timeout)).isoformat()
+        stale = sorted(
+            (t for queue in self.services.values() for t in queue.active.values()
+             if (t['state'] in ("CREATED", "WAITING", "NEAR", "CONFIRMING") and t['issued_at'] < waiting_cutoff)
+             or (t['state'] == "CALLED" and t['called_at'] < called_cutoff)),
+            key=lambda t: t['issued_at']
+        )[:batch_size]
+
+        report = {"skipped": False, "touched": 0, "counters_freed": 0, "services": {}}
+        for token in stale:
+            counts = report['services'].setdefault(token['service_id'], {"expired": 0, "missed": 0})
+            if token['state'] == "CALLED":
+                if token['counter_id'] and self.counters.get(token['counter_id'], {}).get('current_token_id') == token['id']:
+                    report['counters_freed'] += 1
+                self._release_counter(token)
+                self._write(token, TokenState.MISSED, actor="sweep_stale_tokens")
+                counts['missed'] += 1
+            else:
+                self._write(token, TokenState.EXPIRED, actor="sweep_stale_tokens")
+                counts['expired'] += 1
+            report['touched'] += 1
+        return report
+
+    async def archive(self, older_than: int, batch_size: int) -> dict:
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=older_than)).isoformat()
+        finished = sorted(
+            (t for t in self.tokens.values() if t['state'] in FINISHED_STATES and t['issued_at'] < cutoff),
+            key=lambda t: t['issued_at']
+        )[:batch_size]
+
+        archived_at = _now()
+        for token in finished:
+            del self.tokens[token['id']]
+            self._release_counter(token)
+            self.archived.append({**token, "archived_at": archived_at})
+
+        # Archived tokens leave the change log of their service
+        for service_id in {t['service_id'] for t in finished}:
+            self._compact_log(self._queue(service_id))
+        return {"skipped": False, "moved": len(finished)}
+
+    async def history(self, service_id: str, since: Optional[datetime], until: Optional[datetime], limit: int) -> List[dict]:
+        since_ts = _utc_iso(since) if since else ""
+        until_ts = _utc_iso(until) if until else "~"
+        rows = [
+            {**t, "archived_at": None} if 'archived_at' not in t else dict(t)
+            for t in list(self.tokens.values()) + list(self.archived)
+            if t['service_id'] == str(service_id) and since_ts <= t['issued_at'] < until_ts
+        ]
+        rows.sort(key=lambda t: t['issued_at'], reverse=True)
+        return rows[:limit]
+
+memory_queue_store = InMemoryQueueStore()
+
+def queue_store_for(supabase: AsyncClient) -> QueueStore:
+    """
+    The queue engine selected by the QUEUE_STORE setting.
+    """
+    if settings.QUEUE_STORE == "memory":
+        memory_queue_store.supabase = supabase
+        return memory_queue_store
+    return SupabaseQueueStore(supabase)
+
+async def get_queue_store(supabase: AsyncClient = Depends(get_supabase)) -> QueueStore:
+    """
+    FastAPI dependency returning the queue engine.
+    """
+    return queue_store_for(supabase)
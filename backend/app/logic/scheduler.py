@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from typing import Optional, Set
+from app.core.config import settings
+from app.core.database import get_supabase
+from app.logic.queue_store import QueueStore, queue_store_for
+from app.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class CounterScheduler:
+    """
+    Auto-dispatch: hands confirmed tokens to idle counters without anyone pressing
+    call-next. Events that can pair an idle counter with a waiting token (a token
+    confirmed, a counter freed, added or brought online) mark the service dirty, and
+    a background task turns them into one dispatch per service, however many events
+    arrived meanwhile. Services left with confirmed tokens and no suitable idle
+    counter are retried every DISPATCH_INTERVAL_SECONDS, which also picks up counters
+    freed on other workers. Which counter gets which token is decided by the
+    dispatch_service RPC (priority lanes, skills, weights).
+    """
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.dirty: Set[str] = set()
+        self.backlog: Set[str] = set()
+        self.wakeup = asyncio.Event()
+        # service_id -> counters left idle by the last dispatch; 0 means new
+        # confirmations can wait for the backlog retry instead of a dispatch each
+        self.idle_counters = TTLCache(maxsize=settings.SERVICE_CACHE_SIZE, ttl=settings.DISPATCH_HINT_TTL)
+        self.last_report: Optional[dict] = None
+
+    def kick(self, service_id: str) -> None:
+        if settings.AUTO_DISPATCH_ENABLED:
+            self.dirty.add(str(service_id))
+            self.wakeup.set()
+
+    def token_confirmed(self, service_id: str) -> None:
+        if self.idle_counters.get(str(service_id)) == 0:
+            self.backlog.add(str(service_id))
+        else:
+            self.kick(service_id)
+
+    def counter_freed(self, service_id: str) -> None:
+        self.idle_counters.invalidate(str(service_id))
+        self.kick(service_id)
+
+    def counter_idle(self, service_id: str) -> None:
+        """
+        A counter became idle and already found the queue empty (exit with auto call-next).
+        """
+        self.idle_counters.invalidate(str(service_id))
+
+    async def dispatch(self, service_id: str, store: Optional[QueueStore] = None) -> dict:
+        store = store or queue_store_for(await get_supabase())
+        result = await store.dispatch(str(service_id))
+        self.idle_counters.set(str(service_id), result.get('idle_counters', 0))
+        if result.get('backlog'):
+            self.backlog.add(str(service_id))
+        else:
+            self.backlog.discard(str(service_id))
+        return result
+
+    async def dispatch_pending(self) -> dict:
+        services, self.dirty = self.dirty, set()
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.dispatch(s) for s in services), return_exceptions=True)
+        report = {"services": len(services), "assigned": 0, "failed": 0}
+        for service_id, result in zip(services, results):
+            if isinstance(result, BaseException):
+                report['failed'] += 1
+                self.backlog.add(service_id) # retry with the backlog
+                logger.warning("Dispatch for service %s failed: %s", service_id, result)
+            else:
+                report['assigned'] += len(result.get('assigned') or [])
+        report['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        report['finished_at'] = time.time()
+        self.last_report = report
+        return report
+
+    async def run(self) -> None:
+        next_retry = time.monotonic() + settings.DISPATCH_INTERVAL_SECONDS
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(0.0, next_retry - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            if time.monotonic() >= next_retry:
+                self.dirty |= self.backlog
+                next_retry = time.monotonic() + settings.DISPATCH_INTERVAL_SECONDS
+            if self.dirty:
+                await self.dispatch_pending()
+
+    def start(self) -> None:
+        if settings.AUTO_DISPATCH_ENABLED and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+counter_scheduler = CounterScheduler()
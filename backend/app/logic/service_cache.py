@@ -0,0 +1,48 @@
+from typing import Dict, List, Optional
+from supabase import AsyncClient
+from app.core.config import settings
+from app.utils.cache import TTLCache
+
+GEOMETRY_FIELDS = ("latitude", "longitude", "presence_radius")
+
+# service_id -> {latitude, longitude, presence_radius}
+service_geometry_cache = TTLCache(maxsize=settings.SERVICE_CACHE_SIZE, ttl=settings.SERVICE_CACHE_TTL)
+
+# token_id -> service_id. A token never moves between services, so no TTL.
+token_service_cache = TTLCache(maxsize=settings.TOKEN_SERVICE_CACHE_SIZE, ttl=None)
+
+def get_service_geometry(service_id: str) -> Optional[dict]:
+    return service_geometry_cache.get(str(service_id))
+
+def cache_service_geometry(service_id: str, row: dict) -> dict:
+    geometry = {field: row[field] for field in GEOMETRY_FIELDS}
+    service_geometry_cache.set(str(service_id), geometry)
+    return geometry
+
+async def load_service_geometries(supabase: AsyncClient, tokens: List[dict]) -> Dict[str, dict]:
+    """
+    Geometry of the services of `tokens` (rows from QueueStore.get_many): embedded
+    `services` first, then the cache, then one query for whatever is left.
+    """
+    geometries: Dict[str, dict] = {}
+    for token in tokens:
+        service_id = str(token['service_id'])
+        if service_id in geometries:
+            continue
+        if token.get('services'):
+            geometries[service_id] = cache_service_geometry(service_id, token['services'])
+        elif (cached := get_service_geometry(service_id)) is not None:
+            geometries[service_id] = cached
+    
+    missing = list({str(t['service_id']) for t in tokens} - set(geometries))
+    if missing:
+        res = await supabase.table("services").select("id, " + ", ".join(GEOMETRY_FIELDS)).in_("id", missing).execute()
+        for row in res.data or []:
+            geometries[row['id']] = cache_service_geometry(row['id'], row)
+    return geometries
+
+def invalidate_service(service_id: str) -> None:
+    """
+    Drop cached geometry for a service. Call after any write to `services`.
+    """
+    service_geometry_cache.invalidate(str(service_id))
@@ -0,0 +1,228 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+from supabase import AsyncClient
+from app.core.config import settings
+from app.core.database import get_supabase
+from app.utils.geo import MIN_METERS_PER_DEG, haversine_distance
+
+logger = logging.getLogger(__name__)
+
+INDEX_FIELDS = "id, name, latitude, longitude, presence_radius, status, organization_id"
+LOAD_PAGE_SIZE = 1000
+
+Cell = Tuple[int, int]
+
+def _far_cos(lat: float, meters: float) -> float:
+    # cos of the latitude farthest from the equator within `meters` of `lat`: degrees
+    # of longitude are shortest there
+    return math.cos(math.radians(min(90.0, abs(lat) + meters / MIN_METERS_PER_DEG)))
+
+def _lon_span(lat: float, meters: float) -> float:
+    # Degrees of longitude covering `meters` anywhere in the box; capped so the poles stay finite
+    return min(180.0, meters / (MIN_METERS_PER_DEG * max(_far_cos(lat, meters), 1e-6)))
+
+class ServiceGrid:
+    """
+    Fixed-size lat/long grid buckets over service locations. A radius query only
+    visits the cells overlapping the search box, so cost depends on the services
+    nearby rather than on the total number of services.
+    """
+
+    def __init__(self, cell_degrees: float):
+        self.cell_degrees = cell_degrees
+        # Longitude columns wrap at ±180°; the last one is narrower when cell_degrees doesn't divide 360
+        self.lon_cells = math.ceil(360.0 / cell_degrees)
+        self.cells: Dict[Cell, Dict[str, dict]] = {}
+        self.services: Dict[str, Tuple[Cell, dict]] = {}
+        self.max_presence_radius = 0.0
+
+    def __len__(self) -> int:
+        return len(self.services)
+
+    def _column(self, lon: float) -> int:
+        return math.floor(((lon + 180.0) % 360.0) / self.cell_degrees)
+
+    def _cell(self, lat: float, lon: float) -> Cell:
+        return (math.floor(lat / self.cell_degrees), self._column(lon))
+
+    def upsert(self, row: dict) -> None:
+        """
+        Insert a service or move it to its new cell. Rows without coordinates are dropped.
+        """
+        service_id = str(row['id'])
+        if row.get('latitude') is None or row.get('longitude') is None:
+            self.remove(service_id)
+            return
+        entry = {
+            "id": service_id,
+            "name": row.get('name'),
+            "latitude": float(row['latitude']),
+            "longitude": float(row['longitude']),
+            "presence_radius": float(row.get('presence_radius') or 0),
+            "status": row.get('status'),
+            "organization_id": row.get('organization_id'),
+        }
+        cell = self._cell(entry['latitude'], entry['longitude'])
+        previous = self.services.get(service_id)
+        if previous is not None and previous[0] != cell:
+            self._discard(previous[0], service_id)
+        self.cells.setdefault(cell, {})[service_id] = entry
+        self.services[service_id] = (cell, entry)
+        # Only grows; shrinks back on the next full reload
+        self.max_presence_radius = max(self.max_presence_radius, entry['presence_radius'])
+
+    def remove(self, service_id: str) -> None:
+        previous = self.services.pop(str(service_id), None)
+        if previous is not None:
+            self._discard(previous[0], str(service_id))
+
+    def _discard(self, cell: Cell, service_id: str) -> None:
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.pop(service_id, None)
+            if not bucket:
+                del self.cells[cell]
+
+    def _candidate_cells(self, lat: float, lon: float, meters: float):
+        dlat = meters / MIN_METERS_PER_DEG
+        dlon = _lon_span(lat, meters)
+        lat_lo = math.floor((lat - dlat) / self.cell_degrees)
+        lat_hi = math.floor((lat + dlat) / self.cell_degrees)
+        if 2 * dlon >= 360.0 - self.cell_degrees:
+            columns = range(self.lon_cells)
+        else:
+            # Walk east from the western edge, wrapping across the antimeridian
+            first = self._column(lon - dlon)
+            count = (self._column(lon + dlon) - first) % self.lon_cells + 1
+            columns = [(first + k) % self.lon_cells for k in range(count)]
+        if (lat_hi - lat_lo + 1) * len(columns) > len(self.cells):
+            # Huge search box: walking the occupied cells is cheaper than the empty ones
+            wanted = set(columns)
+            return [
+                bucket for (i, j), bucket in self.cells.items()
+                if lat_lo <= i <= lat_hi and j in wanted
+            ]
+        buckets = []
+        for i in range(lat_lo, lat_hi + 1):
+            for j in columns:
+                bucket = self.cells.get((i, j))
+                if bucket:
+                    buckets.append(bucket)
+        return buckets
+
+    def nearby(self, lat: float, lon: float, radius: Optional[float], limit: int, open_only: bool = False) -> List[dict]:
+        """
+        Services within `radius` meters of the point, nearest first. Without a radius,
+        services whose own presence_radius covers the point (i.e. joinable from here).
+        """
+        search = radius if radius is not None else self.max_presence_radius
+        # Equirectangular pre-reject with lower-bound degree lengths (never longer than the
+        # haversine distance, so nothing in range is rejected), haversine only for survivors
+        kx = MIN_METERS_PER_DEG * _far_cos(lat, search)
+        limit_sq = (search * 1.01 + 1) ** 2
+        found = []
+        for bucket in self._candidate_cells(lat, lon, search):
+            for entry in bucket.values():
+                dy = (entry['latitude'] - lat) * MIN_METERS_PER_DEG
+                dx = ((entry['longitude'] - lon + 180.0) % 360.0 - 180.0) * kx
+                if dx * dx + dy * dy > limit_sq or (open_only and entry['status'] != "OPEN"):
+                    continue
+                distance = haversine_distance(lat, lon, entry['latitude'], entry['longitude'])
+                if distance <= (radius if radius is not None else entry['presence_radius']):
+                    found.append((distance, entry))
+        nearest = heapq.nsmallest(limit, found, key=lambda item: item[0])
+        return [
+            {**entry, "distance": round(distance, 1), "in_range": distance <= entry['presence_radius']}
+            for distance, entry in nearest
+        ]
+
+class ServiceIndex:
+    """
+    Per-worker spatial index of all services for "find a queue near me". Built from
+    the services table on first use and rebuilt every NEARBY_REFRESH_SECONDS (to pick
+    up edits made outside this API, and deletions); the service write routes upsert
+    into it directly, so their changes are visible immediately.
+    """
+
+    def __init__(self):
+        self.grid: Optional[ServiceGrid] = None
+        self.loaded_at: Optional[float] = None
+        self.load_lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.pending: Optional[List[dict]] = None # upserts seen while a rebuild is reading
+
+    async def _load(self, supabase: AsyncClient) -> ServiceGrid:
+        grid = ServiceGrid(settings.NEARBY_CELL_DEGREES)
+        last_id = None
+        while True:
+            query = supabase.table("services").select(INDEX_FIELDS).order("id").limit(LOAD_PAGE_SIZE)
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            res = await query.execute()
+            rows = res.data or []
+            for row in rows:
+                grid.upsert(row)
+            if len(rows) < LOAD_PAGE_SIZE:
+                return grid
+            last_id = rows[-1]['id']
+
+    async def reload(self, supabase: AsyncClient) -> ServiceGrid:
+        started = time.perf_counter()
+        self.pending = []
+        try:
+            grid = await self._load(supabase)
+            # A write may have landed after its page was read; replay it before swapping
+            for row in self.pending:
+                grid.upsert(row)
+        finally:
+            self.pending = None
+        # Swap in whole, so readers never see a half-built index
+        self.grid = grid
+        self.loaded_at = time.monotonic()
+        logger.info("Service index: %d services in %d cells, built in %.1f ms",
+                    len(grid), len(grid.cells), (time.perf_counter() - started) * 1000)
+        return grid
+
+    async def ensure(self, supabase: AsyncClient) -> ServiceGrid:
+        if self.grid is not None:
+            return self.grid
+        async with self.load_lock:
+            if self.grid is None:
+                await self.reload(supabase)
+            return self.grid
+
+    def upsert(self, rows: List[dict]) -> None:
+        """
+        Apply rows returned by an insert/update on services.
+        """
+        if self.pending is not None:
+            self.pending.extend(rows or [])
+        if self.grid is not None:
+            for row in rows or []:
+                self.grid.upsert(row)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.reload(await get_supabase())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Service index reload failed: %s", e)
+            await asyncio.sleep(settings.NEARBY_REFRESH_SECONDS)
+
+    def start(self) -> None:
+        if settings.NEARBY_INDEX_ENABLED and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+service_index = ServiceIndex()
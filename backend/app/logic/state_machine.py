@@ -12,9 +12,9 @@ ACTIVE_STATES = {
 }
 
 VALID_TRANSITIONS = {
-    TokenState.CREATED: {TokenState.WAITING},
+    TokenState.CREATED: {TokenState.WAITING, TokenState.EXPIRED}, # never activated: swept like WAITING
     TokenState.WAITING: {TokenState.NEAR, TokenState.CONFIRMED, TokenState.MISSED, TokenState.EXPIRED},
-    TokenState.NEAR: {TokenState.CONFIMED, TokenState.CONFIRMING, TokenState.WAITING, TokenState.MISSED, TokenState.EXPIRED},
+    TokenState.NEAR: {TokenState.CONFIRMED, TokenState.CONFIRMING, TokenState.WAITING, TokenState.MISSED, TokenState.EXPIRED},
     TokenState.CONFIRMING: {TokenState.CONFIRMED, TokenState.NEAR, TokenState.MISSED, TokenState.EXPIRED},
     TokenState.CONFIRMED: {TokenState.CALLED, TokenState.MISSED, TokenState.EXPIRED},
     TokenState.CALLED: {TokenState.SERVING, TokenState.MISSED, TokenState.EXPIRED},
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+from app.core.config import settings
+from app.core.database import get_supabase
+from app.logic.eta import eta_estimator
+from app.logic.queue_store import queue_store_for
+from app.logic.scheduler import counter_scheduler
+
+logger = logging.getLogger(__name__)
+
+class TokenSweeper:
+    """
+    Background task that moves abandoned tokens to EXPIRED / MISSED in set-based batches,
+    then archives old finished tokens to tokens_history. Every worker runs one and sweeps
+    each interval; both RPCs take a transaction-level advisory lock, so batches never run
+    concurrently (a worker that finds the lock taken skips this round), but there is no
+    single leader.
+    """
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.last_report: Optional[dict] = None
+        self.last_archive_report: Optional[dict] = None
+
+    async def sweep_once(self) -> dict:
+        store = queue_store_for(await get_supabase())
+        started = time.perf_counter()
+        report = {"touched": 0, "counters_freed": 0, "batches": 0, "skipped": False, "services": {}}
+        
+        while True:
+            batch = await store.sweep(settings.WAITING_TIMEOUT_SECONDS, settings.CALLED_TIMEOUT_SECONDS, settings.SWEEP_BATCH_SIZE)
+            
+            if batch.get('skipped'):
+                # Another worker holds the sweep lock
+                report['skipped'] = True
+                break
+            
+            report['batches'] += 1
+            report['touched'] += batch.get('touched', 0)
+            report['counters_freed'] += batch.get('counters_freed', 0)
+            for service_id, counts in (batch.get('services') or {}).items():
+                totals = report['services'].setdefault(service_id, {"expired": 0, "missed": 0})
+                totals['expired'] += counts['expired']
+                totals['missed'] += counts['missed']
+                for _ in range(counts['expired'] + counts['missed']):
+                    eta_estimator.record_outcome(service_id, no_show=True)
+                if counts['missed']:
+                    counter_scheduler.counter_freed(service_id)
+            
+            if batch.get('touched', 0) < settings.SWEEP_BATCH_SIZE:
+                break
+        
+        report['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        report['finished_at'] = time.time()
+        self.last_report = report
+        if report['touched']:
+            logger.info(
+                "Token sweep: %d tokens in %d batches (%d counters freed) in %.1f ms",
+                report['touched'], report['batches'], report['counters_freed'], report['duration_ms']
+            )
+        return report
+
+    async def archive_once(self) -> dict:
+        store = queue_store_for(await get_supabase())
+        started = time.perf_counter()
+        report = {"moved": 0, "batches": 0, "skipped": False}
+        
+        while True:
+            batch = await store.archive(settings.ARCHIVE_AFTER_SECONDS, settings.ARCHIVE_BATCH_SIZE)
+            if batch.get('skipped'):
+                report['skipped'] = True
+                break
+            report['batches'] += 1
+            report['moved'] += batch.get('moved', 0)
+            if batch.get('moved', 0) < settings.ARCHIVE_BATCH_SIZE:
+                break
+        
+        report['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        report['finished_at'] = time.time()
+        self.last_archive_report = report
+        if report['moved']:
+            logger.info("Token archive: %d tokens in %d batches in %.1f ms", report['moved'], report['batches'], report['duration_ms'])
+        return report
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.sweep_once()
+                if settings.ARCHIVE_ENABLED:
+                    await self.archive_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Token sweep failed: %s", e)
+            await asyncio.sleep(settings.SWEEP_INTERVAL_SECONDS)
+
+    def start(self) -> None:
+        if settings.SWEEPER_ENABLED and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+token_sweeper = TokenSweeper()
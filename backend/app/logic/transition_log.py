@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Optional
+from app.core.config import settings
+from app.core.database import get_supabase
+
+logger = logging.getLogger(__name__)
+
+class TransitionLog:
+    """
+    Buffered writer of token_events for the in-memory engine, whose transitions never
+    reach the database triggers. record() only appends to a buffer; a background task
+    inserts the buffer in batches of TRANSITION_LOG_BATCH_SIZE every
+    TRANSITION_LOG_FLUSH_SECONDS (sooner once a batch is full), so requests never wait
+    on the log. A failed insert keeps its rows for the next flush, up to
+    TRANSITION_LOG_MAX_BUFFER events.
+    """
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.buffer: Deque[dict] = deque(maxlen=settings.TRANSITION_LOG_MAX_BUFFER)
+        self.wakeup = asyncio.Event()
+        self.written = 0
+        self.dropped = 0
+        self.last_report: Optional[dict] = None
+
+    def record(self, token: dict, from_state: Optional[str], actor: str) -> None:
+        if not settings.TRANSITION_LOG_ENABLED:
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append({
+            "at": datetime.now(timezone.utc).isoformat(),
+            "token_id": token['id'],
+            "service_id": token['service_id'],
+            "counter_id": token.get('counter_id'),
+            "from_state": from_state,
+            "to_state": token['state'],
+            "actor": actor,
+        })
+        if len(self.buffer) >= settings.TRANSITION_LOG_BATCH_SIZE:
+            self.wakeup.set()
+
+    async def flush(self) -> dict:
+        started = time.perf_counter()
+        report = {"written": 0, "batches": 0, "pending": 0}
+        supabase = await get_supabase()
+        try:
+            while self.buffer:
+                batch = [self.buffer.popleft() for _ in range(min(settings.TRANSITION_LOG_BATCH_SIZE, len(self.buffer)))]
+                try:
+                    await supabase.table("token_events").insert(batch).execute()
+                except Exception:
+                    # Back in front, in order, for the next flush. Events recorded during
+                    # the insert may have filled the buffer: drop the oldest of the batch
+                    # explicitly (extendleft would evict the newest) and count them
+                    overflow = max(0, len(batch) - (self.buffer.maxlen - len(self.buffer)))
+                    self.dropped += overflow
+                    self.buffer.extendleft(reversed(batch[overflow:]))
+                    raise
+                report['written'] += len(batch)
+                report['batches'] += 1
+        finally:
+            self.written += report['written']
+            report['pending'] = len(self.buffer)
+            report['dropped'] = self.dropped
+            report['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            self.last_report = report
+        return report
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), settings.TRANSITION_LOG_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            if not self.buffer:
+                continue
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Transition log flush failed (%d events pending): %s", len(self.buffer), e)
+                await asyncio.sleep(settings.TRANSITION_LOG_FLUSH_SECONDS)
+
+    def start(self) -> None:
+        if settings.TRANSITION_LOG_ENABLED and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+            # Last events of this worker
+            if self.buffer:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.warning("Transition log: %d events lost on shutdown: %s", len(self.buffer), e)
+
+transition_log = TransitionLog()
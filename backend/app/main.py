@@ -1,9 +1,40 @@
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from app.core.config import settings
+from app.core.database import init_supabase, close_supabase
+from app.core.metrics import MetricsMiddleware, render_metrics
+from app.logic.queue_feed import queue_feeds
+from app.logic.sweeper import token_sweeper
+from app.logic.service_index import service_index
+from app.logic.scheduler import counter_scheduler
+from app.logic.transition_log import transition_log
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.ADMIN_AUTH_DISABLED:
+        logger.warning("ADMIN_AUTH_DISABLED is set: /admin routes accept unauthenticated requests")
+    # Open the shared Supabase connection pool once per worker
+    await init_supabase()
+    token_sweeper.start()
+    service_index.start()
+    counter_scheduler.start()
+    transition_log.start()
+    yield
+    await counter_scheduler.stop()
+    await service_index.stop()
+    await token_sweeper.stop()
+    await transition_log.stop() # flushes the last events
+    await queue_feeds.close()
+    await close_supabase()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
 )
 
 from fastapi.middleware.cors import CORSMiddleware
@@ -16,15 +47,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if settings.METRICS_ENABLED:
+    # Added last so it wraps CORS too and times the whole request
+    app.add_middleware(MetricsMiddleware)
+
 # Placeholder for router inclusion
-from app.routers import queue, presence, service_flow, admin, organizations, auth
+from app.routers import queue, presence, service_flow, admin, organizations, auth, services
 app.include_router(queue.router, prefix=f"{settings.API_V1_STR}/queue", tags=["Queue"])
 app.include_router(presence.router, prefix=f"{settings.API_V1_STR}/presence", tags=["Presence"])
 app.include_router(service_flow.router, prefix=f"{settings.API_V1_STR}/flow", tags=["Service Flow"])
 app.include_router(admin.router, prefix=f"{settings.API_V1_STR}/admin", tags=["Admin"])
 app.include_router(organizations.router, prefix=f"{settings.API_V1_STR}/organizations", tags=["Organizations"])
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["Auth"])
+app.include_router(services.router, prefix=f"{settings.API_V1_STR}/services", tags=["Services"])
 
 @app.get("/")
 async def root():
     return {"message": "QueueLess+ System Active", "version": "0.1.0"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Per-route and per-Supabase-call latency histograms and error counts, Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
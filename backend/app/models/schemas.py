@@ -50,12 +50,26 @@ class TokenResponse(BaseModel):
     state: TokenState
     issued_at: datetime
     # Include other fields as needed for UI
+    position: Optional[int] = None # people still waiting ahead
+    estimated_wait_seconds: Optional[float] = None
 
 class VerifyPresenceRequest(BaseModel):
     token_id: UUID4
     lat: float
     long: float
 
+class VerifyPresenceBatchRequest(BaseModel):
+    pings: List[VerifyPresenceRequest] = Field(..., min_length=1, max_length=500)
+
+class PresenceResult(BaseModel):
+    token_id: UUID4
+    success: bool
+    state: Optional[TokenState] = None
+    distance: Optional[float] = None # meters
+    message: str
+    position: Optional[int] = None
+    estimated_wait_seconds: Optional[float] = None
+
 # --- Flow Models ---
 class EntryScanRequest(BaseModel):
     token_id: UUID4
@@ -64,6 +78,7 @@ class EntryScanRequest(BaseModel):
 class ExitScanRequest(BaseModel):
     token_id: UUID4
     exit_code: str # Simple validation string or QR content
+    auto_call_next: bool = True # Finish and call the next token in one atomic RPC
 
 # --- Auth Models ---
 class AuthExchangeRequest(BaseModel):
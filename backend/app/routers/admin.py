@@ -1,30 +1,58 @@
-from fastapi import APIRouter, HTTPException
+import logging
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from supabase import AsyncClient
+from app.core.config import settings
 from app.core.database import get_supabase
-from pydantic import BaseModel, UUID4
+from app.core.security import require_admin
+from app.logic.service_cache import invalidate_service
+from app.logic.list_cache import invalidate_org
+from app.logic.service_index import service_index
+from app.logic.eta import eta_estimator
+from app.logic.sweeper import token_sweeper
+from app.logic.queue_store import QueueStore, get_queue_store
+from app.logic.idempotency import idempotency_store
+from app.logic.scheduler import counter_scheduler
+from app.logic.state_machine import can_transition
+from app.logic.transition_log import transition_log
+from app.models.schemas import CounterStatus, TokenState
+from pydantic import BaseModel, Field, UUID4
 
-router = APIRouter()
+logger = logging.getLogger(__name__)
+
+router = APIRouter(dependencies=[Depends(require_admin)])
 
 class CallNextRequest(BaseModel):
     service_id: UUID4
     counter_id: UUID4
 
 @router.post("/call-next")
-async def call_next(request: CallNextRequest):
-    supabase = get_supabase()
+async def call_next(
+    request: CallNextRequest,
+    store: QueueStore = Depends(get_queue_store),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Calls the next confirmed token to the counter. A double tap sent with the same
+    Idempotency-Key returns the first call instead of calling a second person.
+    """
+    return await idempotency_store.run("admin/call-next", idempotency_key, request, lambda: _call_next(request, store))
+
+async def _call_next(request: CallNextRequest, store: QueueStore) -> dict:
     try:
-        res = supabase.rpc('call_next_token', {
-            'p_service_id': str(request.service_id),
-            'p_counter_id': str(request.counter_id)
-        }).execute()
+        token = await store.call_next(str(request.service_id), str(request.counter_id))
         
-        if not res.data:
+        if not token:
             return {"success": False, "message": "No confirmed tokens waiting."}
             
-        return {"success": True, "token": res.data}
+        return {"success": True, "token": token}
         
     except Exception as e:
         if "Counter is busy" in str(e):
              raise HTTPException(status_code=409, detail="Counter is currently busy.")
+        if "Counter is offline" in str(e):
+             raise HTTPException(status_code=409, detail="Counter is offline.")
         raise HTTPException(status_code=500, detail=str(e))
 
 class CancelTokenRequest(BaseModel):
@@ -32,20 +60,105 @@ class CancelTokenRequest(BaseModel):
     reason: str = "Admin cancelled"
 
 @router.post("/cancel-token")
-async def cancel_token(request: CancelTokenRequest):
-    supabase = get_supabase()
-    # Direct update for MVP (Ideally RPC for audit log)
-    res = supabase.table("tokens").update({"state": "MISSED"}).eq("id", str(request.token_id)).execute()
-    return {"success": True, "data": res.data}
+async def cancel_token(request: CancelTokenRequest, store: QueueStore = Depends(get_queue_store)):
+    # Only tokens allowed to move to MISSED (VALID_TRANSITIONS) are cancelled
+    token = await store.cancel(str(request.token_id))
+    if token:
+        eta_estimator.record_outcome(token['service_id'], no_show=True)
+        if token.get('counter_id'):
+            # A called token was cancelled: its counter can take the next one
+            counter_scheduler.counter_freed(token['service_id'])
+    return {"success": True, "data": [token] if token else []}
+
+class BulkTokenRequest(BaseModel):
+    token_ids: Optional[List[UUID4]] = Field(None, max_length=settings.BULK_MAX_TOKENS)
+    service_id: Optional[UUID4] = None # instead of token_ids: the service's tokens in `states`
+    states: Optional[List[TokenState]] = None # with service_id; default every state that can make the move
+    limit: int = Field(settings.BULK_MAX_TOKENS, ge=1, le=settings.BULK_MAX_TOKENS)
+
+async def _bulk_transition(request: BulkTokenRequest, state: TokenState, store: QueueStore) -> dict:
+    # 1. Exactly one selector; a state filter only applies to a service
+    if (request.token_ids is None) == (request.service_id is None):
+        raise HTTPException(status_code=400, detail="Send either token_ids or service_id.")
+    if request.states and request.token_ids is not None:
+        raise HTTPException(status_code=400, detail="states can only filter a service_id.")
+    stuck = [s.value for s in request.states or [] if not can_transition(s, state)]
+    if stuck:
+        raise HTTPException(status_code=400, detail=f"{', '.join(stuck)} tokens cannot move to {state.value}.")
+
+    # 2. One set-based transition; invalid moves come back as per-row outcomes
+    token_ids = list(dict.fromkeys(str(t) for t in request.token_ids)) if request.token_ids is not None else None
+    results = await store.bulk_transition(
+        state, token_ids=token_ids, service_id=str(request.service_id) if request.service_id else None,
+        states=request.states, limit=request.limit
+    )
+
+    # 3. Same bookkeeping as the single-token routes
+    freed = set()
+    for row in results:
+        token = row.get('token')
+        if row['outcome'] != "applied" or not token:
+            continue
+        if state == TokenState.DONE:
+            eta_estimator.record_service(token)
+        else:
+            eta_estimator.record_outcome(token['service_id'], no_show=True)
+        if token.get('counter_id'):
+            freed.add(token['service_id'])
+    for service_id in freed:
+        counter_scheduler.counter_freed(service_id)
+
+    applied = sum(1 for row in results if row['outcome'] == "applied")
+    return {"success": True, "applied": applied, "rejected": len(results) - applied, "results": results}
+
+@router.post("/bulk-cancel")
+async def bulk_cancel(request: BulkTokenRequest, store: QueueStore = Depends(get_queue_store)):
+    """
+    Cancels (-> MISSED) many tokens in one transaction, e.g. every WAITING token of a
+    service at closing time. Tokens that cannot be cancelled are reported per row.
+    """
+    return await _bulk_transition(request, TokenState.MISSED, store)
+
+@router.post("/bulk-complete")
+async def bulk_complete(request: BulkTokenRequest, store: QueueStore = Depends(get_queue_store)):
+    """
+    Completes (SERVING -> DONE) many tokens in one transaction and frees their counters.
+    """
+    return await _bulk_transition(request, TokenState.DONE, store)
 
 class ToggleServiceRequest(BaseModel):
     service_id: UUID4
     status: str # OPEN or CLOSED
 
 @router.post("/toggle-service")
-async def toggle_service(request: ToggleServiceRequest):
-    supabase = get_supabase()
-    res = supabase.table("services").update({"status": request.status}).eq("id", str(request.service_id)).execute()
+async def toggle_service(
+    request: ToggleServiceRequest,
+    supabase: AsyncClient = Depends(get_supabase),
+    store: QueueStore = Depends(get_queue_store)
+):
+    res = await supabase.table("services").update({"status": request.status}).eq("id", str(request.service_id)).execute()
+    invalidate_service(request.service_id)
+    service_index.upsert(res.data)
+    if res.data:
+        invalidate_org(res.data[0].get('organization_id'))
+        await store.set_service_status(str(request.service_id), request.status)
+    if not res.data:
+        return {"success": False, "message": "Service not found or update failed"}
+    return {"success": True, "data": res.data}
+
+class UpdateRadiusRequest(BaseModel):
+    service_id: UUID4
+    presence_radius: float # meters
+
+@router.post("/update-radius")
+async def update_radius(request: UpdateRadiusRequest, supabase: AsyncClient = Depends(get_supabase)):
+    if request.presence_radius <= 0:
+        raise HTTPException(status_code=400, detail="Presence radius must be positive")
+    res = await supabase.table("services").update({"presence_radius": request.presence_radius}).eq("id", str(request.service_id)).execute()
+    invalidate_service(request.service_id)
+    service_index.upsert(res.data)
+    for service in res.data or []:
+        invalidate_org(service.get('organization_id'))
     if not res.data:
         return {"success": False, "message": "Service not found or update failed"}
     return {"success": True, "data": res.data}
@@ -54,58 +167,233 @@ class CompleteTokenRequest(BaseModel):
     token_id: UUID4
 
 @router.post("/complete-token")
-async def complete_token(request: CompleteTokenRequest):
-    supabase = get_supabase()
-    # Mark as DONE
-    res = supabase.table("tokens").update({"state": "DONE"}).eq("id", str(request.token_id)).execute()
+async def complete_token(request: CompleteTokenRequest, store: QueueStore = Depends(get_queue_store)):
+    # Same transition as the exit scan: SERVING -> DONE, counter freed
+    try:
+        finished = await store.end(str(request.token_id))
+    except Exception as e:
+        if "Token is not currently serving" in str(e):
+            raise HTTPException(status_code=400, detail="Token is not currently SERVING.")
+        if "Token not found" not in str(e):
+            raise HTTPException(status_code=500, detail=str(e))
+        finished = None
     
-    if not res.data:
+    if not finished:
         return {"success": False, "message": "Token not found or already completed"}
-        
-    return {"success": True, "token": res.data[0]}
+    
+    eta_estimator.record_service(finished)
+    if finished.get('counter_id'):
+        counter_scheduler.counter_freed(finished['service_id'])
+    return {"success": True, "token": finished}
 
 class EnsureCounterRequest(BaseModel):
     service_id: UUID4
 
 @router.post("/ensure-counter")
-async def ensure_counter(request: EnsureCounterRequest):
-    supabase = get_supabase()
+async def ensure_counter(
+    request: EnsureCounterRequest,
+    supabase: AsyncClient = Depends(get_supabase),
+    store: QueueStore = Depends(get_queue_store)
+):
     # Check if exists
-    res = supabase.table("counters").select("*").eq("service_id", str(request.service_id)).limit(1).execute()
+    res = await supabase.table("counters").select("*").eq("service_id", str(request.service_id)).limit(1).execute()
     if res.data and len(res.data) > 0:
+        await store.sync_counters(res.data)
         return {"success": True, "counter": res.data[0]}
     
     # Create
     try:
-        new_res = supabase.table("counters").insert({
+        new_res = await supabase.table("counters").insert({
             "service_id": str(request.service_id), 
             "name": "Counter 1"
         }).execute()
         
         if new_res.data:
+             await store.sync_counters(new_res.data)
+             counter_scheduler.counter_freed(request.service_id)
              return {"success": True, "counter": new_res.data[0]}
     except Exception as e:
-        print(f"Error creating counter: {e}")
-        pass
+        logger.error("Error creating counter: %s", e)
         
     raise HTTPException(status_code=500, detail="Failed to create default counter")
 
+@router.get("/counters/{service_id}")
+async def list_counters(
+    service_id: UUID4,
+    supabase: AsyncClient = Depends(get_supabase),
+    store: QueueStore = Depends(get_queue_store)
+):
+    res = await supabase.table("counters").select("*").eq("service_id", str(service_id)).order("created_at").execute()
+    await store.sync_counters(res.data)
+    return {"success": True, "data": res.data or []}
+
+class AddCounterRequest(BaseModel):
+    service_id: UUID4
+    name: str
+    skills: Optional[List[str]] = None # token skills handled here; None = all
+    weight: int = Field(1, ge=1, le=100) # higher weight is dispatched to first
+
+@router.post("/add-counter")
+async def add_counter(
+    request: AddCounterRequest,
+    supabase: AsyncClient = Depends(get_supabase),
+    store: QueueStore = Depends(get_queue_store)
+):
+    res = await supabase.table("counters").insert({
+        "service_id": str(request.service_id),
+        "name": request.name,
+        "skills": request.skills,
+        "weight": request.weight
+    }).execute()
+    if not res.data:
+        raise HTTPException(status_code=500, detail="Failed to create counter")
+    await store.sync_counters(res.data)
+    counter_scheduler.counter_freed(request.service_id)
+    return {"success": True, "counter": res.data[0]}
+
+class UpdateCounterRequest(BaseModel):
+    counter_id: UUID4
+    name: Optional[str] = None
+    skills: Optional[List[str]] = None
+    weight: Optional[int] = Field(None, ge=1, le=100)
+
+@router.post("/update-counter")
+async def update_counter(
+    request: UpdateCounterRequest,
+    supabase: AsyncClient = Depends(get_supabase),
+    store: QueueStore = Depends(get_queue_store)
+):
+    # Only the fields sent are changed; "skills": null makes the counter serve all skills
+    changes = request.model_dump(exclude_unset=True, exclude={"counter_id"})
+    if not changes:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    res = await supabase.table("counters").update(changes).eq("id", str(request.counter_id)).execute()
+    if not res.data:
+        return {"success": False, "message": "Counter not found or update failed"}
+    await store.sync_counters(res.data)
+    counter_scheduler.kick(res.data[0]['service_id'])
+    return {"success": True, "counter": res.data[0]}
+
+class CounterStatusRequest(BaseModel):
+    counter_id: UUID4
+    status: CounterStatus # FREE or OFFLINE; BUSY is set by entry scans
+
+@router.post("/set-counter-status")
+async def set_counter_status(request: CounterStatusRequest, store: QueueStore = Depends(get_queue_store)):
+    if request.status == CounterStatus.BUSY:
+        raise HTTPException(status_code=400, detail="Counter status BUSY is set by entry scans.")
+    try:
+        counter = await store.set_counter_status(str(request.counter_id), request.status.value)
+    except Exception as e:
+        if "Counter is busy" in str(e):
+             raise HTTPException(status_code=409, detail="Counter is serving or has someone called.")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not counter:
+        raise HTTPException(status_code=404, detail="Counter not found")
+    if counter['status'] == CounterStatus.FREE and counter.get('service_id'):
+        counter_scheduler.counter_freed(counter['service_id'])
+    return {"success": True, "counter": counter}
+
+class RouteTokenRequest(BaseModel):
+    token_id: UUID4
+    priority: int = Field(0, ge=0, le=9) # lane: higher is called first
+    skill: Optional[str] = None # only counters with this skill (or no skill list) call it
+
+@router.post("/route-token")
+async def route_token(request: RouteTokenRequest, store: QueueStore = Depends(get_queue_store)):
+    token = await store.route(str(request.token_id), request.priority, request.skill)
+    if not token:
+        raise HTTPException(status_code=400, detail="Token not found or no longer waiting.")
+    if token['state'] == "CONFIRMED":
+        counter_scheduler.kick(token['service_id'])
+    return {"success": True, "token": token}
+
+@router.post("/dispatch/{service_id}")
+async def dispatch(service_id: UUID4, store: QueueStore = Depends(get_queue_store)):
+    """
+    Runs auto-dispatch for a service now: every idle counter calls its next token.
+    """
+    return {"success": True, **await counter_scheduler.dispatch(str(service_id), store)}
+
+@router.get("/sweeper")
+async def sweeper_status():
+    """
+    Report of the last stale-token sweep run by this worker.
+    """
+    return {
+        "success": True,
+        "enabled": token_sweeper.task is not None,
+        "last_report": token_sweeper.last_report,
+        "last_archive_report": token_sweeper.last_archive_report
+    }
+
+@router.post("/sweeper/run")
+async def run_sweeper():
+    return {"success": True, "report": await token_sweeper.sweep_once()}
+
+@router.post("/archive/run")
+async def run_archive():
+    return {"success": True, "report": await token_sweeper.archive_once()}
+
+@router.get("/history/{service_id}")
+async def token_history(
+    service_id: UUID4,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(200, ge=1, le=1000),
+    store: QueueStore = Depends(get_queue_store)
+):
+    """
+    Tokens of a service issued in [since, until), newest first, including archived ones.
+    """
+    return {"success": True, "data": await store.history(str(service_id), since, until, limit)}
+
+EVENT_FIELDS = "at, token_id, service_id, counter_id, from_state, to_state, actor"
+
+@router.get("/events")
+async def token_events(
+    service_id: Optional[UUID4] = None,
+    token_id: Optional[UUID4] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    supabase: AsyncClient = Depends(get_supabase)
+):
+    """
+    Token state transitions in [since, until), oldest first, from the append-only
+    token_events log. Longer ranges are read as consecutive [since, until) windows.
+    """
+    if not (service_id or token_id or since):
+        raise HTTPException(status_code=400, detail="Filter by service_id, token_id or since.")
+    query = supabase.table("token_events").select(EVENT_FIELDS)
+    if service_id:
+        query = query.eq("service_id", str(service_id))
+    if token_id:
+        query = query.eq("token_id", str(token_id))
+    if since:
+        query = query.gte("at", since.isoformat())
+    if until:
+        query = query.lt("at", until.isoformat())
+    res = await query.order("at").limit(limit).execute()
+    return {"success": True, "data": res.data or [], "pending_writes": len(transition_log.buffer)}
+
 class ClaimOrphansRequest(BaseModel):
     organization_id: UUID4
 
 @router.post("/claim-orphans")
-async def claim_orphans(request: ClaimOrphansRequest):
+async def claim_orphans(request: ClaimOrphansRequest, supabase: AsyncClient = Depends(get_supabase)):
     # Use standard client - in this backend setup, it often uses the Service Role Key 
     # if configured in .env with SUPABASE_KEY=service_role_key. 
     # If it uses ANON key, this might fail unless RLS allows it (which it definitely won't for orphans).
     # Assuming backend has privileged access.
-    supabase = get_supabase()
     
     try:
         # 1. Update services where organization_id is NULL
-        res = supabase.table("services").update({
+        res = await supabase.table("services").update({
             "organization_id": str(request.organization_id)
         }).is_("organization_id", "null").execute()
+        invalidate_org(request.organization_id)
+        service_index.upsert(res.data)
         
         return {
             "success": True, 
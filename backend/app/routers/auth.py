@@ -1,35 +1,56 @@
-from fastapi import APIRouter, HTTPException
+import logging
+from fastapi import APIRouter, HTTPException, Depends
+from pydantic import UUID4, BaseModel
+from supabase import AsyncClient
 from app.core.database import get_supabase
+from app.core.security import authenticate, get_user_role, invalidate_role, require_admin, InvalidTokenError, VerificationUnavailable
 from app.models.schemas import AuthExchangeRequest, AuthResponse, ProfileResponse
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 @router.post("/exchange", response_model=AuthResponse)
-async def exchange_token(request: AuthExchangeRequest):
-    supabase = get_supabase()
+async def exchange_token(request: AuthExchangeRequest, supabase: AsyncClient = Depends(get_supabase)):
+    # Verify the token locally (cached signing keys + cached role)
+    try:
+        user = await authenticate(request.access_token, supabase)
+        return AuthResponse(
+            user_id=user.id,
+            email=user.email,
+            profile=ProfileResponse(role=user.role)
+        )
+    except VerificationUnavailable:
+        # No local key for this token, fall back to Supabase Auth below
+        pass
+    except InvalidTokenError as e:
+        raise HTTPException(status_code=401, detail=f"Authentication failed: {str(e)}")
     
     # Verify the token using Supabase Auth
     try:
-        user_response = supabase.auth.get_user(request.access_token)
+        user_response = await supabase.auth.get_user(request.access_token)
         user = user_response.user
         
         if not user:
              raise HTTPException(status_code=401, detail="Invalid token")
              
-        # Fetch user profile/role
-        # Assuming 'profiles' table has 'id' matching auth.users.id
-        profile_response = supabase.table('profiles').select('role').eq('id', user.id).single().execute()
-        
-        role = "USER" # Default role
-        if profile_response.data:
-            role = profile_response.data.get('role', 'USER')
-            
         return AuthResponse(
             user_id=user.id,
             email=user.email,
-            profile=ProfileResponse(role=role)
+            profile=ProfileResponse(role=await get_user_role(supabase, user.id))
         )
         
     except Exception as e:
-        print(f"Auth Exchange Error: {e}")
+        logger.warning("Auth exchange failed: %s", e)
         raise HTTPException(status_code=401, detail=f"Authentication failed: {str(e)}")
+
+class InvalidateRoleRequest(BaseModel):
+    user_id: UUID4
+
+@router.post("/invalidate-role", dependencies=[Depends(require_admin)])
+async def invalidate_cached_role(request: InvalidateRoleRequest):
+    """
+    Drop a cached role after changing `profiles.role` (this worker only; others expire via ROLE_CACHE_TTL).
+    """
+    invalidate_role(request.user_id)
+    return {"success": True}
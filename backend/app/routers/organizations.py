@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from pydantic import BaseModel, IPvAnyAddress
 from typing import List, Optional
 from uuid import UUID
 from datetime import datetime
+from supabase import AsyncClient
 from app.core.database import get_supabase
+from app.logic.service_cache import invalidate_service
+from app.logic.list_cache import cached_json, etag_response, invalidate_org
+from app.logic.service_index import service_index
+from app.logic.queue_store import QueueStore, get_queue_store
 
 router = APIRouter(prefix="/v1/organizations", tags=["organizations"])
 
@@ -27,18 +32,66 @@ class Service(BaseModel):
     status: str
     organization_id: UUID
 
+# Columns clients may request via `fields` (id is always included, it is the cursor)
+ORGANIZATION_FIELDS = ("id", "name", "owner_id", "created_at")
+SERVICE_FIELDS = ("id", "name", "latitude", "longitude", "presence_radius", "status", "organization_id", "created_at", "updated_at")
+
+def _projection(fields: Optional[str], allowed: tuple) -> str:
+    if not fields:
+        return ", ".join(allowed)
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown:
+        raise HTTPException(400, f"Unknown fields: {', '.join(unknown)}")
+    return ", ".join(["id"] + [f for f in requested if f != "id"])
+
+PAGE_SIZE = 100 # when a cursor is sent without a limit
+
+async def _page(query, cursor: Optional[UUID], limit: Optional[int]) -> dict:
+    """
+    Keyset page ordered by id: `cursor` is the last id of the previous page. Without
+    cursor and limit every row is returned, as before pagination existed.
+    """
+    if cursor is None and limit is None:
+        res = await query.order("id").execute()
+        return {"success": True, "data": res.data or [], "next_cursor": None}
+    limit = limit or PAGE_SIZE
+    if cursor:
+        query = query.gt("id", str(cursor))
+    res = await query.order("id").limit(limit + 1).execute()
+    rows = res.data or []
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {"success": True, "data": rows, "next_cursor": rows[-1]['id'] if has_more else None}
+
 @router.get("/my-orgs")
-async def get_my_organizations():
-    supabase = get_supabase()
+async def get_my_organizations(
+    request: Request,
+    fields: Optional[str] = None,
+    cursor: Optional[UUID] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    supabase: AsyncClient = Depends(get_supabase)
+):
+    """
+    Organizations, all of them or paginated by `limit` / `cursor` / `next_cursor`.
+    Identical concurrent reads share one query, and If-None-Match gets 304. Organizations
+    are only written outside this API, so a cached list is refreshed after LIST_CACHE_TTL.
+    """
     # RLS should handle filtering, but we can also be explicit if we used the function manually
     # For now, rely on RLS with standard select
-    res = supabase.table("organizations").select("*").execute()
-    return {"success": True, "data": res.data}
+    columns = _projection(fields, ORGANIZATION_FIELDS)
+    entry = await cached_json("orgs", (columns, cursor, limit), lambda: _page(
+        supabase.table("organizations").select(columns), cursor, limit
+    ))
+    return etag_response(request, entry)
 
 @router.post("/{org_id}/services")
-async def create_service_for_org(org_id: UUID, service: ServiceCreate):
-    supabase = get_supabase()
-    
+async def create_service_for_org(
+    org_id: UUID,
+    service: ServiceCreate,
+    supabase: AsyncClient = Depends(get_supabase),
+    store: QueueStore = Depends(get_queue_store)
+):
     # 1. Verify membership/permission (RLS does this, but good to check org_id match)
     if str(org_id) != str(service.organization_id):
         raise HTTPException(400, "Organization ID mismatch")
@@ -53,7 +106,7 @@ async def create_service_for_org(org_id: UUID, service: ServiceCreate):
         "organization_id": str(org_id)
     }
     
-    res = supabase.table("services").insert(data).execute()
+    res = await supabase.table("services").insert(data).execute()
     
     if not res.data:
          # Likely RLS rejection if not admin
@@ -61,12 +114,29 @@ async def create_service_for_org(org_id: UUID, service: ServiceCreate):
          
     # 3. Create Default Counter (Optional, but good for MVP)
     svc_id = res.data[0]['id']
-    supabase.table("counters").insert({"service_id": svc_id, "name": "Counter 1"}).execute()
+    invalidate_service(svc_id)
+    invalidate_org(org_id)
+    service_index.upsert(res.data)
+    counter = await supabase.table("counters").insert({"service_id": svc_id, "name": "Counter 1"}).execute()
+    await store.sync_counters(counter.data)
 
     return {"success": True, "data": res.data[0]}
 
 @router.get("/{org_id}/services")
-async def get_org_services(org_id: UUID):
-    supabase = get_supabase()
-    res = supabase.table("services").select("*").eq("organization_id", str(org_id)).execute()
-    return {"success": True, "data": res.data}
+async def get_org_services(
+    org_id: UUID,
+    request: Request,
+    fields: Optional[str] = None,
+    cursor: Optional[UUID] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    supabase: AsyncClient = Depends(get_supabase)
+):
+    """
+    Services of an organization, all of them or paginated by `limit` / `cursor` /
+    `next_cursor`, projected to `fields`. Cached until a service of the organization is written (or LIST_CACHE_TTL).
+    """
+    columns = _projection(fields, SERVICE_FIELDS)
+    entry = await cached_json(f"org:{org_id}", (columns, cursor, limit), lambda: _page(
+        supabase.table("services").select(columns).eq("organization_id", str(org_id)), cursor, limit
+    ))
+    return etag_response(request, entry)
@@ -1,27 +1,45 @@
-from fastapi import APIRouter, HTTPException
-from app.models.schemas import VerifyPresenceRequest, TokenResponse
+from fastapi import APIRouter, HTTPException, Depends
+from typing import List
+from app.models.schemas import VerifyPresenceRequest, VerifyPresenceBatchRequest, PresenceResult, TokenResponse, TokenState
+from supabase import AsyncClient
+from app.core.config import settings
 from app.core.database import get_supabase
-from app.utils.geo import is_within_radius
+from app.utils.geo import is_within_radius, haversine_many
+from app.logic.service_cache import token_service_cache, get_service_geometry, load_service_geometries
+from app.logic.state_machine import can_transition
+from app.logic.eta import position_estimate
+from app.logic.queue_store import QueueStore, get_queue_store
+from app.logic.scheduler import counter_scheduler
 
 router = APIRouter()
 
+CONFIRMED_STATES = {TokenState.CONFIRMED, TokenState.CALLED, TokenState.SERVING}
+FINISHED_STATES = {TokenState.DONE, TokenState.MISSED, TokenState.EXPIRED}
+WAITING_STATES = {TokenState.WAITING, TokenState.NEAR, TokenState.CONFIRMING, TokenState.CONFIRMED}
+
 @router.post("/verify")
-async def verify_presence(request: VerifyPresenceRequest):
-    supabase = get_supabase()
-    
-    # 1. Fetch Token
-    token_res = supabase.table("tokens").select("*").eq("id", str(request.token_id)).single().execute()
-    if not token_res.data:
-         raise HTTPException(status_code=404, detail="Token not found")
+async def verify_presence(
+    request: VerifyPresenceRequest,
+    supabase: AsyncClient = Depends(get_supabase),
+    store: QueueStore = Depends(get_queue_store)
+):
+    token_id = str(request.token_id)
     
-    token = token_res.data
+    # 1. Resolve service geometry from cache (token -> service -> geometry)
+    service_id = token_service_cache.get(token_id)
+    service = get_service_geometry(service_id) if service_id else None
     
-    # 2. Fetch Service for location
-    svc_res = supabase.table("services").select("latitude, longitude, presence_radius").eq("id", token['service_id']).single().execute()
-    if not svc_res.data:
-         raise HTTPException(status_code=404, detail="Service not found")
-         
-    service = svc_res.data
+    # 2. Cache miss: fetch the token (Postgres joins the service geometry into the same query)
+    if service is None:
+        rows = await store.get_many([token_id])
+        if not rows:
+             raise HTTPException(status_code=404, detail="Token not found")
+        
+        service_id = rows[0]['service_id']
+        service = (await load_service_geometries(supabase, rows)).get(str(service_id))
+        if service is None:
+             raise HTTPException(status_code=404, detail="Service not found")
+        token_service_cache.set(token_id, service_id)
     
     # 3. Check Distance
     in_range = is_within_radius(
@@ -31,12 +49,131 @@ async def verify_presence(request: VerifyPresenceRequest):
     )
     
     if in_range:
-        # 4. Update State Logic (via RPC to be safe/atomic)
+        # 4. Update State Logic (atomic in the queue store)
         try:
-            rpc_res = supabase.rpc('confirm_token', {'p_token_id': str(request.token_id)}).execute()
-            return {"success": True, "message": "You are confirmed.", "token": rpc_res.data}
+            confirmed = await store.confirm(token_id)
         except Exception as e:
              raise HTTPException(status_code=500, detail=str(e))
+        
+        response = {"success": True, "message": "You are confirmed.", "token": confirmed}
+        if confirmed and confirmed.get('state') == TokenState.CONFIRMED:
+            counter_scheduler.token_confirmed(service_id)
+        if confirmed and confirmed.get('state') in WAITING_STATES:
+            [ahead] = await store.people_ahead([(service_id, confirmed['token_number'])])
+            response.update(position_estimate(service_id, ahead))
+        return response
     else:
         # Just return failure, don't expire yet? Or maybe warning.
         return {"success": False, "message": "You are too far from the service location."}
+
+PRESENCE_MESSAGES = {
+    TokenState.CONFIRMED: "You are confirmed.",
+    TokenState.NEAR: "You are near the service location.",
+    TokenState.WAITING: "You are too far from the service location.",
+}
+
+@router.post("/verify-batch", response_model=List[PresenceResult])
+async def verify_presence_batch(
+    request: VerifyPresenceBatchRequest,
+    supabase: AsyncClient = Depends(get_supabase),
+    store: QueueStore = Depends(get_queue_store)
+):
+    """
+    Batch presence check for periodic location pings.
+    Transitions: WAITING/NEAR -> CONFIRMED inside the radius,
+    WAITING -> NEAR inside NEAR_RADIUS_FACTOR * radius, NEAR -> WAITING beyond it.
+    """
+    # Last ping wins if a token appears more than once
+    pings = {str(p.token_id): p for p in request.pings}
+    token_ids = list(pings)
+    
+    # 1. Fetch all tokens with their service geometry (one query on Postgres)
+    rows = await store.get_many(token_ids)
+    geometries = await load_service_geometries(supabase, rows)
+    
+    tokens = {}
+    for row in rows:
+        service = geometries.get(str(row['service_id']))
+        if service is None:
+            continue
+        token_service_cache.set(row['id'], row['service_id'])
+        row['services'] = service
+        tokens[row['id']] = row
+    
+    results = {
+        token_id: PresenceResult(token_id=token_id, success=False, message="Token not found")
+        for token_id in token_ids if token_id not in tokens
+    }
+    found = [token_id for token_id in token_ids if token_id in tokens]
+    
+    # 2. Evaluate all distances in one vectorized pass
+    distances = haversine_many(
+        [pings[t].lat for t in found], [pings[t].long for t in found],
+        [tokens[t]['services']['latitude'] for t in found], [tokens[t]['services']['longitude'] for t in found],
+    )
+    
+    # 3. Decide transitions
+    updates = []
+    targets = {}
+    for token_id, distance in zip(found, distances.tolist()):
+        state = TokenState(tokens[token_id]['state'])
+        radius = tokens[token_id]['services']['presence_radius']
+        
+        if state in CONFIRMED_STATES:
+            results[token_id] = PresenceResult(token_id=token_id, success=True, state=state, distance=distance, message="Already confirmed.")
+            continue
+        if state in FINISHED_STATES:
+            results[token_id] = PresenceResult(token_id=token_id, success=False, state=state, distance=distance, message="Token invalid or finished")
+            continue
+        
+        if distance <= radius:
+            target = TokenState.CONFIRMED
+        elif distance <= radius * settings.NEAR_RADIUS_FACTOR:
+            target = TokenState.NEAR
+        else:
+            target = TokenState.WAITING
+        
+        targets[token_id] = (target, distance)
+        if target != state and can_transition(state, target):
+            updates.append({"token_id": token_id, "from_state": state.value, "to_state": target.value})
+        else:
+            results[token_id] = PresenceResult(
+                token_id=token_id, success=state == TokenState.CONFIRMED, state=state,
+                distance=distance, message=PRESENCE_MESSAGES.get(target, "No change.")
+            )
+    
+    # 4. Apply every transition in one set-based call
+    if updates:
+        try:
+            applied = {row['id']: row for row in await store.apply_presence(updates)}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        
+        for service_id in {tokens[t]['service_id'] for t, row in applied.items() if row['state'] == TokenState.CONFIRMED}:
+            counter_scheduler.token_confirmed(service_id)
+        
+        for update in updates:
+            token_id = update['token_id']
+            target, distance = targets[token_id]
+            if token_id in applied:
+                results[token_id] = PresenceResult(
+                    token_id=token_id, success=target == TokenState.CONFIRMED,
+                    state=applied[token_id]['state'], distance=distance, message=PRESENCE_MESSAGES[target]
+                )
+            else:
+                # Token moved on between the read and the update (called, cancelled, ...)
+                results[token_id] = PresenceResult(
+                    token_id=token_id, success=False, state=update['from_state'],
+                    distance=distance, message="Token state changed, please retry."
+                )
+    
+    # 5. Position + ETA for tokens still in line (one lookup for all services)
+    in_line = [r for r in results.values() if r.state in WAITING_STATES]
+    if in_line:
+        keys = [(tokens[str(r.token_id)]['service_id'], tokens[str(r.token_id)]['token_number']) for r in in_line]
+        for r, (service_id, _), ahead in zip(in_line, keys, await store.people_ahead(keys)):
+            estimate = position_estimate(service_id, ahead)
+            r.position = estimate['position']
+            r.estimated_wait_seconds = estimate['estimated_wait_seconds']
+    
+    return [results[token_id] for token_id in token_ids]
@@ -1,33 +1,134 @@
-from fastapi import APIRouter, HTTPException
-from app.core.database import get_supabase
+import asyncio
+import json
+import logging
+from fastapi import APIRouter, HTTPException, Depends, Header, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from uuid import UUID
+from app.core.config import settings
+from app.logic.queue_feed import queue_feeds
+from app.logic.eta import eta_estimator, position_estimate
+from app.logic.queue_store import QueueStore, get_queue_store
+from app.logic.idempotency import idempotency_store
+from app.logic.admission import join_admission
 from app.models.schemas import JoinQueueRequest, TokenResponse
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 @router.post("/join", response_model=TokenResponse)
-async def join_queue(request: JoinQueueRequest):
-    supabase = get_supabase()
-    
-    # Use RPC for atomic issuing
+async def join_queue(
+    request: JoinQueueRequest,
+    store: QueueStore = Depends(get_queue_store),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Issues a token. Retries carrying the same Idempotency-Key get the original response.
+    Join storms are throttled per service and per user (429 + Retry-After).
+    """
+    return await idempotency_store.run("queue/join", idempotency_key, request, lambda: _join_queue(request, store))
+
+async def _join_queue(request: JoinQueueRequest, store: QueueStore) -> dict:
+    # Atomic issuing, behind admission control
     try:
-        response = supabase.rpc('issue_token', {
-            'p_service_id': str(request.service_id),
-            'p_user_id': request.user_identifier
-        }).execute()
+        async with join_admission.admit(str(request.service_id), request.user_identifier):
+            token = await store.issue(str(request.service_id), request.user_identifier)
         
-        if not response.data:
+        if not token:
             # Should check errors, but assuming exception if rpc fails logically
              raise HTTPException(status_code=400, detail="Could not issue token. Service might be closed or token exists.")
-             
-        return response.data
         
+    except HTTPException:
+        raise
     except Exception as e:
         # Supabase API raises exceptions on SQL errors usually
         err_msg = str(e)
-        if "User already has an active token" in err_msg:
+        if "User already has an active token" in err_msg or "unique_active_token" in err_msg:
              raise HTTPException(status_code=409, detail="User already has an active token")
         if "Service is closed" in err_msg:
              raise HTTPException(status_code=400, detail="Service is closed")
         
         # Generic fallback
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {err_msg}")
+    
+    # Position + ETA (best effort, the token is already issued)
+    try:
+        [ahead] = await store.people_ahead([(token['service_id'], token['token_number'])])
+        token.update(position_estimate(token['service_id'], ahead))
+    except Exception as e:
+        logger.warning("ETA lookup failed: %s", e)
+    
+    return token
+
+@router.get("/{service_id}/eta-stats")
+async def queue_eta_stats(service_id: UUID):
+    """
+    Rolling service-time / no-show statistics behind the ETA estimates (this worker).
+    """
+    return {"success": True, "data": eta_estimator.snapshot(str(service_id))}
+
+@router.get("/{service_id}/summary")
+async def queue_summary(service_id: UUID, store: QueueStore = Depends(get_queue_store)):
+    """
+    One-row queue summary (counts, now serving, average wait) for dashboards,
+    instead of loading the token list. Also published as the queue_stats row.
+    """
+    data = await store.summary(str(service_id))
+    data["estimated_wait_seconds"] = eta_estimator.estimate_wait(str(service_id), data["waiting_count"])
+    return {"success": True, "data": data}
+
+@router.get("/{service_id}/snapshot")
+async def queue_snapshot(service_id: UUID, store: QueueStore = Depends(get_queue_store)):
+    """
+    Active tokens of a service (ordered by token_number) plus the queue version.
+    Clients then poll /changes?since=<version> for deltas.
+    """
+    data = await store.snapshot(str(service_id))
+    return {"success": True, "version": data['version'], "tokens": data['tokens']}
+
+@router.get("/{service_id}/changes")
+async def queue_changes(
+    service_id: UUID,
+    since: int = Query(..., ge=0),
+    limit: int = Query(500, ge=1, le=1000),
+    store: QueueStore = Depends(get_queue_store)
+):
+    """
+    Tokens written after `since`, in version order. Finished tokens (DONE/MISSED/EXPIRED)
+    are included so clients can drop them. If `has_more` is true, call again with the
+    returned version (or re-fetch the snapshot).
+    """
+    changes = await store.changes(str(service_id), since, limit)
+    version = changes[-1]['version'] if changes else since
+    return {"success": True, "version": version, "changes": changes, "has_more": len(changes) == limit}
+
+@router.get("/{service_id}/stream")
+async def queue_stream(
+    service_id: UUID,
+    http_request: Request,
+    token_id: Optional[UUID] = None,
+    store: QueueStore = Depends(get_queue_store)
+):
+    """
+    Server-Sent Events stream for one service. All clients of a service share one
+    upstream change feed; each receives only the called number and, if `token_id`
+    is given, its own position and ETA.
+    """
+    async def event_stream():
+        sub = queue_feeds.subscribe(str(service_id), str(token_id) if token_id else None, store)
+        try:
+            while not await http_request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(sub.get(), timeout=settings.QUEUE_STREAM_KEEPALIVE)
+                    yield f"data: {json.dumps(message)}\n\n"
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            queue_feeds.unsubscribe(sub)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,26 +1,28 @@
-from fastapi import APIRouter, HTTPException
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header
 from app.models.schemas import EntryScanRequest, ExitScanRequest
-from app.core.database import get_supabase
+from app.logic.eta import eta_estimator
+from app.logic.queue_store import QueueStore, get_queue_store
+from app.logic.idempotency import idempotency_store
+from app.logic.scheduler import counter_scheduler
 
 router = APIRouter()
 
 @router.post("/entry")
-async def entry_scan(request: EntryScanRequest):
+async def entry_scan(request: EntryScanRequest, store: QueueStore = Depends(get_queue_store)):
     """
     Phase A: Entry QR Scan.
     Admin scans User's QR code.
     Transitions: CALLED -> SERVING.
     Counter: FREE -> BUSY.
     """
-    supabase = get_supabase()
     try:
-        # Use atomic RPC
-        res = supabase.rpc('start_service', {
-            'p_token_id': str(request.token_id),
-            'p_counter_id': str(request.counter_id)
-        }).execute()
+        # Atomic transition
+        token = await store.start(str(request.token_id), str(request.counter_id))
         
-        return {"success": True, "token": res.data}
+        if token:
+            eta_estimator.record_outcome(token['service_id'], no_show=False)
+        return {"success": True, "token": token}
     except Exception as e:
         # Map DB errors
         if "Token is not called" in str(e):
@@ -28,40 +30,43 @@ async def entry_scan(request: EntryScanRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/exit")
-async def exit_scan(request: ExitScanRequest):
+async def exit_scan(
+    request: ExitScanRequest,
+    store: QueueStore = Depends(get_queue_store),
+    idempotency_key: Optional[str] = Header(None)
+):
     """
     Phase B: Exit QR Scan.
     User scans Desk QR code.
     Transitions: SERVING -> DONE.
     Counter: BUSY -> FREE.
-    Triggers next call (optionally).
+    Triggers next call (auto_call_next, default) in the same transaction.
+    Retries with the same Idempotency-Key get the original response.
     """
-    supabase = get_supabase()
+    return await idempotency_store.run("flow/exit", idempotency_key, request, lambda: _exit_scan(request, store))
+
+async def _exit_scan(request: ExitScanRequest, store: QueueStore) -> dict:
     try:
-        # Use atomic RPC
-        res = supabase.rpc('end_service', {
-            'p_token_id': str(request.token_id)
-        }).execute()
+        if request.auto_call_next:
+            # Single atomic step: end_service + call_next_token
+            result = await store.finish_and_call_next(str(request.token_id))
+            eta_estimator.record_service(result.get('finished_token'))
+            if result.get('finished_token') and not result.get('next_token'):
+                counter_scheduler.counter_idle(result['finished_token']['service_id'])
+            return {
+                "success": True,
+                "message": "Service completed.",
+                "finished_token": result.get('finished_token'),
+                "next_token": result.get('next_token')
+            }
+        
+        # Atomic transition
+        finished = await store.end(str(request.token_id))
         
-        # Optional: Auto-call next? 
-        # For strict MVP control, we might just end here.
-        # But per spec "System auto-calls next eligible token".
-        # We can implement that in background or here.
-        # Let's trigger it here for efficiency if we know the counter/service.
-        # But `end_service` returns the finished token.
-        # We need service_id and counter_id.
-        finished_token = res.data
-        if finished_token and finished_token.get('counter_id'):
-            # Try to call next
-             call_res = supabase.rpc('call_next_token', {
-                 'p_service_id': finished_token['service_id'],
-                 'p_counter_id': finished_token['counter_id']
-             }).execute()
-             
-             next_token = call_res.data
-             return {"success": True, "message": "Service completed.", "next_token": next_token}
-             
-        return {"success": True, "message": "Service completed."}
+        eta_estimator.record_service(finished)
+        if finished and finished.get('counter_id'):
+            counter_scheduler.counter_freed(finished['service_id'])
+        return {"success": True, "message": "Service completed.", "finished_token": finished}
         
     except Exception as e:
         if "Token is not currently serving" in str(e):
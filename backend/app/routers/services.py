@@ -0,0 +1,25 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from supabase import AsyncClient
+from app.core.config import settings
+from app.core.database import get_supabase
+from app.logic.service_index import service_index
+
+router = APIRouter()
+
+@router.get("/nearby")
+async def nearby_services(
+    lat: float = Query(..., ge=-90, le=90),
+    long: float = Query(..., ge=-180, le=180),
+    radius: Optional[float] = Query(None, gt=0, le=settings.NEARBY_MAX_RADIUS),
+    limit: int = Query(50, ge=1, le=500),
+    open_only: bool = False,
+    supabase: AsyncClient = Depends(get_supabase)
+):
+    """
+    Services within `radius` meters of the point, nearest first, with their distance and
+    whether the point is inside their presence radius. Without `radius`, only services
+    that can be joined from the point are returned.
+    """
+    grid = await service_index.ensure(supabase)
+    return {"success": True, "data": grid.nearby(lat, long, radius, limit, open_only)}
@@ -0,0 +1,172 @@
+import heapq
+import random
+from typing import List, Optional
+from pydantic import BaseModel
+from app.core.config import settings
+from app.logic.state_machine import can_transition
+from app.models.schemas import TokenState
+from app.simulation.model import QueueModel
+
+# Event kinds, in tie-break order at equal times (frees a counter before it is re-used)
+FINISH, NO_SHOW, START, EXPIRE, CONFIRM, ARRIVE = range(6)
+
+class Scenario(BaseModel):
+    """
+    Operating choices to evaluate against a QueueModel. confirm_delay_scale stands in
+    for the presence radius: a larger radius confirms people earlier (scale < 1).
+    """
+    name: str = ""
+    counters: int = 1
+    waiting_timeout: float = settings.WAITING_TIMEOUT_SECONDS # unconfirmed tokens expire
+    called_timeout: float = settings.CALLED_TIMEOUT_SECONDS # no-shows hold the counter this long
+    sweep_interval: float = settings.SWEEP_INTERVAL_SECONDS # timeouts only fire on a sweep
+    arrival_scale: float = 1.0 # demand multiplier
+    confirm_delay_scale: float = 1.0
+    replay: bool = False # recorded arrival times instead of a Poisson process at the fitted rates
+
+class _Token:
+    __slots__ = ("number", "state", "issued_at", "called_at")
+
+    def __init__(self, number: int, issued_at: float):
+        self.number = number
+        self.state = TokenState.CREATED
+        self.issued_at = issued_at
+        self.called_at = 0.0
+
+def _move(token: _Token, state: TokenState) -> None:
+    # Same rules as the live queue: an impossible sequence is a simulator bug
+    if not can_transition(token.state, state):
+        raise ValueError(f"Invalid transition {token.state.value} -> {state.value}")
+    token.state = state
+
+def _arrivals(model: QueueModel, scenario: Scenario, rng: random.Random) -> List[float]:
+    if scenario.replay:
+        return list(model.arrival_offsets)
+    # Piecewise-constant Poisson process; exponential gaps are memoryless, so each
+    # bucket restarts at its own boundary
+    times = []
+    for i, rate in enumerate(model.arrival_rates):
+        rate *= scenario.arrival_scale
+        if rate <= 0:
+            continue
+        t, end = i * model.bucket_seconds, (i + 1) * model.bucket_seconds
+        while True:
+            t += rng.expovariate(rate)
+            if t >= end:
+                break
+            times.append(t)
+    return times
+
+def simulate(model: QueueModel, scenario: Scenario, seed: int) -> dict:
+    """
+    One discrete-event run of a service day. Tokens follow the state machine of the
+    live queue: WAITING -> CONFIRMED (or EXPIRED on a sweep after waiting_timeout),
+    CONFIRMED -> CALLED to the first idle counter in token-number order (auto-dispatch),
+    then SERVING -> DONE, or MISSED on a sweep after called_timeout for no-shows.
+    Waits are issued_at -> called_at, like avg_wait_seconds in queue_stats.
+    """
+    rng = random.Random(seed)
+    sweep_phase = rng.uniform(0, scenario.sweep_interval)
+
+    def on_sweep(t: float) -> float:
+        # First sweep tick at or after t
+        if scenario.sweep_interval <= 0:
+            return t
+        ticks = max(0.0, t - sweep_phase) / scenario.sweep_interval
+        return sweep_phase + -(-ticks // 1) * scenario.sweep_interval
+
+    events: list = []
+    seq = 0
+
+    def schedule(t: float, kind: int, payload) -> None:
+        nonlocal seq
+        seq += 1
+        heapq.heappush(events, (t, kind, seq, payload))
+
+    for number, t in enumerate(_arrivals(model, scenario, rng), start=1):
+        schedule(t, ARRIVE, _Token(number, t))
+
+    idle = list(range(scenario.counters))
+    busy_since = [0.0] * scenario.counters
+    busy_seconds = 0.0
+    confirmed: list = [] # heap of (number, token)
+    waits: List[float] = []
+    counts = {"issued": 0, "served": 0, "no_show": 0, "expired": 0}
+    max_confirmed = 0
+    now = 0.0
+
+    def dispatch(t: float) -> None:
+        while idle and confirmed:
+            counter = idle.pop()
+            _, token = heapq.heappop(confirmed)
+            _move(token, TokenState.CALLED)
+            token.called_at = t
+            busy_since[counter] = t
+            waits.append(t - token.issued_at)
+            if rng.random() < model.no_show_probability:
+                schedule(on_sweep(t + scenario.called_timeout), NO_SHOW, (counter, token))
+            else:
+                schedule(t + rng.choice(model.walk_up_delays), START, (counter, token))
+
+    def release(t: float, counter: int) -> None:
+        nonlocal busy_seconds
+        busy_seconds += t - busy_since[counter]
+        idle.append(counter)
+        dispatch(t)
+
+    while events:
+        now, kind, _, payload = heapq.heappop(events)
+        if kind == ARRIVE:
+            token = payload
+            _move(token, TokenState.WAITING)
+            counts['issued'] += 1
+            delay = None
+            if rng.random() < model.confirm_probability:
+                delay = rng.choice(model.confirm_delays) * scenario.confirm_delay_scale
+            if delay is not None and delay <= scenario.waiting_timeout:
+                schedule(now + delay, CONFIRM, token)
+            else:
+                schedule(on_sweep(now + scenario.waiting_timeout), EXPIRE, token)
+        elif kind == CONFIRM:
+            _move(payload, TokenState.CONFIRMED)
+            heapq.heappush(confirmed, (payload.number, payload))
+            max_confirmed = max(max_confirmed, len(confirmed))
+            dispatch(now)
+        elif kind == EXPIRE:
+            _move(payload, TokenState.EXPIRED)
+            counts['expired'] += 1
+        elif kind == START:
+            counter, token = payload
+            _move(token, TokenState.SERVING)
+            schedule(now + rng.choice(model.service_times), FINISH, (counter, token))
+        elif kind == FINISH:
+            counter, token = payload
+            _move(token, TokenState.DONE)
+            counts['served'] += 1
+            release(now, counter)
+        elif kind == NO_SHOW:
+            counter, token = payload
+            _move(token, TokenState.MISSED)
+            counts['no_show'] += 1
+            release(now, counter)
+
+    # Counters are open from the start of the day until the last token left
+    span = max(now, model.horizon_seconds)
+    return {
+        **counts,
+        "waits": waits,
+        "utilization": busy_seconds / (span * scenario.counters) if span > 0 and scenario.counters else 0.0,
+        "max_confirmed_queue": max_confirmed,
+        "closing_seconds": now,
+    }
+
+def run_batch(model: QueueModel, scenario: Scenario, seeds: List[int]) -> List[dict]:
+    """
+    Several runs of one scenario; the unit of work sent to a worker process.
+    """
+    return [simulate(model, scenario, seed) for seed in seeds]
+
+def percentile(ordered: List[float], p: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
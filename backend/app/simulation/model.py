@@ -0,0 +1,109 @@
+import math
+import random
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel
+from app.core.config import settings
+
+# Fallbacks for quantities with no samples in the fitted history
+DEFAULT_CONFIRM_DELAY_SECONDS = 600.0
+DEFAULT_WALK_UP_SECONDS = 60.0
+SYNTHETIC_SAMPLES = 2000
+
+# Outcomes are only known once a token left these states
+PENDING_CONFIRMATION = {"CREATED", "WAITING", "NEAR", "CONFIRMING"}
+
+class QueueModel(BaseModel):
+    """
+    Input of the simulator: how tokens arrive and behave, fitted from the timestamp
+    columns of past tokens (fit_model) or made up (synthetic_model). Durations are
+    kept as samples and resampled, so skew and long tails survive as observed.
+    """
+    bucket_seconds: float = 900.0
+    arrival_rates: List[float] # tokens per second, one per bucket
+    arrival_offsets: List[float] = [] # recorded issue times (seconds from start), for replay
+    confirm_probability: float = 1.0 # share of tokens that ever confirm presence
+    confirm_delays: List[float] # issued_at -> confirmed_at
+    no_show_probability: float = 0.0 # share of called tokens that never start service
+    walk_up_delays: List[float] # called_at -> service_start_at
+    service_times: List[float] # service_start_at -> service_end_at
+    tokens: int = 0 # tokens the model was fitted from
+
+    @property
+    def horizon_seconds(self) -> float:
+        return self.bucket_seconds * len(self.arrival_rates)
+
+def _parse_ts(value) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def _seconds(start, end) -> Optional[float]:
+    start, end = _parse_ts(start), _parse_ts(end)
+    if start is None or end is None:
+        return None
+    return max(0.0, (end - start).total_seconds())
+
+def fit_model(tokens: List[dict], bucket_seconds: float = 900.0) -> QueueModel:
+    """
+    Fits a QueueModel to token rows (live or archived, e.g. QueueStore.history) of one
+    service. Arrival rates are per `bucket_seconds` from the first issue time.
+    """
+    rows = [t for t in tokens if t.get('issued_at')]
+    if not rows:
+        raise ValueError("No tokens to fit")
+    issued = sorted(_parse_ts(t['issued_at']) for t in rows)
+    offsets = [(ts - issued[0]).total_seconds() for ts in issued]
+    buckets = [0] * (int(offsets[-1] // bucket_seconds) + 1)
+    for offset in offsets:
+        buckets[int(offset // bucket_seconds)] += 1
+
+    # 1. Presence: tokens still waiting have no outcome yet
+    decided = [t for t in rows if t['state'] not in PENDING_CONFIRMATION]
+    confirm_delays = [d for d in (_seconds(t['issued_at'], t.get('confirmed_at')) for t in rows) if d is not None]
+    confirmed = sum(1 for t in decided if t.get('confirmed_at'))
+
+    # 2. Calls: a called token that was never started is a no-show
+    called = [t for t in rows if t.get('called_at') and t['state'] != "CALLED"]
+    no_shows = sum(1 for t in called if not t.get('service_start_at'))
+    walk_up = [d for d in (_seconds(t['called_at'], t.get('service_start_at')) for t in called) if d is not None]
+    service = [d for d in (_seconds(t.get('service_start_at'), t.get('service_end_at')) for t in rows) if d is not None]
+
+    return QueueModel(
+        bucket_seconds=bucket_seconds,
+        arrival_rates=[count / bucket_seconds for count in buckets],
+        arrival_offsets=offsets,
+        confirm_probability=confirmed / len(decided) if decided else 1.0,
+        confirm_delays=confirm_delays or [DEFAULT_CONFIRM_DELAY_SECONDS],
+        no_show_probability=no_shows / len(called) if called else 0.0,
+        walk_up_delays=walk_up or [DEFAULT_WALK_UP_SECONDS],
+        service_times=service or [settings.DEFAULT_SERVICE_TIME_SECONDS],
+        tokens=len(rows),
+    )
+
+def synthetic_model(
+    arrivals_per_hour: float,
+    hours: float,
+    service_seconds: float = settings.DEFAULT_SERVICE_TIME_SECONDS,
+    confirm_seconds: float = DEFAULT_CONFIRM_DELAY_SECONDS,
+    confirm_probability: float = 0.95,
+    no_show_probability: float = 0.05,
+    bucket_seconds: float = 900.0,
+    seed: int = 0,
+) -> QueueModel:
+    """
+    A model for a service with no history: constant arrival rate, lognormal service
+    times (CV 0.5) and exponential confirmation / walk-up delays around the given means.
+    """
+    rng = random.Random(seed)
+    sigma = math.sqrt(math.log(1 + 0.5 ** 2))
+    mu = math.log(service_seconds) - sigma ** 2 / 2
+    return QueueModel(
+        bucket_seconds=bucket_seconds,
+        arrival_rates=[arrivals_per_hour / 3600.0] * max(1, math.ceil(hours * 3600 / bucket_seconds)),
+        confirm_probability=confirm_probability,
+        confirm_delays=[rng.expovariate(1 / confirm_seconds) for _ in range(SYNTHETIC_SAMPLES)],
+        no_show_probability=no_show_probability,
+        walk_up_delays=[rng.expovariate(1 / DEFAULT_WALK_UP_SECONDS) for _ in range(SYNTHETIC_SAMPLES)],
+        service_times=[rng.lognormvariate(mu, sigma) for _ in range(SYNTHETIC_SAMPLES)],
+    )
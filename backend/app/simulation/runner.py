@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from statistics import fmean
+from typing import List, Optional
+from app.simulation.engine import Scenario, percentile, run_batch
+from app.simulation.model import QueueModel
+
+# Runs per task sent to a worker: large enough to amortize pickling the model
+BATCH_SIZE = 25
+
+def summarize(scenario: Scenario, runs: List[dict]) -> dict:
+    """
+    Pools the waits of all replications of a scenario; counts are per run.
+    """
+    waits = sorted(w for run in runs for w in run['waits'])
+    per_run = lambda key: fmean(run[key] for run in runs) if runs else 0.0
+    return {
+        "scenario": scenario.name or f"{scenario.counters} counters",
+        "counters": scenario.counters,
+        "runs": len(runs),
+        "wait_mean": fmean(waits) if waits else None,
+        "wait_p50": percentile(waits, 50),
+        "wait_p90": percentile(waits, 90),
+        "wait_p99": percentile(waits, 99),
+        "wait_max": waits[-1] if waits else None,
+        "utilization": per_run('utilization'),
+        "issued": per_run('issued'),
+        "served": per_run('served'),
+        "no_show": per_run('no_show'),
+        "expired": per_run('expired'),
+        "max_confirmed_queue": max((run['max_confirmed_queue'] for run in runs), default=0),
+        "closing_seconds": per_run('closing_seconds'),
+    }
+
+def run_scenarios(
+    model: QueueModel,
+    scenarios: List[Scenario],
+    replications: int,
+    workers: Optional[int] = None,
+    seed: int = 0,
+) -> List[dict]:
+    """
+    Runs every scenario `replications` times and summarizes each. Replications are
+    split into batches spread over `workers` processes (default: all cores); workers=1
+    runs in this process. Seeds depend only on `seed` and the replication number, so
+    scenarios are compared on the same random arrivals and results do not depend on
+    the number of workers.
+    """
+    seeds = [seed * 1_000_003 + i for i in range(replications)]
+    batches = [
+        (index, seeds[start:start + BATCH_SIZE])
+        for index in range(len(scenarios))
+        for start in range(0, replications, BATCH_SIZE)
+    ]
+    runs: List[List[dict]] = [[] for _ in scenarios]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for index, batch in batches:
+            runs[index].extend(run_batch(model, scenarios[index], batch))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(index, pool.submit(run_batch, model, scenarios[index], batch)) for index, batch in batches]
+            for index, future in futures:
+                runs[index].extend(future.result())
+    return [summarize(scenario, scenario_runs) for scenario, scenario_runs in zip(scenarios, runs)]
@@ -1,13 +1,93 @@
+import math
+from typing import Sequence, Union
+
+import numpy as np
 from geopy.distance import geodesic
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+# Mean Earth radius (IUGG), meters. Haversine on a sphere stays within ~0.5%
+# of the WGS-84 geodesic, i.e. well under a meter at presence-check ranges.
+EARTH_RADIUS_M = 6371008.8
+
+# Lower bound on the length of a degree (of latitude, or of longitude / cos(lat)),
+# for bounding boxes that must contain the whole circle: the WGS-84 minimum is
+# 110574 m (latitude at the equator), the haversine sphere has 111195 m.
+MIN_METERS_PER_DEG = 110000.0
+
+ArrayLike = Union[Sequence[float], np.ndarray]
+
+def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great-circle distance in meters on a spherical Earth.
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float, precise: bool = False) -> float:
     """
     Calculates the distance in meters between two coordinates.
+    Uses haversine by default; `precise=True` uses the (much slower) WGS-84 geodesic.
+    """
+    if precise:
+        return geodesic((lat1, lon1), (lat2, lon2)).meters
+    return haversine_distance(lat1, lon1, lat2, lon2)
+
+def outside_bounding_box(lat1: float, lon1: float, lat2: float, lon2: float, radius_meters: float) -> bool:
     """
-    return geodesic((lat1, lon1), (lat2, lon2)).meters
+    Cheap pre-reject: True if point 1 is certainly farther than radius from point 2,
+    by haversine or geodesic. The box is sized with MIN_METERS_PER_DEG, so it is
+    slightly larger than the circle: False does not imply within radius.
+    """
+    dlat = radius_meters / MIN_METERS_PER_DEG
+    if abs(lat1 - lat2) > dlat:
+        return True
+    cos_lat = math.cos(math.radians(max(abs(lat1), abs(lat2))))
+    if cos_lat < 1e-6:
+        # Near the poles every longitude is close, skip the longitude test
+        return False
+    dlon = abs(lon1 - lon2) % 360.0
+    dlon = min(dlon, 360.0 - dlon)
+    return dlon > radius_meters / (MIN_METERS_PER_DEG * cos_lat)
 
-def is_within_radius(lat1: float, lon1: float, lat2: float, lon2: float, radius_meters: float) -> bool:
+def is_within_radius(lat1: float, lon1: float, lat2: float, lon2: float, radius_meters: float, precise: bool = False) -> bool:
     """
     Checks if point 1 is within radius of point 2.
     """
-    return calculate_distance(lat1, lon1, lat2, lon2) <= radius_meters
+    if outside_bounding_box(lat1, lon1, lat2, lon2, radius_meters):
+        return False
+    return calculate_distance(lat1, lon1, lat2, lon2, precise=precise) <= radius_meters
+
+# --- Vectorized batch API ---
+
+def haversine_many(lats1: ArrayLike, lons1: ArrayLike, lats2: ArrayLike, lons2: ArrayLike) -> np.ndarray:
+    """
+    Element-wise haversine distance in meters. Inputs broadcast against each other,
+    so either side may be a scalar.
+    """
+    phi1 = np.radians(np.asarray(lats1, dtype=np.float64))
+    phi2 = np.radians(np.asarray(lats2, dtype=np.float64))
+    dphi = phi2 - phi1
+    dlmb = np.radians(np.asarray(lons2, dtype=np.float64) - np.asarray(lons1, dtype=np.float64))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def distances_to_service(lats: ArrayLike, lons: ArrayLike, service_lat: float, service_lon: float) -> np.ndarray:
+    """
+    Many points vs one service: distance in meters from each (lat, lon) to the service.
+    """
+    return haversine_many(lats, lons, service_lat, service_lon)
+
+def distances_to_services(lat: float, lon: float, service_lats: ArrayLike, service_lons: ArrayLike) -> np.ndarray:
+    """
+    One point vs many services: distance in meters from (lat, lon) to each service.
+    """
+    return haversine_many(lat, lon, service_lats, service_lons)
+
+def within_radius_many(lats1: ArrayLike, lons1: ArrayLike, lats2: ArrayLike, lons2: ArrayLike, radii: ArrayLike) -> np.ndarray:
+    """
+    Element-wise (broadcasting) version of `is_within_radius`. Returns a boolean array.
+    """
+    return haversine_many(lats1, lons1, lats2, lons2) <= np.asarray(radii, dtype=np.float64)
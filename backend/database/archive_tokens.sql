@@ -0,0 +1,69 @@
+-- Migration: Move finished tokens out of the hot tokens table (tokens_history + archive_finished_tokens)
+-- Run this script to apply the changes without re-creating tables.
+
+create table if not exists public.tokens_history (
+  like public.tokens including defaults,
+  archived_at timestamptz not null default now(),
+  primary key (id)
+);
+
+create index if not exists idx_tokens_archive on public.tokens(issued_at)
+where state in ('DONE', 'MISSED', 'EXPIRED'); -- archive_finished_tokens candidates
+create index if not exists idx_tokens_history_service on public.tokens_history(service_id, issued_at);
+create index if not exists idx_tokens_history_user on public.tokens_history(user_identifier);
+
+create or replace view public.tokens_all with (security_invoker = on) as
+  select t.*, null::timestamptz as archived_at from public.tokens t
+  union all
+  select h.* from public.tokens_history h;
+
+alter table public.tokens_history enable row level security;
+drop policy if exists "Allow public read tokens history" on public.tokens_history;
+create policy "Allow public read tokens history" on public.tokens_history for select using (true);
+-- Moves DONE/MISSED/EXPIRED tokens issued more than p_older_than_seconds ago from
+-- tokens to tokens_history, at most p_batch_size per call; the caller loops until
+-- fewer are moved. Deletes do not bump the queue version: finished tokens were
+-- already published to /changes when they finished.
+create or replace function archive_finished_tokens(
+  p_older_than_seconds int,
+  p_batch_size int default 1000
+) returns json language plpgsql as $$
+declare
+  v_ids uuid[];
+  v_moved int;
+begin
+  if not pg_try_advisory_xact_lock(hashtext('archive_finished_tokens')) then
+    return json_build_object('skipped', true);
+  end if;
+
+  select array_agg(id) into v_ids
+  from (
+    select id from tokens
+    where state in ('DONE', 'MISSED', 'EXPIRED')
+      and issued_at < now() - make_interval(secs => p_older_than_seconds)
+    order by issued_at
+    limit p_batch_size
+  ) finished;
+
+  if v_ids is null then
+    return json_build_object('skipped', false, 'moved', 0);
+  end if;
+
+  -- Lock order of every blocking writer: tokens, then counters.
+  -- A token cancelled while CALLED can still be a counter's current_token_id.
+  perform 1 from tokens where id = any(v_ids) order by id for update;
+  perform 1 from counters where current_token_id = any(v_ids) order by id for update;
+  update counters set current_token_id = null where current_token_id = any(v_ids);
+
+  with moved as (
+    delete from tokens
+    where id = any(v_ids) and state in ('DONE', 'MISSED', 'EXPIRED')
+    returning *
+  )
+  insert into tokens_history
+  select moved.*, now() from moved;
+  get diagnostics v_moved = row_count;
+
+  return json_build_object('skipped', false, 'moved', v_moved);
+end;
+$$;
@@ -0,0 +1,98 @@
+-- Migration: Bulk admin cancel / complete (one set-based RPC per request)
+-- Run this script to apply the changes without re-creating tables.
+-- Requires lock_queue_rows from queue_versions.sql.
+
+-- 13. Bulk Transition (admin cancel / complete)
+-- Moves the tokens in p_token_ids, or up to p_limit tokens of p_service_id in
+-- p_states (lowest number first), to p_to_state in one statement. Only tokens in
+-- p_allowed_from (the sources of -> p_to_state in VALID_TRANSITIONS, passed by the
+-- backend) are moved; counters holding a moved token are freed. One outcome per
+-- requested token, in request order:
+-- {token_id, outcome: applied | invalid_transition | not_found, from_state, token}
+create or replace function bulk_transition(
+  p_to_state token_state,
+  p_allowed_from token_state[],
+  p_token_ids uuid[] default null,
+  p_service_id uuid default null,
+  p_states token_state[] default null,
+  p_limit int default 1000
+) returns json language plpgsql as $$
+declare
+  v_ids uuid[];
+  v_res json;
+begin
+  if p_token_ids is not null then
+    v_ids := p_token_ids[1:p_limit];
+  else
+    select array_agg(id order by token_number) into v_ids
+    from (
+      select id, token_number from tokens
+      where service_id = p_service_id
+        and state = any(p_allowed_from)
+        and (p_states is null or state = any(p_states))
+      order by token_number
+      limit p_limit
+    ) picked;
+  end if;
+
+  if v_ids is null or cardinality(v_ids) = 0 then
+    return '[]'::json;
+  end if;
+
+  -- Lock order of every blocking writer: tokens, then counters (call_next_token
+  -- and dispatch_service skip locked tokens, so they never wait on us). With the
+  -- tokens locked, the states read below are the ones the update sees.
+  perform 1 from tokens where id = any(v_ids) order by id for update;
+
+  -- Picked by filter before the lock: drop tokens that left it meanwhile (a WAITING
+  -- token called in between is no longer "WAITING" and must not be cancelled)
+  if p_token_ids is null then
+    select array_agg(id order by token_number) into v_ids
+    from tokens
+    where id = any(v_ids)
+      and state = any(p_allowed_from)
+      and (p_states is null or state = any(p_states));
+    if v_ids is null then
+      return '[]'::json;
+    end if;
+  end if;
+
+  perform 1 from counters where current_token_id = any(v_ids) order by id for update;
+
+  with requested as (
+    select id, ord from unnest(v_ids) with ordinality as r(id, ord)
+  ),
+  current_state as (
+    select id, state from tokens where id = any(v_ids)
+  ),
+  moved as (
+    update tokens t
+    set state = p_to_state,
+        service_end_at = case when p_to_state = 'DONE' then coalesce(t.service_end_at, now()) else t.service_end_at end
+    from current_state c
+    where t.id = c.id and c.state = any(p_allowed_from) and (p_states is null or c.state = any(p_states))
+    returning t.*
+  ),
+  freed as (
+    update counters c
+    set status = 'FREE', current_token_id = null
+    from moved
+    where c.current_token_id = moved.id
+    returning c.id
+  )
+  select coalesce(json_agg(json_build_object(
+    'token_id', r.id,
+    'outcome', case when c.id is null then 'not_found' when m.id is null then 'invalid_transition' else 'applied' end,
+    'from_state', c.state,
+    'token', case when m.id is not null then row_to_json(m.*) end
+  ) order by r.ord), '[]'::json) into v_res
+  from requested r
+  left join current_state c on c.id = r.id
+  left join moved m on m.id = r.id;
+
+  -- The ids can span several services
+  perform lock_queue_rows(array(select distinct service_id from tokens where id = any(v_ids)));
+
+  return v_res;
+end;
+$$;
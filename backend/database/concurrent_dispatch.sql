@@ -0,0 +1,52 @@
+-- Migration: Concurrent multi-counter dispatch for call_next_token
+-- Run this script to apply the changes without re-creating tables.
+
+-- Covering partial index over the confirmed queue
+create index if not exists idx_tokens_confirmed_queue on public.tokens(service_id, token_number) include (id)
+where state = 'CONFIRMED'; -- call_next_token reads the head of this index
+
+-- 3. Call Next Token (Admin/Auto)
+-- Safe for many counters pulling from one queue: the counter row is locked so
+-- the busy check cannot race, and the token is claimed with SKIP LOCKED so
+-- concurrent callers each take a different token instead of blocking.
+create or replace function call_next_token(
+  p_service_id uuid,
+  p_counter_id uuid
+) returns json language plpgsql as $$
+declare
+  v_counter_status counter_status;
+  v_res json;
+begin
+  -- Check Counter (row lock serializes calls from the same counter)
+  select status into v_counter_status from counters where id = p_counter_id for update;
+  if v_counter_status = 'BUSY' then
+    raise exception 'Counter is busy';
+  end if;
+
+  -- Claim eligible token (Smallest number that is CONFIRMED and not being claimed)
+  with next_token as (
+    select id
+    from tokens
+    where service_id = p_service_id and state = 'CONFIRMED'
+    order by token_number asc
+    limit 1
+    for update skip locked
+  )
+  update tokens t
+  set state = 'CALLED', called_at = now(), counter_id = p_counter_id
+  from next_token
+  where t.id = next_token.id
+  returning row_to_json(t.*) into v_res;
+
+  if v_res is null then
+    return null; -- No one to call
+  end if;
+
+  -- Update Counter
+  update counters
+  set current_token_id = (v_res->>'id')::uuid
+  where id = p_counter_id;
+  
+  return v_res;
+end;
+$$;
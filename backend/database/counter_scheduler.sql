@@ -0,0 +1,230 @@
+-- Migration: Counter-aware dispatch (priority lanes, counter skills/weights, auto-dispatch)
+-- Run this script to apply the changes without re-creating tables.
+
+-- Routing columns
+alter table public.counters add column if not exists skills text[]; -- token skills this counter handles; null = all
+alter table public.counters add column if not exists weight int not null default 1 check (weight > 0); -- higher weight gets dispatched to first
+alter table public.counters add column if not exists freed_at timestamptz not null default now(); -- last time the counter became idle
+alter table public.tokens add column if not exists priority smallint not null default 0; -- higher lanes are called first
+alter table public.tokens add column if not exists skill text; -- restricts the counters that can call the token
+alter table public.tokens_history add column if not exists priority smallint not null default 0;
+alter table public.tokens_history add column if not exists skill text;
+
+-- The confirmed queue is now read in (priority, number) order
+drop index if exists idx_tokens_confirmed_queue;
+create index if not exists idx_tokens_confirmed_queue on public.tokens(service_id, priority desc, token_number) include (id, skill)
+where state = 'CONFIRMED'; -- call_next_token reads the head of this index
+
+-- Counter idle tracking
+-- freed_at is when the counter last became idle (FREE with nobody at it), so
+-- dispatch_service can hand the next token to the counter that has waited longest.
+create or replace function touch_counter_freed_at()
+returns trigger language plpgsql as $$
+begin
+  if new.status = 'FREE' and new.current_token_id is null
+     and (old.status is distinct from 'FREE' or old.current_token_id is not null) then
+    new.freed_at := now();
+  end if;
+  return new;
+end;
+$$;
+
+drop trigger if exists on_counter_write on public.counters;
+create trigger on_counter_write
+  before update on public.counters
+  for each row execute procedure touch_counter_freed_at();
+
+-- Columns are listed by name: tokens_history got the routing columns appended
+-- after archived_at, so `t.*` / `h.*` no longer line up
+drop view if exists public.tokens_all;
+create view public.tokens_all with (security_invoker = on) as
+  select id, service_id, counter_id, user_identifier, token_number, state,
+         issued_at, confirmed_at, called_at, service_start_at, service_end_at,
+         entry_qr_code, exit_qr_code, version, priority, skill, null::timestamptz as archived_at
+  from public.tokens
+  union all
+  select id, service_id, counter_id, user_identifier, token_number, state,
+         issued_at, confirmed_at, called_at, service_start_at, service_end_at,
+         entry_qr_code, exit_qr_code, version, priority, skill, archived_at
+  from public.tokens_history;
+
+-- 3. Call Next Token (Admin/Auto)
+-- Safe for many counters pulling from one queue: the counter row is locked so
+-- the busy check cannot race, and the token is claimed with SKIP LOCKED so
+-- concurrent callers each take a different token instead of blocking.
+-- Highest priority lane first, then lowest number, among the tokens whose skill
+-- the counter has (tokens without a skill go to any counter).
+create or replace function call_next_token(
+  p_service_id uuid,
+  p_counter_id uuid
+) returns json language plpgsql as $$
+declare
+  v_counter record;
+  v_res json;
+begin
+  -- Check Counter (row lock serializes calls from the same counter)
+  select status, skills into v_counter from counters where id = p_counter_id for update;
+  if v_counter.status = 'BUSY' then
+    raise exception 'Counter is busy';
+  end if;
+  if v_counter.status = 'OFFLINE' then
+    raise exception 'Counter is offline';
+  end if;
+
+  -- Claim eligible token (CONFIRMED, routable to this counter and not being claimed)
+  with next_token as (
+    select id
+    from tokens
+    where service_id = p_service_id and state = 'CONFIRMED'
+      and (skill is null or v_counter.skills is null or skill = any(v_counter.skills))
+    order by priority desc, token_number asc
+    limit 1
+    for update skip locked
+  )
+  update tokens t
+  set state = 'CALLED', called_at = now(), counter_id = p_counter_id
+  from next_token
+  where t.id = next_token.id
+  returning row_to_json(t.*) into v_res;
+
+  if v_res is null then
+    return null; -- No one to call
+  end if;
+
+  -- Update Counter
+  update counters
+  set current_token_id = (v_res->>'id')::uuid
+  where id = p_counter_id;
+  
+  return v_res;
+end;
+$$;
+
+-- 10. Archive Finished Tokens (hot/cold split)
+-- (re-created: the history insert now names its columns)
+-- Moves DONE/MISSED/EXPIRED tokens issued more than p_older_than_seconds ago from
+-- tokens to tokens_history, at most p_batch_size per call; the caller loops until
+-- fewer are moved. Deletes do not bump the queue version: finished tokens were
+-- already published to /changes when they finished.
+create or replace function archive_finished_tokens(
+  p_older_than_seconds int,
+  p_batch_size int default 1000
+) returns json language plpgsql as $$
+declare
+  v_ids uuid[];
+  v_moved int;
+begin
+  if not pg_try_advisory_xact_lock(hashtext('archive_finished_tokens')) then
+    return json_build_object('skipped', true);
+  end if;
+
+  select array_agg(id) into v_ids
+  from (
+    select id from tokens
+    where state in ('DONE', 'MISSED', 'EXPIRED')
+      and issued_at < now() - make_interval(secs => p_older_than_seconds)
+    order by issued_at
+    limit p_batch_size
+  ) finished;
+
+  if v_ids is null then
+    return json_build_object('skipped', false, 'moved', 0);
+  end if;
+
+  -- Lock order of every blocking writer: tokens, then counters.
+  -- A token cancelled while CALLED can still be a counter's current_token_id.
+  perform 1 from tokens where id = any(v_ids) order by id for update;
+  perform 1 from counters where current_token_id = any(v_ids) order by id for update;
+  update counters set current_token_id = null where current_token_id = any(v_ids);
+
+  with moved as (
+    delete from tokens
+    where id = any(v_ids) and state in ('DONE', 'MISSED', 'EXPIRED')
+    returning *
+  )
+  insert into tokens_history (
+    id, service_id, counter_id, user_identifier, token_number, state,
+    issued_at, confirmed_at, called_at, service_start_at, service_end_at,
+    entry_qr_code, exit_qr_code, version, priority, skill, archived_at
+  )
+  select id, service_id, counter_id, user_identifier, token_number, state,
+         issued_at, confirmed_at, called_at, service_start_at, service_end_at,
+         entry_qr_code, exit_qr_code, version, priority, skill, now()
+  from moved;
+  get diagnostics v_moved = row_count;
+
+  return json_build_object('skipped', false, 'moved', v_moved);
+end;
+$$;
+
+-- 11. Dispatch (auto-assign confirmed tokens to idle counters)
+-- Every idle counter of the service (FREE and nobody called to it), best first:
+-- highest weight, then idle longest, gets call_next_token. Counters locked by a
+-- concurrent dispatch or call are skipped. Returns the calls made, the counters
+-- left idle, and whether confirmed tokens are still waiting (e.g. for a skill no
+-- idle counter has).
+create or replace function dispatch_service(
+  p_service_id uuid
+) returns json language plpgsql as $$
+declare
+  v_counter_id uuid;
+  v_token json;
+  v_assigned json[] := '{}';
+  v_idle int := 0;
+begin
+  for v_counter_id in
+    select c.id from counters c
+    where c.service_id = p_service_id and c.status = 'FREE'
+      -- a cancelled or missed call leaves current_token_id behind
+      and not exists (select 1 from tokens t where t.id = c.current_token_id and t.state = 'CALLED')
+    order by c.weight desc, c.freed_at asc
+    for update of c skip locked
+  loop
+    v_token := call_next_token(p_service_id, v_counter_id);
+    if v_token is null then
+      v_idle := v_idle + 1;
+    else
+      v_assigned := v_assigned || v_token;
+    end if;
+  end loop;
+
+  return json_build_object(
+    'assigned', array_to_json(v_assigned),
+    'idle_counters', v_idle,
+    'backlog', exists (select 1 from tokens where service_id = p_service_id and state = 'CONFIRMED')
+  );
+end;
+$$;
+
+-- 12. Counter Status (FREE <-> OFFLINE)
+-- A counter can go OFFLINE only with nobody being served at it or called to it;
+-- the current_token_id left behind by a cancelled or missed call is cleared.
+create or replace function set_counter_status(
+  p_counter_id uuid,
+  p_status counter_status
+) returns json language plpgsql as $$
+declare
+  v_counter record;
+  v_res json;
+begin
+  if p_status = 'BUSY' then
+    raise exception 'Counter status BUSY is set by entry scans';
+  end if;
+
+  select * into v_counter from counters where id = p_counter_id for update;
+  if not found then
+    return null;
+  end if;
+  if v_counter.status = 'BUSY'
+     or (p_status = 'OFFLINE' and exists (select 1 from tokens where id = v_counter.current_token_id and state = 'CALLED')) then
+    raise exception 'Counter is busy';
+  end if;
+
+  update counters
+  set status = p_status,
+      current_token_id = case when p_status = 'OFFLINE' then null else current_token_id end
+  where id = p_counter_id
+  returning row_to_json(counters.*) into v_res;
+  return v_res;
+end;
+$$;
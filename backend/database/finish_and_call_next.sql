@@ -0,0 +1,38 @@
+-- Migration: Add finish_and_call_next for the exit scan flow
+-- Run this script to apply the changes without re-creating tables.
+-- Requires call_next_token from concurrent_dispatch.sql.
+
+-- Same as end_service followed by call_next_token, but in one round trip and
+-- without a window where the counter is FREE and nobody has been called.
+create or replace function finish_and_call_next(
+  p_token_id uuid
+) returns json language plpgsql as $$
+declare
+  v_token record;
+  v_finished json;
+  v_next json;
+begin
+  select * into v_token from tokens where id = p_token_id for update;
+  
+  if v_token.state is distinct from 'SERVING' then
+     raise exception 'Token is not currently serving';
+  end if;
+  
+  -- Update Token
+  update tokens 
+  set state = 'DONE', service_end_at = now()
+  where id = p_token_id
+  returning row_to_json(tokens.*) into v_finished;
+  
+  -- Free the counter and immediately hand it the next confirmed token
+  if v_token.counter_id is not null then
+    update counters 
+    set status = 'FREE', current_token_id = null 
+    where id = v_token.counter_id;
+    
+    v_next := call_next_token(v_token.service_id, v_token.counter_id);
+  end if;
+  
+  return json_build_object('finished_token', v_finished, 'next_token', v_next);
+end;
+$$;
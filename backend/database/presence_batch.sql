@@ -0,0 +1,38 @@
+-- Migration: Add apply_presence_batch for POST /presence/verify-batch
+-- Run this script to apply the changes without re-creating tables.
+
+-- p_updates: [{"token_id": uuid, "from_state": token_state, "to_state": token_state}, ...]
+-- Each row is applied only if the token is still in from_state (compare-and-set),
+-- so transitions decided by the backend cannot overwrite a concurrent call/cancel.
+create or replace function apply_presence_batch(
+  p_updates jsonb
+) returns json language plpgsql as $$
+declare
+  v_res json;
+begin
+  with req as (
+    select
+      (u->>'token_id')::uuid as token_id,
+      (u->>'from_state')::token_state as from_state,
+      (u->>'to_state')::token_state as to_state
+    from jsonb_array_elements(p_updates) u
+  ),
+  updated as (
+    update tokens t
+    set state = req.to_state,
+        confirmed_at = case when req.to_state = 'CONFIRMED' then now() else t.confirmed_at end
+    from req
+    where t.id = req.token_id
+      and t.state = req.from_state
+      and (
+        (req.from_state = 'WAITING' and req.to_state in ('NEAR', 'CONFIRMED'))
+        or (req.from_state = 'NEAR' and req.to_state in ('WAITING', 'CONFIRMED'))
+        or (req.from_state = 'CONFIRMING' and req.to_state in ('NEAR', 'CONFIRMED'))
+      )
+    returning t.*
+  )
+  select coalesce(json_agg(row_to_json(updated.*)), '[]'::json) into v_res from updated;
+
+  return v_res;
+end;
+$$;
@@ -0,0 +1,127 @@
+-- Migration: Add queue_stats (per-service summary row maintained by a trigger)
+-- Run this script to apply the changes without re-creating tables.
+
+-- Per-service queue summary, maintained incrementally by apply_queue_stats (one tiny
+-- row per service for dashboards instead of the full token list)
+create table if not exists public.queue_stats (
+  service_id uuid primary key references public.services(id) on delete cascade,
+  active_count int not null default 0, -- CREATED .. SERVING
+  waiting_count int not null default 0, -- in line: CREATED .. CONFIRMED
+  confirmed_count int not null default 0,
+  last_called_number int, -- "now serving"
+  avg_wait_seconds double precision, -- EWMA (alpha 0.2) of issued_at -> called_at
+  updated_at timestamptz not null default now()
+);
+
+-- Queue summary
+-- Applies the state delta of every token write (and delete) to queue_stats when the
+-- transaction commits, so all RPCs (and direct writes) keep the summary exact.
+-- Deferred like the version triggers and named to fire after them, so the lock
+-- order is version row -> stats row everywhere.
+create or replace function apply_queue_stats()
+returns trigger language plpgsql security definer set search_path = public as $$
+declare
+  v_row record;
+  v_from token_state;
+  v_to token_state;
+  v_active int;
+  v_waiting int;
+  v_confirmed int;
+  v_called int;
+  v_wait double precision;
+begin
+  if tg_op = 'DELETE' then
+    v_row := old;
+    v_from := old.state;
+  elsif tg_op = 'UPDATE' then
+    if old.state = new.state then
+      return null;
+    end if;
+    v_row := new;
+    v_from := old.state;
+    v_to := new.state;
+  else
+    v_row := new;
+    v_to := new.state;
+  end if;
+
+  v_active := coalesce((v_to in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED', 'CALLED', 'SERVING'))::int, 0)
+    - coalesce((v_from in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED', 'CALLED', 'SERVING'))::int, 0);
+  v_waiting := coalesce((v_to in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED'))::int, 0)
+    - coalesce((v_from in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED'))::int, 0);
+  v_confirmed := coalesce((v_to = 'CONFIRMED')::int, 0) - coalesce((v_from = 'CONFIRMED')::int, 0);
+
+  if v_to = 'CALLED' then
+    v_called := v_row.token_number;
+    v_wait := extract(epoch from coalesce(v_row.called_at, now()) - v_row.issued_at);
+  end if;
+
+  -- Nothing to apply (WAITING -> NEAR, archiving a finished token, ...): leave the row unlocked
+  if v_active = 0 and v_waiting = 0 and v_confirmed = 0 and v_called is null then
+    return null;
+  end if;
+
+  insert into queue_stats as s (service_id, active_count, waiting_count, confirmed_count, last_called_number, avg_wait_seconds)
+  values (v_row.service_id, v_active, v_waiting, v_confirmed, v_called, v_wait)
+  on conflict (service_id) do update set
+    active_count = s.active_count + v_active,
+    waiting_count = s.waiting_count + v_waiting,
+    confirmed_count = s.confirmed_count + v_confirmed,
+    last_called_number = coalesce(v_called, s.last_called_number),
+    avg_wait_seconds = case
+      when v_wait is null then s.avg_wait_seconds
+      when s.avg_wait_seconds is null then v_wait
+      else s.avg_wait_seconds + 0.2 * (v_wait - s.avg_wait_seconds)
+    end,
+    updated_at = now();
+  return null;
+end;
+$$;
+
+drop trigger if exists on_token_stats on public.tokens;
+drop trigger if exists on_token_write_stats on public.tokens;
+create constraint trigger on_token_write_stats
+  after insert or update of state or delete on public.tokens
+  deferrable initially deferred
+  for each row execute procedure apply_queue_stats();
+
+alter table public.queue_stats enable row level security;
+drop policy if exists "Allow public read queue stats" on public.queue_stats;
+create policy "Allow public read queue stats" on public.queue_stats for select using (true);
+
+-- Multi-service writers lock the stats rows with the version rows (see queue_versions.sql)
+create or replace function lock_queue_rows(p_service_ids uuid[])
+returns void language plpgsql security definer set search_path = public as $$
+begin
+  perform 1 from service_token_counters where service_id = any(p_service_ids) order by service_id for update;
+  perform 1 from queue_stats where service_id = any(p_service_ids) order by service_id for update;
+end;
+$$;
+
+-- Backfill from the current tokens (also resets any drift)
+insert into public.queue_stats (service_id, active_count, waiting_count, confirmed_count, last_called_number)
+select
+  service_id,
+  count(*) filter (where state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED', 'CALLED', 'SERVING')),
+  count(*) filter (where state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED')),
+  count(*) filter (where state = 'CONFIRMED'),
+  (array_agg(token_number order by called_at desc) filter (where called_at is not null))[1]
+from public.tokens
+group by service_id
+on conflict (service_id) do update set
+  active_count = excluded.active_count,
+  waiting_count = excluded.waiting_count,
+  confirmed_count = excluded.confirmed_count,
+  last_called_number = excluded.last_called_number,
+  updated_at = now();
+
+-- Let dashboards subscribe to the row (Supabase Realtime)
+do $$
+begin
+  if exists (select 1 from pg_publication where pubname = 'supabase_realtime')
+     and not exists (select 1 from pg_publication_tables
+                     where pubname = 'supabase_realtime' and schemaname = 'public' and tablename = 'queue_stats') then
+    alter publication supabase_realtime add table public.queue_stats;
+  end if;
+end;
+$$;
@@ -0,0 +1,166 @@
+-- Migration: Versioned queue snapshots and deltas for /queue/{service_id}/snapshot and /changes
+-- Run this script to apply the changes without re-creating tables.
+-- Requires service_token_counters from token_counters.sql.
+
+alter table public.service_token_counters add column if not exists version bigint not null default 0;
+alter table public.tokens add column if not exists version bigint not null default 0;
+create index if not exists idx_tokens_service_version on public.tokens(service_id, version);
+
+-- Make sure every service has a version row
+insert into public.service_token_counters (service_id)
+select id from public.services
+on conflict (service_id) do nothing;
+
+-- Queue versioning
+-- Every token write takes the next version of its service's queue at commit: the
+-- deferred triggers below bump the service's version row and stamp the token. The
+-- row is locked only from that point until the commit finishes, so writers of one
+-- service (call_next_token on N counters, presence, joins) run in parallel and only
+-- their commits queue up. Versions still become visible in commit order, so
+-- `version > since` never skips a late-committing write. Rows returned inside the
+-- writing transaction (RPC results) carry the previous version.
+--
+-- Lock order: writers that block take tokens, then counters (call_next_token only
+-- claims tokens with SKIP LOCKED, so it never waits on one); the per-service queue
+-- rows (service_token_counters, queue_stats) come last, at commit.
+create or replace function bump_token_version()
+returns trigger language plpgsql security definer set search_path = public as $$
+declare
+  v_version bigint;
+begin
+  insert into service_token_counters as c (service_id, version)
+  values (new.service_id, 1)
+  on conflict (service_id) do update set version = c.version + 1
+  returning c.version into v_version;
+  update tokens set version = v_version where id = new.id;
+  return null;
+end;
+$$;
+
+drop trigger if exists on_token_write on public.tokens;
+drop trigger if exists on_token_version_insert on public.tokens;
+create constraint trigger on_token_version_insert
+  after insert on public.tokens
+  deferrable initially deferred
+  for each row execute procedure bump_token_version();
+
+drop trigger if exists on_token_version_update on public.tokens;
+create constraint trigger on_token_version_update
+  after update on public.tokens
+  deferrable initially deferred
+  for each row
+  when (old.version is not distinct from new.version) -- not the stamp itself
+  execute procedure bump_token_version();
+
+-- Writers that touch several services in one transaction call this as their last
+-- step: it takes those services' queue rows in service_id order, so the commit-time
+-- triggers of two such transactions cannot take them in opposite orders.
+create or replace function lock_queue_rows(p_service_ids uuid[])
+returns void language plpgsql security definer set search_path = public as $$
+begin
+  perform 1 from service_token_counters where service_id = any(p_service_ids) order by service_id for update;
+end;
+$$;
+
+-- Re-create functions with the lock order of the version triggers
+create or replace function apply_presence_batch(
+  p_updates jsonb
+) returns json language plpgsql as $$
+declare
+  v_res json;
+  v_services uuid[];
+begin
+  with req as (
+    select
+      (u->>'token_id')::uuid as token_id,
+      (u->>'from_state')::token_state as from_state,
+      (u->>'to_state')::token_state as to_state
+    from jsonb_array_elements(p_updates) u
+  ),
+  updated as (
+    update tokens t
+    set state = req.to_state,
+        confirmed_at = case when req.to_state = 'CONFIRMED' then now() else t.confirmed_at end
+    from req
+    where t.id = req.token_id
+      and t.state = req.from_state
+      and (
+        (req.from_state = 'WAITING' and req.to_state in ('NEAR', 'CONFIRMED'))
+        or (req.from_state = 'NEAR' and req.to_state in ('WAITING', 'CONFIRMED'))
+        or (req.from_state = 'CONFIRMING' and req.to_state in ('NEAR', 'CONFIRMED'))
+      )
+    returning t.*
+  )
+  select coalesce(json_agg(row_to_json(updated.*)), '[]'::json), array_agg(distinct updated.service_id)
+  into v_res, v_services
+  from updated;
+
+  -- A batch can span several services
+  perform lock_queue_rows(v_services);
+
+  return v_res;
+end;
+$$;
+
+create or replace function finish_and_call_next(
+  p_token_id uuid
+) returns json language plpgsql as $$
+declare
+  v_token record;
+  v_finished json;
+  v_next json;
+begin
+  select * into v_token from tokens where id = p_token_id for update;
+  
+  if v_token.state is distinct from 'SERVING' then
+     raise exception 'Token is not currently serving';
+  end if;
+  
+  -- Token, then counter: the lock order of every blocking writer
+  perform 1 from counters where id = v_token.counter_id for update;
+  
+  -- Update Token
+  update tokens 
+  set state = 'DONE', service_end_at = now()
+  where id = p_token_id
+  returning row_to_json(tokens.*) into v_finished;
+  
+  -- Free the counter and immediately hand it the next confirmed token
+  if v_token.counter_id is not null then
+    update counters 
+    set status = 'FREE', current_token_id = null 
+    where id = v_token.counter_id;
+    
+    v_next := call_next_token(v_token.service_id, v_token.counter_id);
+  end if;
+  
+  return json_build_object('finished_token', v_finished, 'next_token', v_next);
+end;
+$$;
+
+-- 8. Queue Snapshot (compact projection of active tokens + queue version)
+-- The version is read before the tokens, so the rows are at least as new as
+-- the version; replaying /changes from it is idempotent.
+create or replace function queue_snapshot(
+  p_service_id uuid
+) returns json language plpgsql stable as $$
+declare
+  v_version bigint;
+  v_tokens json;
+begin
+  select version into v_version from service_token_counters where service_id = p_service_id;
+
+  select coalesce(json_agg(json_build_object(
+    'id', t.id,
+    'token_number', t.token_number,
+    'state', t.state,
+    'counter_id', t.counter_id,
+    'version', t.version
+  ) order by t.token_number), '[]'::json) into v_tokens
+  from tokens t
+  where t.service_id = p_service_id
+    and t.state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED', 'CALLED', 'SERVING');
+
+  return json_build_object('version', coalesce(v_version, 0), 'tokens', v_tokens);
+end;
+$$;
@@ -35,6 +35,9 @@ create table public.counters (
   name text not null,
   status counter_status not null default 'FREE',
   current_token_id uuid, -- FK added later
+  skills text[], -- token skills this counter handles; null = all
+  weight int not null default 1 check (weight > 0), -- higher weight gets dispatched to first
+  freed_at timestamptz not null default now(), -- last time the counter became idle (see touch_counter_freed_at)
   created_at timestamptz not null default now()
 );
 
@@ -56,8 +59,58 @@ create table public.tokens (
   
   -- Verification
   entry_qr_code text,
-  exit_qr_code text
+  exit_qr_code text,
   
+  -- Queue version at the time of the last write (for /queue/{id}/changes)
+  version bigint not null default 0,
+  
+  -- Routing: higher priority lanes are called first; a skill restricts the counters
+  priority smallint not null default 0,
+  skill text
+);
+
+-- Per-service token numbering (one row per service, bumped atomically by issue_token)
+create table if not exists public.service_token_counters (
+  service_id uuid primary key references public.services(id) on delete cascade,
+  last_number int not null default 0,
+  counter_date date not null default current_date,
+  reset_daily boolean not null default false, -- restart numbering at 1 each day
+  version bigint not null default 0 -- queue version, bumped on every token write (see bump_token_version)
+);
+
+-- Per-service queue summary, maintained incrementally by apply_queue_stats (one tiny
+-- row per service for dashboards instead of the full token list)
+create table if not exists public.queue_stats (
+  service_id uuid primary key references public.services(id) on delete cascade,
+  active_count int not null default 0, -- CREATED .. SERVING
+  waiting_count int not null default 0, -- in line: CREATED .. CONFIRMED
+  confirmed_count int not null default 0,
+  last_called_number int, -- "now serving"
+  avg_wait_seconds double precision, -- EWMA (alpha 0.2) of issued_at -> called_at
+  updated_at timestamptz not null default now()
+);
+
+-- Archived tokens (cold). Finished tokens are moved here by archive_finished_tokens
+-- so the hot `tokens` table only holds the live queue plus recent history.
+-- Same columns as tokens, in the same order, plus archived_at.
+create table if not exists public.tokens_history (
+  like public.tokens including defaults,
+  archived_at timestamptz not null default now(),
+  primary key (id)
+);
+
+-- Token transition log (append-only). One row per state change of a token, written
+-- by the statement triggers below in the transaction that made the change. No
+-- foreign key: events outlive archived tokens. Fixed-width columns first, so a row
+-- is ~100 bytes; time-range scans use a BRIN index (rows arrive in time order).
+create table if not exists public.token_events (
+  at timestamptz not null default now(),
+  token_id uuid not null,
+  service_id uuid not null,
+  counter_id uuid,
+  from_state token_state, -- null for a newly issued token
+  to_state token_state not null,
+  actor text not null -- RPC (or table) the change came through, or the in-memory engine operation
 );
 
 -- Partial Unique Index (User can only have one active token per service)
@@ -71,25 +124,272 @@ alter table public.counters
 -- INDEXES
 create index idx_tokens_service_state on public.tokens(service_id, state);
 create index idx_tokens_user on public.tokens(user_identifier);
+create index if not exists idx_tokens_confirmed_queue on public.tokens(service_id, priority desc, token_number) include (id, skill)
+where state = 'CONFIRMED'; -- call_next_token reads the head of this index
+create index if not exists idx_tokens_service_version on public.tokens(service_id, version);
+create index if not exists idx_tokens_sweep on public.tokens(issued_at)
+where state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CALLED'); -- sweep_stale_tokens candidates
+create index if not exists idx_tokens_archive on public.tokens(issued_at)
+where state in ('DONE', 'MISSED', 'EXPIRED'); -- archive_finished_tokens candidates
+create index if not exists idx_tokens_waiting_line on public.tokens(service_id, token_number)
+where state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED'); -- count_waiting_ahead
+create index if not exists idx_tokens_history_service on public.tokens_history(service_id, issued_at);
+create index if not exists idx_tokens_history_user on public.tokens_history(user_identifier);
+create index if not exists idx_token_events_at on public.token_events using brin (at);
+create index if not exists idx_token_events_service on public.token_events(service_id, at);
+create index if not exists idx_token_events_token on public.token_events(token_id);
+
+-- Live and archived tokens together, for history / analytics reads
+-- Columns are listed by name: tokens_history of older deployments got the routing
+-- columns appended after archived_at (see counter_scheduler.sql)
+create or replace view public.tokens_all with (security_invoker = on) as
+  select id, service_id, counter_id, user_identifier, token_number, state,
+         issued_at, confirmed_at, called_at, service_start_at, service_end_at,
+         entry_qr_code, exit_qr_code, version, priority, skill, null::timestamptz as archived_at
+  from public.tokens
+  union all
+  select id, service_id, counter_id, user_identifier, token_number, state,
+         issued_at, confirmed_at, called_at, service_start_at, service_end_at,
+         entry_qr_code, exit_qr_code, version, priority, skill, archived_at
+  from public.tokens_history;
+
+-- Queue versioning
+-- Every token write takes the next version of its service's queue at commit: the
+-- deferred triggers below bump the service's version row and stamp the token. The
+-- row is locked only from that point until the commit finishes, so writers of one
+-- service (call_next_token on N counters, presence, joins) run in parallel and only
+-- their commits queue up. Versions still become visible in commit order, so
+-- `version > since` never skips a late-committing write. Rows returned inside the
+-- writing transaction (RPC results) carry the previous version.
+--
+-- Lock order: writers that block take tokens, then counters (call_next_token only
+-- claims tokens with SKIP LOCKED, so it never waits on one); the per-service queue
+-- rows (service_token_counters, queue_stats) come last, at commit.
+create or replace function bump_token_version()
+returns trigger language plpgsql security definer set search_path = public as $$
+declare
+  v_version bigint;
+begin
+  insert into service_token_counters as c (service_id, version)
+  values (new.service_id, 1)
+  on conflict (service_id) do update set version = c.version + 1
+  returning c.version into v_version;
+  update tokens set version = v_version where id = new.id;
+  return null;
+end;
+$$;
+
+drop trigger if exists on_token_write on public.tokens;
+drop trigger if exists on_token_version_insert on public.tokens;
+create constraint trigger on_token_version_insert
+  after insert on public.tokens
+  deferrable initially deferred
+  for each row execute procedure bump_token_version();
+
+drop trigger if exists on_token_version_update on public.tokens;
+create constraint trigger on_token_version_update
+  after update on public.tokens
+  deferrable initially deferred
+  for each row
+  when (old.version is not distinct from new.version) -- not the stamp itself
+  execute procedure bump_token_version();
+
+-- Writers that touch several services in one transaction call this as their last
+-- step: it takes those services' queue rows in service_id order, so the commit-time
+-- triggers of two such transactions cannot take them in opposite orders.
+create or replace function lock_queue_rows(p_service_ids uuid[])
+returns void language plpgsql security definer set search_path = public as $$
+begin
+  perform 1 from service_token_counters where service_id = any(p_service_ids) order by service_id for update;
+  perform 1 from queue_stats where service_id = any(p_service_ids) order by service_id for update;
+end;
+$$;
+
+-- Counter idle tracking
+-- freed_at is when the counter last became idle (FREE with nobody at it), so
+-- dispatch_service can hand the next token to the counter that has waited longest.
+create or replace function touch_counter_freed_at()
+returns trigger language plpgsql as $$
+begin
+  if new.status = 'FREE' and new.current_token_id is null
+     and (old.status is distinct from 'FREE' or old.current_token_id is not null) then
+    new.freed_at := now();
+  end if;
+  return new;
+end;
+$$;
+
+drop trigger if exists on_counter_write on public.counters;
+create trigger on_counter_write
+  before update on public.counters
+  for each row execute procedure touch_counter_freed_at();
+
+-- Queue summary
+-- Applies the state delta of every token write (and delete) to queue_stats when the
+-- transaction commits, so all RPCs (and direct writes) keep the summary exact.
+-- Deferred like the version triggers and named to fire after them, so the lock
+-- order is version row -> stats row everywhere.
+create or replace function apply_queue_stats()
+returns trigger language plpgsql security definer set search_path = public as $$
+declare
+  v_row record;
+  v_from token_state;
+  v_to token_state;
+  v_active int;
+  v_waiting int;
+  v_confirmed int;
+  v_called int;
+  v_wait double precision;
+begin
+  if tg_op = 'DELETE' then
+    v_row := old;
+    v_from := old.state;
+  elsif tg_op = 'UPDATE' then
+    if old.state = new.state then
+      return null;
+    end if;
+    v_row := new;
+    v_from := old.state;
+    v_to := new.state;
+  else
+    v_row := new;
+    v_to := new.state;
+  end if;
+
+  v_active := coalesce((v_to in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED', 'CALLED', 'SERVING'))::int, 0)
+    - coalesce((v_from in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED', 'CALLED', 'SERVING'))::int, 0);
+  v_waiting := coalesce((v_to in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED'))::int, 0)
+    - coalesce((v_from in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED'))::int, 0);
+  v_confirmed := coalesce((v_to = 'CONFIRMED')::int, 0) - coalesce((v_from = 'CONFIRMED')::int, 0);
+
+  if v_to = 'CALLED' then
+    v_called := v_row.token_number;
+    v_wait := extract(epoch from coalesce(v_row.called_at, now()) - v_row.issued_at);
+  end if;
+
+  -- Nothing to apply (WAITING -> NEAR, archiving a finished token, ...): leave the row unlocked
+  if v_active = 0 and v_waiting = 0 and v_confirmed = 0 and v_called is null then
+    return null;
+  end if;
+
+  insert into queue_stats as s (service_id, active_count, waiting_count, confirmed_count, last_called_number, avg_wait_seconds)
+  values (v_row.service_id, v_active, v_waiting, v_confirmed, v_called, v_wait)
+  on conflict (service_id) do update set
+    active_count = s.active_count + v_active,
+    waiting_count = s.waiting_count + v_waiting,
+    confirmed_count = s.confirmed_count + v_confirmed,
+    last_called_number = coalesce(v_called, s.last_called_number),
+    avg_wait_seconds = case
+      when v_wait is null then s.avg_wait_seconds
+      when s.avg_wait_seconds is null then v_wait
+      else s.avg_wait_seconds + 0.2 * (v_wait - s.avg_wait_seconds)
+    end,
+    updated_at = now();
+  return null;
+end;
+$$;
+
+drop trigger if exists on_token_stats on public.tokens;
+drop trigger if exists on_token_write_stats on public.tokens;
+create constraint trigger on_token_write_stats
+  after insert or update of state or delete on public.tokens
+  deferrable initially deferred
+  for each row execute procedure apply_queue_stats();
+
+-- Transition log
+-- Statement triggers with transition tables: a sweep or bulk change of N tokens
+-- logs its N events with one insert. The actor is the PostgREST route of the
+-- request (/rpc/call_next_token -> call_next_token), or the database user.
+create or replace function token_event_actor()
+returns text language sql stable as $$
+  select coalesce(nullif(regexp_replace(current_setting('request.path', true), '^/(rpc/)?', ''), ''), session_user::text);
+$$;
+
+create or replace function log_token_inserts()
+returns trigger language plpgsql security definer set search_path = public as $$
+begin
+  insert into token_events (token_id, service_id, counter_id, from_state, to_state, actor)
+  select n.id, n.service_id, n.counter_id, null, n.state, token_event_actor()
+  from new_rows n;
+  return null;
+end;
+$$;
+
+create or replace function log_token_transitions()
+returns trigger language plpgsql security definer set search_path = public as $$
+begin
+  insert into token_events (token_id, service_id, counter_id, from_state, to_state, actor)
+  select n.id, n.service_id, n.counter_id, o.state, n.state, token_event_actor()
+  from new_rows n
+  join old_rows o on o.id = n.id
+  where o.state is distinct from n.state;
+  return null;
+end;
+$$;
+
+create or replace function forbid_token_event_changes()
+returns trigger language plpgsql as $$
+begin
+  raise exception 'token_events is append-only';
+end;
+$$;
+
+drop trigger if exists on_token_insert_event on public.tokens;
+create trigger on_token_insert_event
+  after insert on public.tokens
+  referencing new table as new_rows
+  for each statement execute procedure log_token_inserts();
+
+drop trigger if exists on_token_state_event on public.tokens;
+create trigger on_token_state_event
+  after update on public.tokens
+  referencing old table as old_rows new table as new_rows
+  for each statement execute procedure log_token_transitions();
+
+drop trigger if exists on_token_event_change on public.token_events;
+create trigger on_token_event_change
+  before update or delete on public.token_events
+  for each statement execute procedure forbid_token_event_changes();
 
 -- RLS
 alter table public.services enable row level security;
 alter table public.counters enable row level security;
 alter table public.tokens enable row level security;
+alter table public.service_token_counters enable row level security; -- only reachable through issue_token (security definer)
+alter table public.tokens_history enable row level security;
+alter table public.queue_stats enable row level security;
+alter table public.token_events enable row level security;
 
 create policy "Allow public read" on public.services for select using (true);
 create policy "Allow public read counters" on public.counters for select using (true);
 create policy "Allow public read tokens" on public.tokens for select using (true);
 create policy "Allow all tokens" on public.tokens for all using (true); -- Dev mode
+create policy "Allow public read tokens history" on public.tokens_history for select using (true);
+create policy "Allow public read queue stats" on public.queue_stats for select using (true); -- written only by apply_queue_stats (security definer)
+create policy "Allow public read token events" on public.token_events for select using (true); -- written by the log triggers (security definer) and the backend
+
+-- Realtime: dashboards subscribe to their service's queue_stats row
+do $$
+begin
+  if exists (select 1 from pg_publication where pubname = 'supabase_realtime')
+     and not exists (select 1 from pg_publication_tables
+                     where pubname = 'supabase_realtime' and schemaname = 'public' and tablename = 'queue_stats') then
+    alter publication supabase_realtime add table public.queue_stats;
+  end if;
+end;
+$$;
 
 -- FUNCTIONS (RPCs)
 
--- 1. Atomic Token Issuing
 -- 1. Atomic Token Issuing (Updated for Auth)
+-- Numbers come from service_token_counters: one row lock per join instead of a
+-- max() scan over the whole token history, and concurrent joins never collide.
+drop function if exists issue_token(uuid);
+drop function if exists issue_token(uuid, text);
 create or replace function issue_token(
-  p_service_id uuid
-  -- p_user_id removed, we use auth.uid()
-) returns json language plpgsql as $$
+  p_service_id uuid,
+  p_user_id text default null -- only honoured for the backend (service_role); users get auth.uid()
+) returns json language plpgsql security definer set search_path = public as $$
 declare
   v_status service_status;
   v_next_num int;
@@ -98,6 +398,10 @@ declare
 begin
   v_user_id := auth.uid()::text;
   
+  if v_user_id is null and auth.role() = 'service_role' then
+    v_user_id := p_user_id;
+  end if;
+  
   if v_user_id is null then
     raise exception 'Not authenticated';
   end if;
@@ -113,9 +417,16 @@ begin
     raise exception 'User already has an active token';
   end if;
 
-  -- Get next number
-  select coalesce(max(token_number), 0) + 1 into v_next_num 
-  from tokens where service_id = p_service_id;
+  -- Get next number (O(1) upsert on the per-service counter row)
+  insert into service_token_counters as c (service_id, last_number, counter_date)
+  values (p_service_id, 1, current_date)
+  on conflict (service_id) do update
+    set last_number = case
+          when c.reset_daily and c.counter_date < current_date then 1
+          else c.last_number + 1
+        end,
+        counter_date = current_date
+  returning c.last_number into v_next_num;
 
   -- Insert
   insert into tokens (service_id, user_identifier, token_number, state)
@@ -152,41 +463,53 @@ end;
 $$;
 
 -- 3. Call Next Token (Admin/Auto)
+-- Safe for many counters pulling from one queue: the counter row is locked so
+-- the busy check cannot race, and the token is claimed with SKIP LOCKED so
+-- concurrent callers each take a different token instead of blocking.
+-- Highest priority lane first, then lowest number, among the tokens whose skill
+-- the counter has (tokens without a skill go to any counter).
 create or replace function call_next_token(
   p_service_id uuid,
   p_counter_id uuid
 ) returns json language plpgsql as $$
 declare
-  v_next_token_id uuid;
+  v_counter record;
   v_res json;
 begin
-  -- Check Counter
-  if exists (select 1 from counters where id = p_counter_id and status = 'BUSY') then
+  -- Check Counter (row lock serializes calls from the same counter)
+  select status, skills into v_counter from counters where id = p_counter_id for update;
+  if v_counter.status = 'BUSY' then
     raise exception 'Counter is busy';
   end if;
+  if v_counter.status = 'OFFLINE' then
+    raise exception 'Counter is offline';
+  end if;
 
-  -- Find eligible token (Smallest number that is CONFIRMED)
-  select id into v_next_token_id
-  from tokens
-  where service_id = p_service_id and state = 'CONFIRMED'
-  order by token_number asc
-  limit 1;
+  -- Claim eligible token (CONFIRMED, routable to this counter and not being claimed)
+  with next_token as (
+    select id
+    from tokens
+    where service_id = p_service_id and state = 'CONFIRMED'
+      and (skill is null or v_counter.skills is null or skill = any(v_counter.skills))
+    order by priority desc, token_number asc
+    limit 1
+    for update skip locked
+  )
+  update tokens t
+  set state = 'CALLED', called_at = now(), counter_id = p_counter_id
+  from next_token
+  where t.id = next_token.id
+  returning row_to_json(t.*) into v_res;
 
-  if v_next_token_id is null then
+  if v_res is null then
     return null; -- No one to call
   end if;
 
-  -- Update Token
-  update tokens 
-  set state = 'CALLED', called_at = now(), counter_id = p_counter_id
-  where id = v_next_token_id;
-
   -- Update Counter
   update counters
-  set current_token_id = v_next_token_id
+  set current_token_id = (v_res->>'id')::uuid
   where id = p_counter_id;
   
-  select row_to_json(t.*) into v_res from tokens t where id = v_next_token_id;
   return v_res;
 end;
 $$;
@@ -258,3 +581,430 @@ begin
   return v_res;
 end;
 $$;
+
+-- 6. Batch Presence Transitions (Periodic location pings)
+-- p_updates: [{"token_id": uuid, "from_state": token_state, "to_state": token_state}, ...]
+-- Each row is applied only if the token is still in from_state (compare-and-set),
+-- so transitions decided by the backend cannot overwrite a concurrent call/cancel.
+create or replace function apply_presence_batch(
+  p_updates jsonb
+) returns json language plpgsql as $$
+declare
+  v_res json;
+  v_services uuid[];
+begin
+  with req as (
+    select
+      (u->>'token_id')::uuid as token_id,
+      (u->>'from_state')::token_state as from_state,
+      (u->>'to_state')::token_state as to_state
+    from jsonb_array_elements(p_updates) u
+  ),
+  updated as (
+    update tokens t
+    set state = req.to_state,
+        confirmed_at = case when req.to_state = 'CONFIRMED' then now() else t.confirmed_at end
+    from req
+    where t.id = req.token_id
+      and t.state = req.from_state
+      and (
+        (req.from_state = 'WAITING' and req.to_state in ('NEAR', 'CONFIRMED'))
+        or (req.from_state = 'NEAR' and req.to_state in ('WAITING', 'CONFIRMED'))
+        or (req.from_state = 'CONFIRMING' and req.to_state in ('NEAR', 'CONFIRMED'))
+      )
+    returning t.*
+  )
+  select coalesce(json_agg(row_to_json(updated.*)), '[]'::json), array_agg(distinct updated.service_id)
+  into v_res, v_services
+  from updated;
+
+  -- A batch can span several services
+  perform lock_queue_rows(v_services);
+
+  return v_res;
+end;
+$$;
+
+-- 7. Finish and Call Next (Exit QR Scan + auto-call in one transaction)
+-- Same as end_service followed by call_next_token, but in one round trip and
+-- without a window where the counter is FREE and nobody has been called.
+create or replace function finish_and_call_next(
+  p_token_id uuid
+) returns json language plpgsql as $$
+declare
+  v_token record;
+  v_finished json;
+  v_next json;
+begin
+  select * into v_token from tokens where id = p_token_id for update;
+  
+  if v_token.state is distinct from 'SERVING' then
+     raise exception 'Token is not currently serving';
+  end if;
+  
+  -- Token, then counter: the lock order of every blocking writer
+  perform 1 from counters where id = v_token.counter_id for update;
+  
+  -- Update Token
+  update tokens 
+  set state = 'DONE', service_end_at = now()
+  where id = p_token_id
+  returning row_to_json(tokens.*) into v_finished;
+  
+  -- Free the counter and immediately hand it the next confirmed token
+  if v_token.counter_id is not null then
+    update counters 
+    set status = 'FREE', current_token_id = null 
+    where id = v_token.counter_id;
+    
+    v_next := call_next_token(v_token.service_id, v_token.counter_id);
+  end if;
+  
+  return json_build_object('finished_token', v_finished, 'next_token', v_next);
+end;
+$$;
+
+-- 8. Queue Snapshot (compact projection of active tokens + queue version)
+-- The version is read before the tokens, so the rows are at least as new as
+-- the version; replaying /changes from it is idempotent.
+create or replace function queue_snapshot(
+  p_service_id uuid
+) returns json language plpgsql stable as $$
+declare
+  v_version bigint;
+  v_tokens json;
+begin
+  select version into v_version from service_token_counters where service_id = p_service_id;
+
+  select coalesce(json_agg(json_build_object(
+    'id', t.id,
+    'token_number', t.token_number,
+    'state', t.state,
+    'counter_id', t.counter_id,
+    'version', t.version
+  ) order by t.token_number), '[]'::json) into v_tokens
+  from tokens t
+  where t.service_id = p_service_id
+    and t.state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED', 'CALLED', 'SERVING');
+
+  return json_build_object('version', coalesce(v_version, 0), 'tokens', v_tokens);
+end;
+$$;
+
+-- 9. Sweep Stale Tokens (Background expiry / no-show)
+-- WAITING-side tokens older than p_waiting_timeout -> EXPIRED,
+-- CALLED tokens not started within p_called_timeout -> MISSED (counter freed).
+-- Handles at most p_batch_size tokens per call; the caller loops until fewer are touched.
+-- pg_try_advisory_xact_lock keeps batches from several workers from running at the
+-- same time (a call that finds it taken returns skipped); it is not a leader lock,
+-- every worker still sweeps each interval and usually finds little left to do.
+create or replace function sweep_stale_tokens(
+  p_waiting_timeout_seconds int,
+  p_called_timeout_seconds int,
+  p_batch_size int default 500
+) returns json language plpgsql as $$
+declare
+  v_ids uuid[];
+  v_res json;
+begin
+  if not pg_try_advisory_xact_lock(hashtext('sweep_stale_tokens')) then
+    return json_build_object('skipped', true);
+  end if;
+
+  select array_agg(id) into v_ids
+  from (
+    select id from tokens
+    where (state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING')
+           and issued_at < now() - make_interval(secs => p_waiting_timeout_seconds))
+       or (state = 'CALLED'
+           and called_at < now() - make_interval(secs => p_called_timeout_seconds))
+    order by issued_at
+    limit p_batch_size
+  ) stale;
+
+  if v_ids is null then
+    return json_build_object('skipped', false, 'touched', 0, 'counters_freed', 0, 'services', '{}'::json);
+  end if;
+
+  -- Lock order of every blocking writer: tokens, then counters (call_next_token
+  -- and dispatch_service skip locked tokens, so they never wait on us)
+  perform 1 from tokens where id = any(v_ids) order by id for update;
+  perform 1 from counters where current_token_id = any(v_ids) order by id for update;
+
+  with swept as (
+    update tokens t
+    set state = case when t.state = 'CALLED' then 'MISSED'::token_state else 'EXPIRED'::token_state end
+    where t.id = any(v_ids)
+      and ((t.state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING')
+            and t.issued_at < now() - make_interval(secs => p_waiting_timeout_seconds))
+        or (t.state = 'CALLED'
+            and t.called_at < now() - make_interval(secs => p_called_timeout_seconds)))
+    returning t.id, t.service_id, t.state
+  ),
+  freed as (
+    update counters c
+    set status = 'FREE', current_token_id = null
+    from swept
+    where c.current_token_id = swept.id and swept.state = 'MISSED'
+    returning c.id
+  ),
+  per_service as (
+    select service_id,
+           count(*) filter (where state = 'EXPIRED') as expired,
+           count(*) filter (where state = 'MISSED') as missed
+    from swept
+    group by service_id
+  )
+  select json_build_object(
+    'skipped', false,
+    'touched', (select count(*) from swept),
+    'counters_freed', (select count(*) from freed),
+    'services', coalesce((select json_object_agg(service_id, json_build_object('expired', expired, 'missed', missed)) from per_service), '{}'::json)
+  ) into v_res;
+
+  -- A batch can span several services
+  perform lock_queue_rows(array(select distinct service_id from tokens where id = any(v_ids)));
+
+  return v_res;
+end;
+$$;
+
+-- 10. Archive Finished Tokens (hot/cold split)
+-- Moves DONE/MISSED/EXPIRED tokens issued more than p_older_than_seconds ago from
+-- tokens to tokens_history, at most p_batch_size per call; the caller loops until
+-- fewer are moved. Deletes do not bump the queue version: finished tokens were
+-- already published to /changes when they finished.
+create or replace function archive_finished_tokens(
+  p_older_than_seconds int,
+  p_batch_size int default 1000
+) returns json language plpgsql as $$
+declare
+  v_ids uuid[];
+  v_moved int;
+begin
+  if not pg_try_advisory_xact_lock(hashtext('archive_finished_tokens')) then
+    return json_build_object('skipped', true);
+  end if;
+
+  select array_agg(id) into v_ids
+  from (
+    select id from tokens
+    where state in ('DONE', 'MISSED', 'EXPIRED')
+      and issued_at < now() - make_interval(secs => p_older_than_seconds)
+    order by issued_at
+    limit p_batch_size
+  ) finished;
+
+  if v_ids is null then
+    return json_build_object('skipped', false, 'moved', 0);
+  end if;
+
+  -- Lock order of every blocking writer: tokens, then counters.
+  -- A token cancelled while CALLED can still be a counter's current_token_id.
+  perform 1 from tokens where id = any(v_ids) order by id for update;
+  perform 1 from counters where current_token_id = any(v_ids) order by id for update;
+  update counters set current_token_id = null where current_token_id = any(v_ids);
+
+  with moved as (
+    delete from tokens
+    where id = any(v_ids) and state in ('DONE', 'MISSED', 'EXPIRED')
+    returning *
+  )
+  insert into tokens_history (
+    id, service_id, counter_id, user_identifier, token_number, state,
+    issued_at, confirmed_at, called_at, service_start_at, service_end_at,
+    entry_qr_code, exit_qr_code, version, priority, skill, archived_at
+  )
+  select id, service_id, counter_id, user_identifier, token_number, state,
+         issued_at, confirmed_at, called_at, service_start_at, service_end_at,
+         entry_qr_code, exit_qr_code, version, priority, skill, now()
+  from moved;
+  get diagnostics v_moved = row_count;
+
+  return json_build_object('skipped', false, 'moved', v_moved);
+end;
+$$;
+
+-- 11. Dispatch (auto-assign confirmed tokens to idle counters)
+-- Every idle counter of the service (FREE and nobody called to it), best first:
+-- highest weight, then idle longest, gets call_next_token. Counters locked by a
+-- concurrent dispatch or call are skipped. Returns the calls made, the counters
+-- left idle, and whether confirmed tokens are still waiting (e.g. for a skill no
+-- idle counter has).
+create or replace function dispatch_service(
+  p_service_id uuid
+) returns json language plpgsql as $$
+declare
+  v_counter_id uuid;
+  v_token json;
+  v_assigned json[] := '{}';
+  v_idle int := 0;
+begin
+  for v_counter_id in
+    select c.id from counters c
+    where c.service_id = p_service_id and c.status = 'FREE'
+      -- a cancelled or missed call leaves current_token_id behind
+      and not exists (select 1 from tokens t where t.id = c.current_token_id and t.state = 'CALLED')
+    order by c.weight desc, c.freed_at asc
+    for update of c skip locked
+  loop
+    v_token := call_next_token(p_service_id, v_counter_id);
+    if v_token is null then
+      v_idle := v_idle + 1;
+    else
+      v_assigned := v_assigned || v_token;
+    end if;
+  end loop;
+
+  return json_build_object(
+    'assigned', array_to_json(v_assigned),
+    'idle_counters', v_idle,
+    'backlog', exists (select 1 from tokens where service_id = p_service_id and state = 'CONFIRMED')
+  );
+end;
+$$;
+
+-- 12. Counter Status (FREE <-> OFFLINE)
+-- A counter can go OFFLINE only with nobody being served at it or called to it;
+-- the current_token_id left behind by a cancelled or missed call is cleared.
+create or replace function set_counter_status(
+  p_counter_id uuid,
+  p_status counter_status
+) returns json language plpgsql as $$
+declare
+  v_counter record;
+  v_res json;
+begin
+  if p_status = 'BUSY' then
+    raise exception 'Counter status BUSY is set by entry scans';
+  end if;
+
+  select * into v_counter from counters where id = p_counter_id for update;
+  if not found then
+    return null;
+  end if;
+  if v_counter.status = 'BUSY'
+     or (p_status = 'OFFLINE' and exists (select 1 from tokens where id = v_counter.current_token_id and state = 'CALLED')) then
+    raise exception 'Counter is busy';
+  end if;
+
+  update counters
+  set status = p_status,
+      current_token_id = case when p_status = 'OFFLINE' then null else current_token_id end
+  where id = p_counter_id
+  returning row_to_json(counters.*) into v_res;
+  return v_res;
+end;
+$$;
+
+-- 13. Bulk Transition (admin cancel / complete)
+-- Moves the tokens in p_token_ids, or up to p_limit tokens of p_service_id in
+-- p_states (lowest number first), to p_to_state in one statement. Only tokens in
+-- p_allowed_from (the sources of -> p_to_state in VALID_TRANSITIONS, passed by the
+-- backend) are moved; counters holding a moved token are freed. One outcome per
+-- requested token, in request order:
+-- {token_id, outcome: applied | invalid_transition | not_found, from_state, token}
+create or replace function bulk_transition(
+  p_to_state token_state,
+  p_allowed_from token_state[],
+  p_token_ids uuid[] default null,
+  p_service_id uuid default null,
+  p_states token_state[] default null,
+  p_limit int default 1000
+) returns json language plpgsql as $$
+declare
+  v_ids uuid[];
+  v_res json;
+begin
+  if p_token_ids is not null then
+    v_ids := p_token_ids[1:p_limit];
+  else
+    select array_agg(id order by token_number) into v_ids
+    from (
+      select id, token_number from tokens
+      where service_id = p_service_id
+        and state = any(p_allowed_from)
+        and (p_states is null or state = any(p_states))
+      order by token_number
+      limit p_limit
+    ) picked;
+  end if;
+
+  if v_ids is null or cardinality(v_ids) = 0 then
+    return '[]'::json;
+  end if;
+
+  -- Lock order of every blocking writer: tokens, then counters (call_next_token
+  -- and dispatch_service skip locked tokens, so they never wait on us). With the
+  -- tokens locked, the states read below are the ones the update sees.
+  perform 1 from tokens where id = any(v_ids) order by id for update;
+
+  -- Picked by filter before the lock: drop tokens that left it meanwhile (a WAITING
+  -- token called in between is no longer "WAITING" and must not be cancelled)
+  if p_token_ids is null then
+    select array_agg(id order by token_number) into v_ids
+    from tokens
+    where id = any(v_ids)
+      and state = any(p_allowed_from)
+      and (p_states is null or state = any(p_states));
+    if v_ids is null then
+      return '[]'::json;
+    end if;
+  end if;
+
+  perform 1 from counters where current_token_id = any(v_ids) order by id for update;
+
+  with requested as (
+    select id, ord from unnest(v_ids) with ordinality as r(id, ord)
+  ),
+  current_state as (
+    select id, state from tokens where id = any(v_ids)
+  ),
+  moved as (
+    update tokens t
+    set state = p_to_state,
+        service_end_at = case when p_to_state = 'DONE' then coalesce(t.service_end_at, now()) else t.service_end_at end
+    from current_state c
+    where t.id = c.id and c.state = any(p_allowed_from) and (p_states is null or c.state = any(p_states))
+    returning t.*
+  ),
+  freed as (
+    update counters c
+    set status = 'FREE', current_token_id = null
+    from moved
+    where c.current_token_id = moved.id
+    returning c.id
+  )
+  select coalesce(json_agg(json_build_object(
+    'token_id', r.id,
+    'outcome', case when c.id is null then 'not_found' when m.id is null then 'invalid_transition' else 'applied' end,
+    'from_state', c.state,
+    'token', case when m.id is not null then row_to_json(m.*) end
+  ) order by r.ord), '[]'::json) into v_res
+  from requested r
+  left join current_state c on c.id = r.id
+  left join moved m on m.id = r.id;
+
+  -- The ids can span several services
+  perform lock_queue_rows(array(select distinct service_id from tokens where id = any(v_ids)));
+
+  return v_res;
+end;
+$$;
+
+-- 14. Waiting Ahead (queue positions for join / presence ETAs)
+-- For each (service, token_number) pair, how many tokens of that service are still
+-- waiting with a lower number. Counts come from idx_tokens_waiting_line, so only the
+-- counts cross the wire; one call answers a whole presence batch.
+create or replace function count_waiting_ahead(
+  p_service_ids uuid[],
+  p_token_numbers int[]
+) returns int[] language sql stable as $$
+  select coalesce(array_agg((
+    select count(*)::int from tokens t
+    where t.service_id = q.service_id
+      and t.state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED')
+      and t.token_number < q.token_number
+  ) order by q.ord), '{}')
+  from unnest(p_service_ids, p_token_numbers) with ordinality as q(service_id, token_number, ord);
+$$;
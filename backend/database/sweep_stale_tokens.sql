@@ -0,0 +1,83 @@
+-- Migration: Add sweep_stale_tokens for the background expiry sweeper
+-- Run this script to apply the changes without re-creating tables.
+-- Requires lock_queue_rows from queue_versions.sql.
+
+create index if not exists idx_tokens_sweep on public.tokens(issued_at)
+where state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CALLED'); -- sweep_stale_tokens candidates
+
+-- WAITING-side tokens older than p_waiting_timeout -> EXPIRED,
+-- CALLED tokens not started within p_called_timeout -> MISSED (counter freed).
+-- Handles at most p_batch_size tokens per call; the caller loops until fewer are touched.
+-- pg_try_advisory_xact_lock keeps batches from several workers from running at the
+-- same time (a call that finds it taken returns skipped); it is not a leader lock,
+-- every worker still sweeps each interval and usually finds little left to do.
+create or replace function sweep_stale_tokens(
+  p_waiting_timeout_seconds int,
+  p_called_timeout_seconds int,
+  p_batch_size int default 500
+) returns json language plpgsql as $$
+declare
+  v_ids uuid[];
+  v_res json;
+begin
+  if not pg_try_advisory_xact_lock(hashtext('sweep_stale_tokens')) then
+    return json_build_object('skipped', true);
+  end if;
+
+  select array_agg(id) into v_ids
+  from (
+    select id from tokens
+    where (state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING')
+           and issued_at < now() - make_interval(secs => p_waiting_timeout_seconds))
+       or (state = 'CALLED'
+           and called_at < now() - make_interval(secs => p_called_timeout_seconds))
+    order by issued_at
+    limit p_batch_size
+  ) stale;
+
+  if v_ids is null then
+    return json_build_object('skipped', false, 'touched', 0, 'counters_freed', 0, 'services', '{}'::json);
+  end if;
+
+  -- Lock order of every blocking writer: tokens, then counters (call_next_token
+  -- and dispatch_service skip locked tokens, so they never wait on us)
+  perform 1 from tokens where id = any(v_ids) order by id for update;
+  perform 1 from counters where current_token_id = any(v_ids) order by id for update;
+
+  with swept as (
+    update tokens t
+    set state = case when t.state = 'CALLED' then 'MISSED'::token_state else 'EXPIRED'::token_state end
+    where t.id = any(v_ids)
+      and ((t.state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING')
+            and t.issued_at < now() - make_interval(secs => p_waiting_timeout_seconds))
+        or (t.state = 'CALLED'
+            and t.called_at < now() - make_interval(secs => p_called_timeout_seconds)))
+    returning t.id, t.service_id, t.state
+  ),
+  freed as (
+    update counters c
+    set status = 'FREE', current_token_id = null
+    from swept
+    where c.current_token_id = swept.id and swept.state = 'MISSED'
+    returning c.id
+  ),
+  per_service as (
+    select service_id,
+           count(*) filter (where state = 'EXPIRED') as expired,
+           count(*) filter (where state = 'MISSED') as missed
+    from swept
+    group by service_id
+  )
+  select json_build_object(
+    'skipped', false,
+    'touched', (select count(*) from swept),
+    'counters_freed', (select count(*) from freed),
+    'services', coalesce((select json_object_agg(service_id, json_build_object('expired', expired, 'missed', missed)) from per_service), '{}'::json)
+  ) into v_res;
+
+  -- A batch can span several services
+  perform lock_queue_rows(array(select distinct service_id from tokens where id = any(v_ids)));
+
+  return v_res;
+end;
+$$;
@@ -0,0 +1,77 @@
+-- Migration: Per-service token counters for issue_token
+-- Run this script to apply the changes without re-creating tables.
+-- Replaces the coalesce(max(token_number), 0) + 1 scan with an atomic counter row.
+
+-- Per-service token numbering (one row per service, bumped atomically by issue_token)
+create table if not exists public.service_token_counters (
+  service_id uuid primary key references public.services(id) on delete cascade,
+  last_number int not null default 0,
+  counter_date date not null default current_date,
+  reset_daily boolean not null default false -- restart numbering at 1 each day
+);
+
+alter table public.service_token_counters enable row level security;
+
+-- Backfill: continue numbering from the highest token already issued
+insert into public.service_token_counters (service_id, last_number)
+select s.id, coalesce(max(t.token_number), 0)
+from public.services s
+left join public.tokens t on t.service_id = s.id
+group by s.id
+on conflict (service_id) do nothing;
+
+-- 1. Atomic Token Issuing (Updated for Auth)
+-- Numbers come from service_token_counters: one row lock per join instead of a
+-- max() scan over the whole token history, and concurrent joins never collide.
+drop function if exists issue_token(uuid);
+drop function if exists issue_token(uuid, text);
+create or replace function issue_token(
+  p_service_id uuid,
+  p_user_id text default null -- only honoured for the backend (service_role); users get auth.uid()
+) returns json language plpgsql security definer set search_path = public as $$
+declare
+  v_status service_status;
+  v_next_num int;
+  v_new_token json;
+  v_user_id text;
+begin
+  v_user_id := auth.uid()::text;
+  
+  if v_user_id is null and auth.role() = 'service_role' then
+    v_user_id := p_user_id;
+  end if;
+  
+  if v_user_id is null then
+    raise exception 'Not authenticated';
+  end if;
+
+  -- Check service status
+  select status into v_status from services where id = p_service_id;
+  if v_status is null or v_status != 'OPEN' then
+    raise exception 'Service is closed or does not exist';
+  end if;
+
+  -- Check atomic constraints (Unique index handles race, but nice to check logic)
+  if exists (select 1 from tokens where service_id = p_service_id and user_identifier = v_user_id and state not in ('DONE', 'MISSED', 'EXPIRED')) then
+    raise exception 'User already has an active token';
+  end if;
+
+  -- Get next number (O(1) upsert on the per-service counter row)
+  insert into service_token_counters as c (service_id, last_number, counter_date)
+  values (p_service_id, 1, current_date)
+  on conflict (service_id) do update
+    set last_number = case
+          when c.reset_daily and c.counter_date < current_date then 1
+          else c.last_number + 1
+        end,
+        counter_date = current_date
+  returning c.last_number into v_next_num;
+
+  -- Insert
+  insert into tokens (service_id, user_identifier, token_number, state)
+  values (p_service_id, v_user_id, v_next_num, 'WAITING')
+  returning row_to_json(tokens.*) into v_new_token;
+  
+  return v_new_token;
+end;
+$$;
@@ -0,0 +1,79 @@
+-- Migration: Append-only token transition log (token_events)
+-- Run this script to apply the changes without re-creating tables.
+
+-- Token transition log (append-only). One row per state change of a token, written
+-- by the statement triggers below in the transaction that made the change. No
+-- foreign key: events outlive archived tokens. Fixed-width columns first, so a row
+-- is ~100 bytes; time-range scans use a BRIN index (rows arrive in time order).
+create table if not exists public.token_events (
+  at timestamptz not null default now(),
+  token_id uuid not null,
+  service_id uuid not null,
+  counter_id uuid,
+  from_state token_state, -- null for a newly issued token
+  to_state token_state not null,
+  actor text not null -- RPC (or table) the change came through, or the in-memory engine operation
+);
+
+create index if not exists idx_token_events_at on public.token_events using brin (at);
+create index if not exists idx_token_events_service on public.token_events(service_id, at);
+create index if not exists idx_token_events_token on public.token_events(token_id);
+
+-- Transition log
+-- Statement triggers with transition tables: a sweep or bulk change of N tokens
+-- logs its N events with one insert. The actor is the PostgREST route of the
+-- request (/rpc/call_next_token -> call_next_token), or the database user.
+create or replace function token_event_actor()
+returns text language sql stable as $$
+  select coalesce(nullif(regexp_replace(current_setting('request.path', true), '^/(rpc/)?', ''), ''), session_user::text);
+$$;
+
+create or replace function log_token_inserts()
+returns trigger language plpgsql security definer set search_path = public as $$
+begin
+  insert into token_events (token_id, service_id, counter_id, from_state, to_state, actor)
+  select n.id, n.service_id, n.counter_id, null, n.state, token_event_actor()
+  from new_rows n;
+  return null;
+end;
+$$;
+
+create or replace function log_token_transitions()
+returns trigger language plpgsql security definer set search_path = public as $$
+begin
+  insert into token_events (token_id, service_id, counter_id, from_state, to_state, actor)
+  select n.id, n.service_id, n.counter_id, o.state, n.state, token_event_actor()
+  from new_rows n
+  join old_rows o on o.id = n.id
+  where o.state is distinct from n.state;
+  return null;
+end;
+$$;
+
+create or replace function forbid_token_event_changes()
+returns trigger language plpgsql as $$
+begin
+  raise exception 'token_events is append-only';
+end;
+$$;
+
+drop trigger if exists on_token_insert_event on public.tokens;
+create trigger on_token_insert_event
+  after insert on public.tokens
+  referencing new table as new_rows
+  for each statement execute procedure log_token_inserts();
+
+drop trigger if exists on_token_state_event on public.tokens;
+create trigger on_token_state_event
+  after update on public.tokens
+  referencing old table as old_rows new table as new_rows
+  for each statement execute procedure log_token_transitions();
+
+drop trigger if exists on_token_event_change on public.token_events;
+create trigger on_token_event_change
+  before update or delete on public.token_events
+  for each statement execute procedure forbid_token_event_changes();
+
+alter table public.token_events enable row level security;
+drop policy if exists "Allow public read token events" on public.token_events;
+create policy "Allow public read token events" on public.token_events for select using (true); -- written by the log triggers (security definer) and the backend
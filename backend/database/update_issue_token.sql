@@ -1,10 +1,17 @@
 -- Migration: Update issue_token to use Auth.uid()
 -- Run this script to apply the changes without re-creating tables.
+-- Requires service_token_counters from token_counters.sql; kept identical to the
+-- issue_token there so re-running this script does not bring back the max() scan.
 
+-- 1. Atomic Token Issuing (Updated for Auth)
+-- Numbers come from service_token_counters: one row lock per join instead of a
+-- max() scan over the whole token history, and concurrent joins never collide.
+drop function if exists issue_token(uuid);
+drop function if exists issue_token(uuid, text);
 create or replace function issue_token(
-  p_service_id uuid
-  -- p_user_id removed, we use auth.uid()
-) returns json language plpgsql as $$
+  p_service_id uuid,
+  p_user_id text default null -- only honoured for the backend (service_role); users get auth.uid()
+) returns json language plpgsql security definer set search_path = public as $$
 declare
   v_status service_status;
   v_next_num int;
@@ -13,6 +20,10 @@ declare
 begin
   v_user_id := auth.uid()::text;
   
+  if v_user_id is null and auth.role() = 'service_role' then
+    v_user_id := p_user_id;
+  end if;
+  
   if v_user_id is null then
     raise exception 'Not authenticated';
   end if;
@@ -28,9 +39,16 @@ begin
     raise exception 'User already has an active token';
   end if;
 
-  -- Get next number
-  select coalesce(max(token_number), 0) + 1 into v_next_num 
-  from tokens where service_id = p_service_id;
+  -- Get next number (O(1) upsert on the per-service counter row)
+  insert into service_token_counters as c (service_id, last_number, counter_date)
+  values (p_service_id, 1, current_date)
+  on conflict (service_id) do update
+    set last_number = case
+          when c.reset_daily and c.counter_date < current_date then 1
+          else c.last_number + 1
+        end,
+        counter_date = current_date
+  returning c.last_number into v_next_num;
 
   -- Insert
   insert into tokens (service_id, user_identifier, token_number, state)
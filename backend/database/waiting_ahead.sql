@@ -0,0 +1,22 @@
+-- Migration: Add count_waiting_ahead for join / presence positions
+-- Run this script to apply the changes without re-creating tables.
+
+create index if not exists idx_tokens_waiting_line on public.tokens(service_id, token_number)
+where state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED'); -- count_waiting_ahead
+
+-- 14. Waiting Ahead (queue positions for join / presence ETAs)
+-- For each (service, token_number) pair, how many tokens of that service are still
+-- waiting with a lower number. Counts come from idx_tokens_waiting_line, so only the
+-- counts cross the wire; one call answers a whole presence batch.
+create or replace function count_waiting_ahead(
+  p_service_ids uuid[],
+  p_token_numbers int[]
+) returns int[] language sql stable as $$
+  select coalesce(array_agg((
+    select count(*)::int from tokens t
+    where t.service_id = q.service_id
+      and t.state in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED')
+      and t.token_number < q.token_number
+  ) order by q.ord), '{}')
+  from unnest(p_service_ids, p_token_numbers) with ordinality as q(service_id, token_number, ord);
+$$;
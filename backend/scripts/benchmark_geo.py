@@ -0,0 +1,141 @@
+import os
+import sys
+import math
+import random
+import timeit
+
+# Make `app` importable when run as `python scripts/benchmark_geo.py`
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(script_dir, '..'))
+
+# Settings are required at import time; the benchmark never talks to Supabase
+os.environ.setdefault("SUPABASE_URL", "http://unused.local")
+os.environ.setdefault("SUPABASE_KEY", "unused")
+
+import numpy as np
+from geopy.distance import geodesic
+from app.utils.geo import EARTH_RADIUS_M, calculate_distance, is_within_radius, distances_to_service, haversine_distance
+from app.logic.service_index import ServiceGrid
+
+SERVICE = (28.6139, 77.2090) # New Delhi
+RADIUS = 100.0
+N = 20000
+N_SERVICES = 50000
+
+def random_point(max_offset_m: float):
+    dlat = random.uniform(-max_offset_m, max_offset_m) / 111320.0
+    dlon = random.uniform(-max_offset_m, max_offset_m) / (111320.0 * math.cos(math.radians(SERVICE[0])))
+    return SERVICE[0] + dlat, SERVICE[1] + dlon
+
+def destination(lat: float, lon: float, bearing: float, meters: float):
+    # Point `meters` away on the haversine sphere
+    phi, lmb, theta, delta = math.radians(lat), math.radians(lon), math.radians(bearing), meters / EARTH_RADIUS_M
+    phi2 = math.asin(math.sin(phi) * math.cos(delta) + math.cos(phi) * math.sin(delta) * math.cos(theta))
+    lmb2 = lmb + math.atan2(math.sin(theta) * math.sin(delta) * math.cos(phi), math.cos(delta) - math.sin(phi) * math.sin(phi2))
+    return math.degrees(phi2), (math.degrees(lmb2) + 540.0) % 360.0 - 180.0
+
+def check_boundaries():
+    """
+    Points just inside the radius (haversine and geodesic) must never be cut by the
+    bounding box or the grid pre-reject, at any latitude and bearing.
+    """
+    misses = []
+    for lat in (0.0, 0.5, 28.6, 45.0, -60.0, 75.0):
+        for bearing in range(0, 360, 15):
+            for radius in (100.0, 5000.0, 50000.0):
+                inside = destination(lat, 77.0, bearing, radius * 0.9995)
+                if not is_within_radius(*inside, lat, 77.0, radius):
+                    misses.append(("haversine", lat, bearing, radius))
+                g = geodesic(meters=radius * 0.9995).destination((lat, 77.0), bearing)
+                if not is_within_radius(g.latitude, g.longitude, lat, 77.0, radius, precise=True):
+                    misses.append(("geodesic", lat, bearing, radius))
+                grid = ServiceGrid(0.02)
+                grid.upsert({"id": "s", "latitude": inside[0], "longitude": inside[1], "presence_radius": radius})
+                if not grid.nearby(lat, 77.0, radius, limit=1) or not grid.nearby(lat, 77.0, None, limit=1):
+                    misses.append(("grid", lat, bearing, radius))
+    print(f"  boundary points rejected while inside the radius: {len(misses)}")
+    assert not misses, misses[:5]
+
+def check_antimeridian():
+    """
+    Services and queries on opposite sides of ±180° longitude must still find each
+    other through the grid, with the same distances as haversine.
+    """
+    misses = []
+    for lat in (0.0, -16.5, 65.0):
+        for service_lon, query_lon in ((179.999, -179.999), (-179.999, 179.999), (179.9, -179.95), (180.0, -180.0)):
+            for cell_degrees in (0.02, 0.7):
+                grid = ServiceGrid(cell_degrees)
+                grid.upsert({"id": "s", "latitude": lat, "longitude": service_lon, "presence_radius": 20000.0})
+                expected = haversine_distance(lat, query_lon, lat, service_lon)
+                for radius in (20000.0, None):
+                    found = grid.nearby(lat, query_lon, radius, limit=1)
+                    if not found or abs(found[0]["distance"] - expected) > 0.1:
+                        misses.append((lat, service_lon, query_lon, cell_degrees, radius))
+    print(f"  services missed across the antimeridian: {len(misses)}")
+    assert not misses, misses[:5]
+
+def bench(label: str, fn, number: int):
+    seconds = min(timeit.repeat(fn, number=1, repeat=3))
+    print(f"  {label:<38} {seconds * 1000:9.2f} ms  ({seconds / number * 1e6:7.3f} us/point)")
+    return seconds
+
+def main():
+    random.seed(42)
+    # Mix of nearby pings (inside/outside radius) and far-away ones
+    points = [random_point(300) for _ in range(N // 2)] + [random_point(50000) for _ in range(N // 2)]
+    lats = np.array([p[0] for p in points])
+    lons = np.array([p[1] for p in points])
+
+    print(f"=== Distance engine benchmark ({N} points, radius {RADIUS} m) ===")
+
+    # Accuracy of the fast path against geodesic
+    max_err = max(
+        abs(calculate_distance(lat, lon, *SERVICE) - calculate_distance(lat, lon, *SERVICE, precise=True))
+        for lat, lon in points[:2000]
+        if calculate_distance(lat, lon, *SERVICE, precise=True) < 1000
+    )
+    print(f"  max |haversine - geodesic| under 1 km: {max_err:.3f} m")
+
+    mismatches = sum(
+        is_within_radius(lat, lon, *SERVICE, RADIUS) != is_within_radius(lat, lon, *SERVICE, RADIUS, precise=True)
+        for lat, lon in points
+    )
+    print(f"  radius decisions differing from geodesic: {mismatches}")
+    check_boundaries()
+    check_antimeridian()
+    print()
+
+    t_geo = bench("geodesic (precise=True)", lambda: [is_within_radius(lat, lon, *SERVICE, RADIUS, precise=True) for lat, lon in points], N)
+    t_fast = bench("bbox + haversine (default)", lambda: [is_within_radius(lat, lon, *SERVICE, RADIUS) for lat, lon in points], N)
+    t_vec = bench("numpy batch (distances_to_service)", lambda: distances_to_service(lats, lons, *SERVICE) <= RADIUS, N)
+
+    print(f"\n  speedup scalar fast path: {t_geo / t_fast:6.1f}x")
+    print(f"  speedup numpy batch:      {t_geo / t_vec:6.1f}x")
+
+    bench_nearby()
+
+def bench_nearby():
+    # Services spread over a ~100 km metro area, queried from random points in it
+    services = [
+        {"id": str(i), "name": f"Service {i}", "latitude": lat, "longitude": lon,
+         "presence_radius": random.choice((50, 100, 250)), "status": "OPEN"}
+        for i, (lat, lon) in enumerate(random_point(50000) for _ in range(N_SERVICES))
+    ]
+    grid = ServiceGrid(0.02)
+    t_build = min(timeit.repeat(lambda: [grid.upsert(s) for s in services], number=1, repeat=3))
+    queries = [random_point(50000) for _ in range(1000)]
+
+    print(f"\n=== Nearby services ({N_SERVICES} services, {len(grid.cells)} cells, built in {t_build * 1000:.1f} ms) ===")
+    for radius in (1000.0, 5000.0, None):
+        expected = sorted(
+            s["id"] for s in services
+            if haversine_distance(*queries[0], s["latitude"], s["longitude"]) <= (radius or s["presence_radius"])
+        )
+        assert sorted(r["id"] for r in grid.nearby(*queries[0], radius, limit=N_SERVICES)) == expected
+        seconds = min(timeit.repeat(lambda: [grid.nearby(lat, lon, radius, limit=50) for lat, lon in queries], number=1, repeat=3))
+        label = f"radius {radius:.0f} m" if radius else "joinable (own presence_radius)"
+        print(f"  {label:<38} {seconds / len(queries) * 1e6:9.1f} us/query")
+
+if __name__ == "__main__":
+    main()
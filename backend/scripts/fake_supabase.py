@@ -0,0 +1,495 @@
+"""
+In-memory stand-in for the async Supabase client, for offline load tests.
+
+Implements the subset of the PostgREST query builder the routers use
+(table/select/eq/in_/gt/lt/is_/order/limit/single/maybe_single/insert/update/delete)
+and the RPCs from database/schema.sql with the same state rules and error messages.
+Every execute() awaits a configurable delay to model the network round trip.
+"""
+import asyncio
+import re
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+ACTIVE_STATES = {'CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED', 'CALLED', 'SERVING'}
+FINISHED_STATES = {'DONE', 'MISSED', 'EXPIRED'}
+WAITING_STATES = {'CREATED', 'WAITING', 'NEAR', 'CONFIRMING', 'CONFIRMED'}
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class FakeAPIError(Exception):
+    pass
+
+class FakeResponse:
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+class FakeDB:
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000.0
+        self.tables: Dict[str, Dict[str, dict]] = {
+            "services": {}, "counters": {}, "tokens": {}, "profiles": {},
+            "organizations": {}, "service_token_counters": {}, "tokens_history": {}, "queue_stats": {}, "token_events": {},
+        }
+        self.actor = "tokens" # token_event_actor(): the RPC running, else a direct table write
+        self.tokens_by_service: Dict[str, set] = {}
+        self.round_trips = 0
+
+    # --- Seeding helpers ---
+
+    def add_service(self, name: str = "Bench Service", latitude: float = 28.6139, longitude: float = 77.2090,
+                    presence_radius: float = 100.0, status: str = "OPEN", organization_id: Optional[str] = None) -> dict:
+        return self._insert("services", {
+            "name": name, "latitude": latitude, "longitude": longitude, "presence_radius": presence_radius,
+            "status": status, "organization_id": organization_id, "updated_at": _now(),
+        })
+
+    def add_counter(self, service_id: str, name: str = "Counter 1", skills: Optional[List[str]] = None, weight: int = 1) -> dict:
+        return self._insert("counters", {"service_id": service_id, "name": name, "skills": skills, "weight": weight})
+
+    # --- Row helpers ---
+
+    def _insert(self, table: str, row: dict) -> dict:
+        row = dict(row)
+        if table != "service_token_counters":
+            row.setdefault("id", str(uuid.uuid4()))
+            row.setdefault("created_at", _now())
+        if table == "tokens":
+            row.setdefault("state", "CREATED")
+            row.setdefault("issued_at", _now())
+            for col in ("counter_id", "confirmed_at", "called_at", "service_start_at", "service_end_at", "skill"):
+                row.setdefault(col, None)
+            row.setdefault("priority", 0)
+            self.tokens_by_service.setdefault(row["service_id"], set()).add(row["id"])
+            self._bump_version(row)
+            self._apply_stats(None, row)
+            self._log_event(None, row)
+        if table == "counters":
+            row.setdefault("status", "FREE")
+            row.setdefault("current_token_id", None)
+            row.setdefault("skills", None)
+            row.setdefault("weight", 1)
+            row.setdefault("freed_at", _now())
+        key = row["service_id"] if table in ("service_token_counters", "queue_stats") else row["id"]
+        self.tables[table][key] = row
+        return row
+
+    def _bump_version(self, token: dict) -> None:
+        counters = self._queue_counter(token["service_id"])
+        counters["version"] += 1
+        token["version"] = counters["version"]
+
+    def _queue_counter(self, service_id: str) -> dict:
+        row = self.tables["service_token_counters"].get(service_id)
+        if row is None:
+            row = {"service_id": service_id, "last_number": 0, "version": 0}
+            self.tables["service_token_counters"][service_id] = row
+        return row
+
+    def _update_token(self, token: dict, **changes) -> dict:
+        old_state = token["state"]
+        token.update(changes)
+        self._bump_version(token)
+        if token["state"] != old_state:
+            self._apply_stats(old_state, token)
+            self._log_event(old_state, token)
+        return dict(token)
+
+    def _log_event(self, old_state: Optional[str], token: dict) -> None:
+        # Mirrors the log_token_inserts / log_token_transitions triggers
+        self._insert("token_events", {
+            "at": _now(), "token_id": token["id"], "service_id": token["service_id"], "counter_id": token["counter_id"],
+            "from_state": old_state, "to_state": token["state"], "actor": self.actor,
+        })
+
+    def _apply_stats(self, old_state: Optional[str], token: dict) -> None:
+        # Mirrors the apply_queue_stats trigger
+        stats = self.tables["queue_stats"].setdefault(token["service_id"], {
+            "service_id": token["service_id"], "active_count": 0, "waiting_count": 0, "confirmed_count": 0,
+            "last_called_number": None, "avg_wait_seconds": None,
+        })
+        new_state = token["state"]
+        stats["active_count"] += (new_state in ACTIVE_STATES) - (old_state in ACTIVE_STATES)
+        stats["waiting_count"] += (new_state in WAITING_STATES) - (old_state in WAITING_STATES)
+        stats["confirmed_count"] += (new_state == "CONFIRMED") - (old_state == "CONFIRMED")
+        if new_state == "CALLED":
+            wait = (datetime.fromisoformat(token["called_at"] or _now()) - datetime.fromisoformat(token["issued_at"])).total_seconds()
+            avg = stats["avg_wait_seconds"]
+            stats["last_called_number"] = token["token_number"]
+            stats["avg_wait_seconds"] = wait if avg is None else avg + 0.2 * (wait - avg)
+        stats["updated_at"] = _now()
+
+    @staticmethod
+    def _free_counter(counter: dict) -> None:
+        # Mirrors the touch_counter_freed_at trigger
+        counter.update(status="FREE", current_token_id=None, freed_at=_now())
+
+    def service_tokens(self, service_id: str) -> List[dict]:
+        tokens = self.tables["tokens"]
+        return [tokens[i] for i in self.tokens_by_service.get(service_id, ())]
+
+    # --- Client API ---
+
+    def table(self, name: str) -> "FakeQuery":
+        return FakeQuery(self, name)
+
+    def from_(self, name: str) -> "FakeQuery":
+        return self.table(name)
+
+    def rpc(self, fn: str, params: Optional[dict] = None) -> "FakeRPC":
+        return FakeRPC(self, fn, params or {})
+
+    async def round_trip(self) -> None:
+        self.round_trips += 1
+        await asyncio.sleep(self.latency)
+
+    # --- RPCs (mirror database/schema.sql) ---
+
+    def rpc_issue_token(self, p_service_id: str, p_user_id: Optional[str] = None) -> dict:
+        if not p_user_id:
+            raise FakeAPIError("Not authenticated")
+        service = self.tables["services"].get(p_service_id)
+        if service is None or service["status"] != "OPEN":
+            raise FakeAPIError("Service is closed or does not exist")
+        if any(t["user_identifier"] == p_user_id and t["state"] in ACTIVE_STATES for t in self.service_tokens(p_service_id)):
+            raise FakeAPIError("User already has an active token")
+        counter = self._queue_counter(p_service_id)
+        counter["last_number"] += 1
+        return dict(self._insert("tokens", {
+            "service_id": p_service_id, "user_identifier": p_user_id,
+            "token_number": counter["last_number"], "state": "WAITING",
+        }))
+
+    def rpc_confirm_token(self, p_token_id: str) -> dict:
+        token = self.tables["tokens"].get(p_token_id)
+        if token and token["state"] in ('WAITING', 'NEAR', 'CONFIRMING', 'CREATED'):
+            return self._update_token(token, state="CONFIRMED", confirmed_at=_now())
+        if token and token["state"] in ('CONFIRMED', 'CALLED', 'SERVING'):
+            return dict(token)
+        raise FakeAPIError("Token invalid or finished")
+
+    def rpc_call_next_token(self, p_service_id: str, p_counter_id: str) -> Optional[dict]:
+        counter = self.tables["counters"].get(p_counter_id)
+        if counter and counter["status"] == "BUSY":
+            raise FakeAPIError("Counter is busy")
+        if counter and counter["status"] == "OFFLINE":
+            raise FakeAPIError("Counter is offline")
+        skills = counter["skills"] if counter else None
+        confirmed = [
+            t for t in self.service_tokens(p_service_id)
+            if t["state"] == "CONFIRMED" and (t["skill"] is None or skills is None or t["skill"] in skills)
+        ]
+        if not confirmed:
+            return None
+        token = min(confirmed, key=lambda t: (-t["priority"], t["token_number"]))
+        result = self._update_token(token, state="CALLED", called_at=_now(), counter_id=p_counter_id)
+        if counter:
+            counter["current_token_id"] = token["id"]
+        return result
+
+    def rpc_start_service(self, p_token_id: str, p_counter_id: str) -> dict:
+        token = self.tables["tokens"].get(p_token_id)
+        if token is None or token["state"] != "CALLED":
+            raise FakeAPIError("Token is not called")
+        result = self._update_token(token, state="SERVING", service_start_at=_now(), counter_id=p_counter_id)
+        counter = self.tables["counters"].get(p_counter_id)
+        if counter:
+            counter.update(status="BUSY", current_token_id=p_token_id)
+        return result
+
+    def rpc_end_service(self, p_token_id: str) -> dict:
+        token = self.tables["tokens"].get(p_token_id)
+        if token is None or token["state"] != "SERVING":
+            raise FakeAPIError("Token is not currently serving")
+        result = self._update_token(token, state="DONE", service_end_at=_now())
+        counter = self.tables["counters"].get(token["counter_id"])
+        if counter:
+            self._free_counter(counter)
+        return result
+
+    def rpc_finish_and_call_next(self, p_token_id: str) -> dict:
+        finished = self.rpc_end_service(p_token_id)
+        next_token = None
+        if finished["counter_id"]:
+            next_token = self.rpc_call_next_token(finished["service_id"], finished["counter_id"])
+        return {"finished_token": finished, "next_token": next_token}
+
+    def _counter_idle(self, counter: dict) -> bool:
+        current = self.tables["tokens"].get(counter["current_token_id"] or "")
+        return counter["status"] == "FREE" and (current is None or current["state"] != "CALLED")
+
+    def rpc_dispatch_service(self, p_service_id: str) -> dict:
+        idle = sorted(
+            (c for c in self.tables["counters"].values() if c["service_id"] == p_service_id and self._counter_idle(c)),
+            key=lambda c: (-c["weight"], c["freed_at"])
+        )
+        assigned = [t for t in (self.rpc_call_next_token(p_service_id, c["id"]) for c in idle) if t]
+        return {
+            "assigned": assigned,
+            "idle_counters": len(idle) - len(assigned),
+            "backlog": any(t["state"] == "CONFIRMED" for t in self.service_tokens(p_service_id)),
+        }
+
+    def rpc_set_counter_status(self, p_counter_id: str, p_status: str) -> Optional[dict]:
+        if p_status == "BUSY":
+            raise FakeAPIError("Counter status BUSY is set by entry scans")
+        counter = self.tables["counters"].get(p_counter_id)
+        if counter is None:
+            return None
+        if counter["status"] == "BUSY" or (p_status == "OFFLINE" and not self._counter_idle(counter)):
+            raise FakeAPIError("Counter is busy")
+        if p_status == "OFFLINE":
+            counter.update(status=p_status, current_token_id=None)
+        elif counter["status"] != p_status:
+            counter["status"] = p_status
+            if counter["current_token_id"] is None:
+                counter["freed_at"] = _now()
+        return dict(counter)
+
+    def rpc_apply_presence_batch(self, p_updates: List[dict]) -> List[dict]:
+        allowed = {('WAITING', 'NEAR'), ('WAITING', 'CONFIRMED'), ('NEAR', 'WAITING'),
+                   ('NEAR', 'CONFIRMED'), ('CONFIRMING', 'NEAR'), ('CONFIRMING', 'CONFIRMED')}
+        applied = []
+        for u in p_updates:
+            token = self.tables["tokens"].get(u["token_id"])
+            if token and token["state"] == u["from_state"] and (u["from_state"], u["to_state"]) in allowed:
+                changes = {"state": u["to_state"]}
+                if u["to_state"] == "CONFIRMED":
+                    changes["confirmed_at"] = _now()
+                applied.append(self._update_token(token, **changes))
+        return applied
+
+    def rpc_queue_snapshot(self, p_service_id: str) -> dict:
+        tokens = sorted((t for t in self.service_tokens(p_service_id) if t["state"] in ACTIVE_STATES), key=lambda t: t["token_number"])
+        return {
+            "version": self._queue_counter(p_service_id)["version"],
+            "tokens": [{k: t[k] for k in ("id", "token_number", "state", "counter_id", "version")} for t in tokens],
+        }
+
+    def rpc_sweep_stale_tokens(self, p_waiting_timeout_seconds: int, p_called_timeout_seconds: int, p_batch_size: int = 500) -> dict:
+        now = datetime.now(timezone.utc)
+        services: Dict[str, dict] = {}
+        touched = freed = 0
+        for token in list(self.tables["tokens"].values()):
+            if touched >= p_batch_size:
+                break
+            if token["state"] in ('CREATED', 'WAITING', 'NEAR', 'CONFIRMING'):
+                age = (now - datetime.fromisoformat(token["issued_at"])).total_seconds()
+                if age <= p_waiting_timeout_seconds:
+                    continue
+                self._update_token(token, state="EXPIRED")
+                services.setdefault(token["service_id"], {"expired": 0, "missed": 0})["expired"] += 1
+            elif token["state"] == "CALLED" and token["called_at"]:
+                age = (now - datetime.fromisoformat(token["called_at"])).total_seconds()
+                if age <= p_called_timeout_seconds:
+                    continue
+                self._update_token(token, state="MISSED")
+                services.setdefault(token["service_id"], {"expired": 0, "missed": 0})["missed"] += 1
+                for counter in self.tables["counters"].values():
+                    if counter["current_token_id"] == token["id"]:
+                        self._free_counter(counter)
+                        freed += 1
+            else:
+                continue
+            touched += 1
+        return {"skipped": False, "touched": touched, "counters_freed": freed, "services": services}
+
+    def rpc_count_waiting_ahead(self, p_service_ids: List[str], p_token_numbers: List[int]) -> List[int]:
+        return [
+            sum(1 for t in self.service_tokens(service_id) if t["state"] in WAITING_STATES and t["token_number"] < number)
+            for service_id, number in zip(p_service_ids, p_token_numbers)
+        ]
+
+    def rpc_bulk_transition(self, p_to_state: str, p_allowed_from: List[str], p_token_ids: Optional[List[str]] = None,
+                            p_service_id: Optional[str] = None, p_states: Optional[List[str]] = None, p_limit: int = 1000) -> List[dict]:
+        tokens = self.tables["tokens"]
+        if p_token_ids is None:
+            picked = sorted(
+                (t for t in self.service_tokens(p_service_id)
+                 if t["state"] in p_allowed_from and (p_states is None or t["state"] in p_states)),
+                key=lambda t: t["token_number"]
+            )
+            p_token_ids = [t["id"] for t in picked]
+        results = []
+        for token_id in p_token_ids[:p_limit]:
+            token = tokens.get(token_id)
+            if token is None or token["state"] not in p_allowed_from:
+                outcome = "not_found" if token is None else "invalid_transition"
+                results.append({"token_id": token_id, "outcome": outcome, "from_state": token and token["state"], "token": None})
+                continue
+            from_state = token["state"]
+            for counter in self.tables["counters"].values():
+                if counter["current_token_id"] == token_id:
+                    self._free_counter(counter)
+            changes = {"service_end_at": token["service_end_at"] or _now()} if p_to_state == "DONE" else {}
+            moved = self._update_token(token, state=p_to_state, **changes)
+            results.append({"token_id": token_id, "outcome": "applied", "from_state": from_state, "token": moved})
+        return results
+
+    def rpc_archive_finished_tokens(self, p_older_than_seconds: int, p_batch_size: int = 1000) -> dict:
+        now = datetime.now(timezone.utc)
+        finished = sorted(
+            (t for t in self.tables["tokens"].values()
+             if t["state"] in FINISHED_STATES and (now - datetime.fromisoformat(t["issued_at"])).total_seconds() > p_older_than_seconds),
+            key=lambda t: t["issued_at"]
+        )[:p_batch_size]
+        for token in finished:
+            for counter in self.tables["counters"].values():
+                if counter["current_token_id"] == token["id"]:
+                    counter["current_token_id"] = None
+            del self.tables["tokens"][token["id"]]
+            self.tokens_by_service[token["service_id"]].discard(token["id"])
+            self.tables["tokens_history"][token["id"]] = {**token, "archived_at": _now()}
+        return {"skipped": False, "moved": len(finished)}
+
+_EMBED = re.compile(r"(\w+)\(([^)]*)\)")
+
+class FakeQuery:
+    def __init__(self, db: FakeDB, table: str):
+        self.db = db
+        self.table = table
+        self.op = "select"
+        self.columns = "*"
+        self.payload: Any = None
+        self.filters: List[tuple] = []
+        self.order_by: List[tuple] = []
+        self.limit_n: Optional[int] = None
+        self.single_mode: Optional[str] = None
+        self.count_mode: Optional[str] = None
+        self.head = False
+
+    # Operations
+    def select(self, columns: str = "*", count: Optional[str] = None, head: bool = False) -> "FakeQuery":
+        if self.op == "select":
+            self.columns = columns
+        self.count_mode = count
+        self.head = head
+        return self
+
+    def insert(self, data) -> "FakeQuery":
+        self.op, self.payload = "insert", data
+        return self
+
+    def upsert(self, data, **kwargs) -> "FakeQuery":
+        self.op, self.payload = "upsert", data
+        return self
+
+    def update(self, data: dict) -> "FakeQuery":
+        self.op, self.payload = "update", data
+        return self
+
+    def delete(self) -> "FakeQuery":
+        self.op = "delete"
+        return self
+
+    # Filters
+    def eq(self, col, value): self.filters.append((col, lambda v, x=value: v is not None and str(v) == str(x))); return self
+    def neq(self, col, value): self.filters.append((col, lambda v, x=value: str(v) != str(x))); return self
+    def gt(self, col, value): self.filters.append((col, lambda v, x=value: v is not None and v > x)); return self
+    def gte(self, col, value): self.filters.append((col, lambda v, x=value: v is not None and v >= x)); return self
+    def lt(self, col, value): self.filters.append((col, lambda v, x=value: v is not None and v < x)); return self
+    def lte(self, col, value): self.filters.append((col, lambda v, x=value: v is not None and v <= x)); return self
+    def in_(self, col, values): self.filters.append((col, lambda v, xs={str(x) for x in values}: str(v) in xs)); return self
+    def is_(self, col, value): self.filters.append((col, lambda v: v is None if value == "null" else v is value)); return self
+
+    def order(self, col: str, desc: bool = False) -> "FakeQuery":
+        self.order_by.append((col, desc))
+        return self
+
+    def limit(self, n: int) -> "FakeQuery":
+        self.limit_n = n
+        return self
+
+    def range(self, start: int, end: int) -> "FakeQuery":
+        self.offset, self.limit_n = start, end - start + 1
+        return self
+
+    def single(self) -> "FakeQuery":
+        self.single_mode = "single"
+        return self
+
+    def maybe_single(self) -> "FakeQuery":
+        self.single_mode = "maybe"
+        return self
+
+    # Execution
+    def _matches(self) -> List[dict]:
+        if self.table == "tokens_all": # view: live + archived tokens
+            rows = [{**r, "archived_at": None} for r in self.db.tables["tokens"].values()] + list(self.db.tables["tokens_history"].values())
+        else:
+            rows = self.db.tables[self.table].values()
+        return [r for r in rows if all(pred(r.get(col)) for col, pred in self.filters)]
+
+    def _project(self, row: dict) -> dict:
+        if self.columns.strip() == "*":
+            return dict(row)
+        out = {}
+        embeds = _EMBED.findall(self.columns)
+        plain = _EMBED.sub("", self.columns)
+        for col in (c.strip() for c in plain.split(",")):
+            if col == "*":
+                out.update(row)
+            elif col:
+                out[col] = row.get(col)
+        for name, cols in embeds:
+            fk = row.get(name.rstrip("s") + "_id")
+            target = self.db.tables.get(name, {}).get(fk)
+            out[name] = None if target is None else {c.strip(): target.get(c.strip()) for c in cols.split(",")}
+        return out
+
+    async def execute(self) -> Optional[FakeResponse]:
+        await self.db.round_trip()
+        if self.op == "insert" or self.op == "upsert":
+            rows = self.payload if isinstance(self.payload, list) else [self.payload]
+            return FakeResponse([dict(self.db._insert(self.table, r)) for r in rows])
+        rows = self._matches()
+        if self.op == "update":
+            result = []
+            for r in rows:
+                if self.table == "tokens":
+                    result.append(self.db._update_token(r, **self.payload))
+                else:
+                    r.update(self.payload)
+                    result.append(dict(r))
+            return FakeResponse(result)
+        if self.op == "delete":
+            for r in rows:
+                del self.db.tables[self.table][r.get("id", r.get("service_id"))]
+                if self.table == "tokens":
+                    self.db.tokens_by_service.get(r["service_id"], set()).discard(r["id"])
+                    self.db._apply_stats(r["state"], {**r, "state": None})
+            return FakeResponse([dict(r) for r in rows])
+        for col, desc in reversed(self.order_by):
+            rows.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+        count = len(rows) if self.count_mode else None
+        rows = rows[getattr(self, "offset", 0):]
+        if self.limit_n is not None:
+            rows = rows[:self.limit_n]
+        data = [] if self.head else [self._project(r) for r in rows]
+        if self.single_mode:
+            if len(data) != 1:
+                if self.single_mode == "maybe" and not data:
+                    return None
+                raise FakeAPIError("JSON object requested, multiple (or no) rows returned")
+            return FakeResponse(data[0], count)
+        return FakeResponse(data, count)
+
+class FakeRPC:
+    def __init__(self, db: FakeDB, fn: str, params: dict):
+        self.db = db
+        self.fn = fn
+        self.params = params
+
+    async def execute(self) -> FakeResponse:
+        await self.db.round_trip()
+        handler = getattr(self.db, f"rpc_{self.fn}", None)
+        if handler is None:
+            raise FakeAPIError(f"Could not find the function public.{self.fn}")
+        self.db.actor = self.fn
+        try:
+            return FakeResponse(handler(**self.params))
+        finally:
+            self.db.actor = "tokens"
@@ -0,0 +1,205 @@
+"""
+Offline load test: drives the FastAPI app in-process against scripts/fake_supabase.py
+and reports p50/p99 latency and requests/s per route.
+
+    python scripts/loadtest.py --users 500 --counters 4 --latency-ms 3
+    python scripts/loadtest.py --json baseline.json
+    python scripts/loadtest.py --compare baseline.json --tolerance 0.25   # exit 1 on regression
+    python scripts/loadtest.py --store memory   # queue state in InMemoryQueueStore instead of the RPCs
+    python scripts/loadtest.py --dispatch   # counters get their first token from one dispatch instead of call-next
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+
+# Make `app` importable and keep the app away from any real project
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(script_dir, '..'))
+sys.path.insert(0, script_dir)
+os.environ.setdefault("SUPABASE_URL", "http://fake-supabase.local")
+os.environ.setdefault("SUPABASE_KEY", "fake-service-role-key")
+os.environ["SWEEPER_ENABLED"] = "false"
+
+import httpx
+from app.main import app
+from app.core.config import settings
+from app.core.database import get_supabase
+from fake_supabase import FakeDB
+
+API = "/api/v1"
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.wall = defaultdict(float)
+
+    async def call(self, client: httpx.AsyncClient, label: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        res = await client.request(method, url, **kwargs)
+        self.samples[label].append(time.perf_counter() - started)
+        if res.status_code >= 400:
+            self.errors[label] += 1
+        return res
+
+    def report(self) -> dict:
+        out = {}
+        for label, values in self.samples.items():
+            ordered = sorted(values)
+            pct = lambda p: ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+            out[label] = {
+                "requests": len(values),
+                "errors": self.errors[label],
+                "p50_ms": round(pct(50), 2),
+                "p99_ms": round(pct(99), 2),
+                "rps": round(len(values) / self.wall[label], 1) if self.wall[label] else None,
+            }
+        return out
+
+async def gather_limited(limit: int, coros):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
+
+async def timed(recorder: Recorder, label: str, coro):
+    started = time.perf_counter()
+    result = await coro
+    recorder.wall[label] += time.perf_counter() - started
+    return result
+
+async def scenario_join_storm(client, recorder, db, service, args):
+    """Opening time: every user joins at once."""
+    async def join(i):
+        res = await recorder.call(client, "POST /queue/join", "POST", f"{API}/queue/join", json={
+            "service_id": service["id"], "user_identifier": f"user-{i}",
+            "user_lat": service["latitude"], "user_long": service["longitude"],
+        })
+        return res.json() if res.status_code == 200 else None
+
+    tokens = await timed(recorder, "POST /queue/join", gather_limited(args.concurrency, [join(i) for i in range(args.users)]))
+    return [t for t in tokens if t]
+
+async def scenario_presence_waves(client, recorder, db, service, tokens, args):
+    """Location pings: a few single-token waves, then the same load as batches."""
+    def ping(token, near: bool):
+        offset = random.uniform(0, 0.0005 if near else 0.01)
+        return {"token_id": token["id"], "lat": service["latitude"] + offset, "long": service["longitude"]}
+
+    for wave in range(args.waves):
+        near = wave == args.waves - 1 # last wave brings everyone in range
+        coros = [recorder.call(client, "POST /presence/verify", "POST", f"{API}/presence/verify", json=ping(t, near)) for t in tokens]
+        await timed(recorder, "POST /presence/verify", gather_limited(args.concurrency, coros))
+
+    for wave in range(args.waves):
+        batches = [tokens[i:i + args.batch_size] for i in range(0, len(tokens), args.batch_size)]
+        coros = [
+            recorder.call(client, "POST /presence/verify-batch", "POST", f"{API}/presence/verify-batch",
+                          json={"pings": [ping(t, True) for t in batch]})
+            for batch in batches
+        ]
+        await timed(recorder, "POST /presence/verify-batch", gather_limited(args.concurrency, coros))
+
+async def scenario_counter_cycles(client, recorder, db, service, counters, args):
+    """Each counter loops call-next (or one dispatch for all) -> entry -> exit until the queue is empty."""
+    first = {}
+    if args.dispatch:
+        # The dashboard lists the counters first (also registers them with the memory engine)
+        await client.get(f"{API}/admin/counters/{service['id']}")
+        res = await recorder.call(client, "POST /admin/dispatch/{id}", "POST", f"{API}/admin/dispatch/{service['id']}")
+        first = {t["counter_id"]: t for t in res.json().get("assigned", [])} if res.status_code == 200 else {}
+
+    async def run_counter(counter):
+        token = first.get(counter["id"])
+        if not args.dispatch:
+            res = await recorder.call(client, "POST /admin/call-next", "POST", f"{API}/admin/call-next",
+                                      json={"service_id": service["id"], "counter_id": counter["id"]})
+            token = res.json().get("token") if res.status_code == 200 else None
+        while token:
+            await recorder.call(client, "POST /flow/entry", "POST", f"{API}/flow/entry",
+                                json={"token_id": token["id"], "counter_id": counter["id"]})
+            res = await recorder.call(client, "POST /flow/exit", "POST", f"{API}/flow/exit",
+                                      json={"token_id": token["id"], "exit_code": "bench"})
+            token = res.json().get("next_token") if res.status_code == 200 else None
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_counter(c) for c in counters))
+    elapsed = time.perf_counter() - started
+    for label in ("POST /admin/call-next", "POST /flow/entry", "POST /flow/exit"):
+        recorder.wall[label] += elapsed
+
+async def scenario_reads(client, recorder, db, service, args):
+    """Dashboards polling the queue."""
+    coros = [recorder.call(client, "GET /queue/{id}/snapshot", "GET", f"{API}/queue/{service['id']}/snapshot") for _ in range(args.users // 5 or 1)]
+    await timed(recorder, "GET /queue/{id}/snapshot", gather_limited(args.concurrency, coros))
+
+async def main(args) -> int:
+    random.seed(args.seed)
+    settings.QUEUE_STORE = args.store
+    settings.ADMIN_AUTH_DISABLED = True # the simulated clients send no access tokens
+    db = FakeDB(latency_ms=args.latency_ms)
+    service = db.add_service()
+    counters = [db.add_counter(service["id"], f"Counter {i + 1}") for i in range(args.counters)]
+    app.dependency_overrides[get_supabase] = lambda: db
+    recorder = Recorder()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        started = time.perf_counter()
+        tokens = await scenario_join_storm(client, recorder, db, service, args)
+        await scenario_presence_waves(client, recorder, db, service, tokens, args)
+        await scenario_reads(client, recorder, db, service, args)
+        await scenario_counter_cycles(client, recorder, db, service, counters, args)
+        total = time.perf_counter() - started
+
+    report = recorder.report()
+    print(f"=== Load test: {args.users} users, {args.counters} counters, {args.latency_ms} ms simulated DB latency, {args.store} queue store ===")
+    print(f"{'route':<30} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+    for label, r in report.items():
+        print(f"{label:<30} {r['requests']:>9} {r['errors']:>7} {r['p50_ms']:>9} {r['p99_ms']:>9} {r['rps'] or '-':>9}")
+    print(f"\nTotal: {sum(r['requests'] for r in report.values())} requests in {total:.2f}s, {db.round_trips} DB round trips")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to {args.json}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = []
+        for label, r in report.items():
+            base = baseline.get(label)
+            if base and r["p99_ms"] > base["p99_ms"] * (1 + args.tolerance):
+                regressions.append(f"{label}: p99 {base['p99_ms']} -> {r['p99_ms']} ms")
+        if regressions:
+            print("\n❌ REGRESSIONS")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("\n✅ No p99 regressions against baseline")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--counters", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="simulated DB round-trip latency")
+    parser.add_argument("--waves", type=int, default=2, help="presence ping waves")
+    parser.add_argument("--batch-size", type=int, default=50, help="pings per /presence/verify-batch call")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--dispatch", action="store_true", help="start counters with POST /admin/dispatch instead of call-next")
+    parser.add_argument("--store", choices=["supabase", "memory"], default="supabase", help="queue engine (QUEUE_STORE)")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", help="baseline report to compare p99 against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p99 increase vs baseline")
+    sys.exit(asyncio.run(main(parser.parse_args())))
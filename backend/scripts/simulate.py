@@ -0,0 +1,131 @@
+"""
+What-if simulator: replays a service's recorded demand (or a synthetic one) under
+different counter counts, timeouts and presence behaviour, and reports wait
+percentiles and counter utilization per scenario. Runs on all cores.
+
+    python scripts/simulate.py --arrivals-per-hour 60 --hours 8 --counters 1,2,3
+    python scripts/simulate.py --service-id <uuid> --since 2026-01-01 --counters 2,3,4
+    python scripts/simulate.py --tokens tokens.json --replay --called-timeout 120,300
+    python scripts/simulate.py --arrivals-per-hour 90 --confirm-scale 0.5,1,2 --replications 5000 --json out.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+from datetime import datetime
+
+# Make `app` importable when run as `python scripts/simulate.py`
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(script_dir, '..'))
+
+from dotenv import load_dotenv
+load_dotenv(os.path.join(script_dir, '..', '.env'))
+os.environ.setdefault("SUPABASE_URL", "http://unused.local")
+os.environ.setdefault("SUPABASE_KEY", "unused")
+
+from app.simulation.engine import Scenario
+from app.simulation.model import fit_model, synthetic_model
+from app.simulation.runner import run_scenarios
+
+HISTORY_LIMIT = 100000
+
+async def fetch_tokens(service_id: str, since, until) -> list:
+    from supabase import acreate_client
+    from app.logic.queue_store import SupabaseQueueStore
+    supabase = await acreate_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    return await SupabaseQueueStore(supabase).history(service_id, since, until, HISTORY_LIMIT)
+
+def load_model(args):
+    if args.service_id or args.tokens:
+        if args.service_id:
+            since = datetime.fromisoformat(args.since) if args.since else None
+            until = datetime.fromisoformat(args.until) if args.until else None
+            tokens = asyncio.run(fetch_tokens(args.service_id, since, until))
+        else:
+            with open(args.tokens) as f:
+                tokens = json.load(f)
+        return fit_model(tokens, bucket_seconds=args.bucket_minutes * 60)
+    return synthetic_model(
+        args.arrivals_per_hour, args.hours,
+        service_seconds=args.service_seconds,
+        confirm_seconds=args.confirm_seconds,
+        no_show_probability=args.no_show,
+        bucket_seconds=args.bucket_minutes * 60,
+        seed=args.seed,
+    )
+
+def floats(value: str):
+    return [float(v) for v in value.split(",")] if value else [None]
+
+def build_scenarios(args):
+    scenarios = []
+    grid = itertools.product(
+        [int(c) for c in args.counters.split(",")],
+        floats(args.called_timeout),
+        floats(args.waiting_timeout),
+        floats(args.confirm_scale),
+    )
+    for counters, called, waiting, confirm in grid:
+        overrides = {"called_timeout": called, "waiting_timeout": waiting, "confirm_delay_scale": confirm}
+        overrides = {k: v for k, v in overrides.items() if v is not None}
+        name = " ".join([f"counters={counters}"] + [f"{k}={v:g}" for k, v in overrides.items()])
+        scenarios.append(Scenario(name=name, counters=counters, replay=args.replay,
+                                  arrival_scale=args.arrival_scale, **overrides))
+    return scenarios
+
+def minutes(seconds) -> str:
+    return "-" if seconds is None else f"{seconds / 60:.1f}"
+
+def main(args) -> int:
+    model = load_model(args)
+    scenarios = build_scenarios(args)
+    source = f"{model.tokens} tokens" if model.tokens else "synthetic demand"
+    print(f"=== {len(scenarios)} scenarios x {args.replications} runs, {source}, "
+          f"{model.horizon_seconds / 3600:.1f} h, no-show {model.no_show_probability:.1%} ===")
+
+    started = time.perf_counter()
+    results = run_scenarios(model, scenarios, args.replications, workers=args.workers, seed=args.seed)
+    elapsed = time.perf_counter() - started
+
+    print(f"  {'scenario':<44} {'p50':>6} {'p90':>6} {'p99':>6} {'util':>6} {'served':>7} {'missed':>7} {'expired':>8}  (waits in min)")
+    for r in results:
+        print(f"  {r['scenario']:<44} {minutes(r['wait_p50']):>6} {minutes(r['wait_p90']):>6} {minutes(r['wait_p99']):>6} "
+              f"{r['utilization']:>6.1%} {r['served']:>7.1f} {r['no_show']:>7.1f} {r['expired']:>8.1f}")
+    runs = len(scenarios) * args.replications
+    print(f"  {runs} runs in {elapsed:.2f}s ({runs / elapsed:.0f} runs/s)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"model": model.model_dump(exclude={"arrival_offsets", "confirm_delays", "walk_up_delays", "service_times"}),
+                       "results": results}, f, indent=2)
+        print(f"  Report written to {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_argument_group("demand (default: synthetic)")
+    source.add_argument("--service-id", help="fit to this service's live and archived tokens")
+    source.add_argument("--since", help="ISO date/time, with --service-id")
+    source.add_argument("--until", help="ISO date/time, with --service-id")
+    source.add_argument("--tokens", help="fit to token rows in this JSON file")
+    source.add_argument("--replay", action="store_true", help="replay recorded arrival times instead of sampling them")
+    source.add_argument("--arrivals-per-hour", type=float, default=60.0)
+    source.add_argument("--hours", type=float, default=8.0)
+    source.add_argument("--service-seconds", type=float, default=300.0, help="mean service time")
+    source.add_argument("--confirm-seconds", type=float, default=600.0, help="mean time from join to presence confirmation")
+    source.add_argument("--no-show", type=float, default=0.05, help="share of called tokens that never show up")
+    source.add_argument("--bucket-minutes", type=float, default=15.0, help="arrival rate resolution")
+    grid = parser.add_argument_group("scenarios (comma-separated values are combined)")
+    grid.add_argument("--counters", default="1,2,3")
+    grid.add_argument("--called-timeout", help="seconds before a called no-show is MISSED")
+    grid.add_argument("--waiting-timeout", help="seconds before an unconfirmed token EXPIRES")
+    grid.add_argument("--confirm-scale", help="confirmation delay multiplier (< 1 ~ larger presence radius)")
+    grid.add_argument("--arrival-scale", type=float, default=1.0, help="demand multiplier")
+    parser.add_argument("--replications", type=int, default=1000)
+    parser.add_argument("--workers", type=int, help="processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="write the results to this file")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+from collections import Counter
+from dotenv import load_dotenv
+from supabase import acreate_client
+
+# Load environment variables
+script_dir = os.path.dirname(os.path.abspath(__file__))
+env_path = os.path.join(script_dir, '..', '.env')
+load_dotenv(env_path)
+
+# Make `app` importable for the state machine
+sys.path.insert(0, os.path.join(script_dir, '..'))
+from app.logic.state_machine import can_transition
+from app.models.schemas import TokenState
+
+URL = os.getenv("SUPABASE_URL")
+KEY = os.getenv("SUPABASE_KEY") # Service role key
+
+MODES = ("call", "bulk", "sweep")
+
+async def main(service_id: str, tokens_count: int, counters_count: int, mode: str):
+    print(f"=== STRESS: {counters_count} counters calling {tokens_count} tokens on service {service_id} ({mode}) ===")
+    supabase = await acreate_client(URL, KEY)
+    run_id = uuid.uuid4().hex[:8]
+
+    # 1. Setup: confirmed tokens + temporary counters
+    token_ids = []
+    for i in range(tokens_count):
+        res = await supabase.rpc('issue_token', {'p_service_id': service_id, 'p_user_id': f"stress-{run_id}-{i}"}).execute()
+        await supabase.rpc('confirm_token', {'p_token_id': res.data['id']}).execute()
+        token_ids.append(res.data['id'])
+
+    counters = await supabase.table("counters").insert([
+        {"service_id": service_id, "name": f"Stress {run_id} #{i + 1}"} for i in range(counters_count)
+    ]).execute()
+    counter_ids = [c['id'] for c in counters.data]
+    print(f"  Setup: {len(token_ids)} confirmed tokens, {len(counter_ids)} counters")
+
+    # 2. Every counter keeps calling until the queue is empty; in bulk mode an admin
+    # cancels random batches at the same time, in sweep mode the sweeper marks every
+    # called token MISSED as soon as it is called (deadlocks surface as errors)
+    assignments = []
+    errors = []
+    cancelled = set()
+    drained = asyncio.Event()
+
+    async def drain(counter_id: str):
+        while True:
+            try:
+                res = await supabase.rpc('call_next_token', {'p_service_id': service_id, 'p_counter_id': counter_id}).execute()
+            except Exception as e:
+                errors.append(e)
+                return
+            if not res.data:
+                return
+            assignments.append((res.data['id'], counter_id))
+
+    async def bulk_cancel():
+        allowed_from = [s.value for s in TokenState if can_transition(s, TokenState.MISSED)]
+        while not drained.is_set():
+            batch = random.sample(token_ids, min(10, len(token_ids)))
+            try:
+                res = await supabase.rpc('bulk_transition', {
+                    'p_to_state': TokenState.MISSED.value, 'p_allowed_from': allowed_from, 'p_token_ids': batch,
+                }).execute()
+            except Exception as e:
+                errors.append(e)
+                return
+            cancelled.update(r['token_id'] for r in res.data if r['outcome'] == 'applied')
+
+    async def sweep():
+        while not drained.is_set():
+            try:
+                await supabase.rpc('sweep_stale_tokens', {
+                    'p_waiting_timeout_seconds': 86400, 'p_called_timeout_seconds': 0,
+                }).execute()
+            except Exception as e:
+                errors.append(e)
+                return
+            await asyncio.sleep(0)
+
+    async def drain_all():
+        await asyncio.gather(*(drain(c) for c in counter_ids))
+        drained.set()
+
+    started = time.perf_counter()
+    contenders = {"call": [], "bulk": [bulk_cancel], "sweep": [sweep]}[mode]
+    await asyncio.gather(drain_all(), *(c() for c in contenders))
+    elapsed = time.perf_counter() - started
+
+    ours = [a for a in assignments if a[0] in set(token_ids)]
+    doubles = [t for t, n in Counter(t for t, _ in ours).items() if n > 1]
+    print(f"  Calls:   {len(assignments)} in {elapsed:.2f}s ({len(assignments) / elapsed:.0f} calls/s)")
+    if mode == "bulk":
+        print(f"  Cancelled: {len(cancelled)}")
+    print(f"  Errors:  {len(errors)}")
+    for e in errors[:3]:
+        print(f"    {e}")
+    print(f"  Double assignments: {len(doubles)}")
+    print(f"  Unassigned tokens:  {len(set(token_ids) - {t for t, _ in ours} - cancelled)}")
+
+    # 3. Cleanup
+    await supabase.table("counters").update({"current_token_id": None}).in_("id", counter_ids).execute()
+    await supabase.table("tokens").delete().in_("id", token_ids).execute()
+    await supabase.table("counters").delete().in_("id", counter_ids).execute()
+    print("  Cleaned up.")
+
+    if errors or doubles:
+        print("\n❌ FAILED")
+        sys.exit(1)
+    print("\n✅ PASSED")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python scripts/stress_call_next.py <service_id> [tokens=200] [counters=8] [mode={'|'.join(MODES)}]")
+        sys.exit(1)
+    asyncio.run(main(
+        sys.argv[1],
+        int(sys.argv[2]) if len(sys.argv) > 2 else 200,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 8,
+        sys.argv[4] if len(sys.argv) > 4 else "call",
+    ))
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import uuid
+import asyncio
+from dotenv import load_dotenv
+from supabase import acreate_client
+
+# Load environment variables
+script_dir = os.path.dirname(os.path.abspath(__file__))
+env_path = os.path.join(script_dir, '..', '.env')
+load_dotenv(env_path)
+
+URL = os.getenv("SUPABASE_URL")
+KEY = os.getenv("SUPABASE_KEY") # Must be the service role key (issue_token trusts p_user_id only for it)
+
+async def main(service_id: str, count: int):
+    print(f"=== STRESS: {count} simultaneous joins on service {service_id} ===")
+    supabase = await acreate_client(URL, KEY)
+    run_id = uuid.uuid4().hex[:8]
+    users = [f"stress-{run_id}-{i}" for i in range(count)]
+
+    async def join(user_id: str):
+        try:
+            res = await supabase.rpc('issue_token', {'p_service_id': service_id, 'p_user_id': user_id}).execute()
+            return res.data
+        except Exception as e:
+            return e
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(join(u) for u in users))
+    elapsed = time.perf_counter() - started
+
+    tokens = [r for r in results if isinstance(r, dict)]
+    errors = [r for r in results if not isinstance(r, dict)]
+    numbers = sorted(t['token_number'] for t in tokens)
+
+    print(f"  Issued:  {len(tokens)} in {elapsed:.2f}s ({len(tokens) / elapsed:.0f} joins/s)")
+    print(f"  Errors:  {len(errors)}")
+    for e in errors[:5]:
+        print(f"    - {e}")
+
+    duplicates = len(numbers) - len(set(numbers))
+    contiguous = numbers == list(range(numbers[0], numbers[0] + len(numbers))) if numbers else True
+    print(f"  Duplicate numbers: {duplicates}")
+    print(f"  Contiguous range:  {contiguous} ({numbers[0] if numbers else '-'}..{numbers[-1] if numbers else '-'})")
+
+    # Cleanup: remove the synthetic tokens
+    if tokens:
+        await supabase.table("tokens").delete().in_("id", [t['id'] for t in tokens]).execute()
+        print(f"  Cleaned up {len(tokens)} tokens.")
+
+    if errors or duplicates or not contiguous:
+        print("\n❌ FAILED")
+        sys.exit(1)
+    print("\n✅ PASSED")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python scripts/stress_join.py <service_id> [count=300]")
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 300))
@@ -15,3 +15,12 @@ export const supabase = createClient(supabaseUrl, supabaseKey, {
         detectSessionInUrl: true
     }
 });
+
+// /api/v1/admin routes require the signed-in admin's access token
+export async function adminHeaders(): Promise<Record<string, string>> {
+    const { data: { session } } = await supabase.auth.getSession();
+    return {
+        'Content-Type': 'application/json',
+        ...(session ? { Authorization: `Bearer ${session.access_token}` } : {}),
+    };
+}
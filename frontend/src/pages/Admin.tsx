@@ -1,7 +1,7 @@
 import React, { useEffect, useState } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
-import { supabase } from '../lib/supabase';
+import { supabase, adminHeaders } from '../lib/supabase';
 import type { Service, Token } from '../types';
 import { motion, AnimatePresence } from 'framer-motion';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
@@ -66,7 +66,7 @@ const Admin: React.FC = () => {
                 try {
                     const counterRes = await fetch('http://localhost:8000/api/v1/admin/ensure-counter', {
                         method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
+                        headers: await adminHeaders(),
                         body: JSON.stringify({ service_id: serviceId })
                     });
                     const counterJson = await counterRes.json();
@@ -121,7 +121,7 @@ const Admin: React.FC = () => {
         try {
             const res = await fetch('http://localhost:8000/api/v1/admin/call-next', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: await adminHeaders(),
                 body: JSON.stringify({ service_id: serviceId, counter_id: counterId })
             });
             const json = await res.json();
@@ -137,7 +137,7 @@ const Admin: React.FC = () => {
         if (!confirm('Cancel this token using standard JS confirm?')) return;
         await fetch('http://localhost:8000/api/v1/admin/cancel-token', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: await adminHeaders(),
             body: JSON.stringify({ token_id: id })
         });
     };
@@ -150,7 +150,7 @@ const Admin: React.FC = () => {
         try {
             const res = await fetch('http://localhost:8000/api/v1/admin/toggle-service', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: await adminHeaders(),
                 body: JSON.stringify({ service_id: serviceId, status: newStatus })
             });
 
@@ -187,7 +187,7 @@ const Admin: React.FC = () => {
             // Assume scannedText is the token UUID
             const res = await fetch('http://localhost:8000/api/v1/admin/complete-token', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: await adminHeaders(),
                 body: JSON.stringify({ token_id: scannedText })
             });
 
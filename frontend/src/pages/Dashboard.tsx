@@ -1,7 +1,7 @@
 import React, { useEffect, useState } from 'react';
 import { useAuth } from '../context/AuthContext';
 import { useNavigate } from 'react-router-dom';
-import { supabase } from '../lib/supabase';
+import { supabase, adminHeaders } from '../lib/supabase';
 import { Card, CardContent } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
@@ -224,7 +224,7 @@ const Dashboard: React.FC = () => {
         try {
             const res = await fetch('http://localhost:8000/api/v1/admin/claim-orphans', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: await adminHeaders(),
                 body: JSON.stringify({ organization_id: orgId })
             });
             const json = await res.json();